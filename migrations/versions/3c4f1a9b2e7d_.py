@@ -0,0 +1,53 @@
+"""metrics as jsonb
+
+Revision ID: 3c4f1a9b2e7d
+Revises: 29bf27973b9e
+Create Date: 2026-10-16 19:45:12.031844
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c4f1a9b2e7d'
+down_revision = '29bf27973b9e'
+
+from alembic import op
+import sqlalchemy as sa
+
+from newslynx.init import (
+    load_sql, load_metric_indexes, drop_metric_indexes, METRIC_INDEX_TABLES)
+
+METRIC_TABLES = [
+    'content_metric_timeseries',
+    'content_metric_summary',
+    'org_metric_timeseries',
+    'org_metric_summary'
+]
+
+
+def upgrade():
+    for table in METRIC_TABLES:
+        op.execute(
+            "ALTER TABLE {0} ALTER COLUMN metrics TYPE jsonb USING metrics::jsonb"
+            .format(table))
+    for table in METRIC_INDEX_TABLES:
+        op.create_index(
+            '{}_metrics_idx'.format(table), table, ['metrics'],
+            postgresql_using='gin')
+
+    # json_merge + the upsert functions now operate on jsonb.
+    for sql in load_sql():
+        op.execute(sql)
+    for sql in load_metric_indexes():
+        op.execute(sql)
+
+
+def downgrade():
+    # the expression indexes read metrics as jsonb.
+    for sql in drop_metric_indexes():
+        op.execute(sql)
+    for table in METRIC_INDEX_TABLES:
+        op.drop_index('{}_metrics_idx'.format(table), table_name=table)
+    for table in METRIC_TABLES:
+        op.execute(
+            "ALTER TABLE {0} ALTER COLUMN metrics TYPE json USING metrics::json"
+            .format(table))
@@ -0,0 +1,87 @@
+"""monthly content_metric_timeseries partitions
+
+Revision ID: 4a8d6c2f0b15
+Revises: 3c4f1a9b2e7d
+Create Date: 2026-10-16 20:12:40.518302
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a8d6c2f0b15'
+down_revision = '3c4f1a9b2e7d'
+
+from alembic import op
+import sqlalchemy as sa
+
+from newslynx.core import settings
+from newslynx.lib import dates
+from newslynx.init import load_sql, load_metric_indexes
+from newslynx.models import ContentMetricTimeseries
+from newslynx.tasks import partition_metric
+
+OLD_TABLE = 'content_metric_timeseries_unpartitioned'
+
+
+def upgrade():
+    # move the old table (and its index names) out of the way.
+    op.rename_table('content_metric_timeseries', OLD_TABLE)
+    op.execute(
+        """DO $$
+           DECLARE r record;
+           BEGIN
+             FOR r IN SELECT indexname FROM pg_indexes
+                      WHERE tablename = '{0}'
+                      AND indexname <> 'content_metric_timeseries_pkey'
+             LOOP
+               EXECUTE format('DROP INDEX %I', r.indexname);
+             END LOOP;
+           END $$;
+           ALTER TABLE {0} DROP CONSTRAINT content_metric_timeseries_pkey;
+        """.format(OLD_TABLE))
+
+    # the partitioned table, its partitions and helpers.
+    ContentMetricTimeseries.__table__.create(op.get_bind())
+    for sql in load_sql():
+        op.execute(sql)
+    op.execute(partition_metric.create_default_query())
+    op.execute(
+        """SELECT create_content_metric_timeseries_partition(m)
+           FROM generate_series(
+             (SELECT date_trunc('month', min(datetime)) FROM {0}),
+             (SELECT max(datetime) FROM {0}),
+             interval '1 month') m
+        """.format(OLD_TABLE))
+    now = dates.now()
+    for offset in xrange(settings.METRICS_PARTITION_PREMAKE_MONTHS + 1):
+        op.execute(partition_metric.create_query(
+            partition_metric.month_start(now, offset)))
+
+    op.execute(
+        """INSERT INTO content_metric_timeseries
+             (org_id, content_item_id, datetime, metrics, updated)
+           SELECT org_id, content_item_id, datetime, metrics, updated
+           FROM {}
+        """.format(OLD_TABLE))
+    op.drop_table(OLD_TABLE)
+    for sql in load_metric_indexes():
+        op.execute(sql)
+
+
+def downgrade():
+    op.rename_table('content_metric_timeseries', OLD_TABLE)
+    op.execute(
+        """CREATE TABLE content_metric_timeseries
+             (LIKE {0} INCLUDING DEFAULTS);
+           INSERT INTO content_metric_timeseries SELECT * FROM {0};
+           DROP TABLE {0} CASCADE;
+           ALTER TABLE content_metric_timeseries
+             ADD PRIMARY KEY (org_id, content_item_id, datetime);
+        """.format(OLD_TABLE))
+    for col in ['org_id', 'content_item_id']:
+        op.create_index('ix_content_metric_timeseries_{}'.format(col),
+                        'content_metric_timeseries', [col])
+    op.create_index('content_metric_timeseries_metrics_idx',
+                    'content_metric_timeseries', ['metrics'],
+                    postgresql_using='gin')
+    for sql in load_metric_indexes():
+        op.execute(sql)
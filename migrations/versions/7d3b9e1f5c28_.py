@@ -0,0 +1,49 @@
+"""content_metric_summary.updated
+
+Revision ID: 7d3b9e1f5c28
+Revises: 4a8d6c2f0b15
+Create Date: 2026-10-16 23:05:37.214906
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d3b9e1f5c28'
+down_revision = '4a8d6c2f0b15'
+
+from alembic import op
+import sqlalchemy as sa
+
+from newslynx.init import load_sql
+
+
+def upgrade():
+    op.add_column('content_metric_summary',
+                  sa.Column('updated', sa.DateTime(timezone=True)))
+    op.execute("UPDATE content_metric_summary SET updated = current_timestamp")
+    op.create_index('content_metric_summary_updated_idx',
+                    'content_metric_summary', ['org_id', 'updated'])
+
+    # upsert_content_metric_summary now sets it.
+    for sql in load_sql():
+        op.execute(sql)
+
+
+def downgrade():
+    op.drop_index('content_metric_summary_updated_idx',
+                  table_name='content_metric_summary')
+    op.execute(
+        """CREATE OR REPLACE FUNCTION "upsert_content_metric_summary"(
+               "_org_id" INT,
+               "_content_item_id" INT,
+               "_metrics" TEXT
+           )
+           RETURNS VOID AS
+           $$
+               INSERT INTO content_metric_summary (org_id, content_item_id, metrics)
+               VALUES ("_org_id", "_content_item_id", "_metrics"::jsonb)
+               ON CONFLICT (org_id, content_item_id) DO UPDATE
+               SET metrics = COALESCE(content_metric_summary.metrics, '{}'::jsonb) || EXCLUDED.metrics;
+           $$
+           LANGUAGE sql;
+        """)
+    op.drop_column('content_metric_summary', 'updated')
@@ -29,7 +29,8 @@ def setup(parser):
     from newslynx.cli import (
         api, db, version, dev, init,
         debug, cron, echo, sc_create,
-        sc_docs, sc_run, sc_sync, sc_install
+        sc_docs, sc_run, sc_sync, sc_install,
+        partitions, cache
     )
     MODULES = [
         api,
@@ -44,7 +45,9 @@ def setup(parser):
         sc_create,
         sc_docs,
         sc_sync,
-        sc_install
+        sc_install,
+        partitions,
+        cache
     ]
     subcommands = {}
     for module in MODULES:
@@ -0,0 +1,63 @@
+"""
+Flush, count and measure cached keys without blocking redis.
+"""
+import sys
+import logging
+
+log = logging.getLogger(__name__)
+
+CACHES = ['url', 'extract', 'thumbnail', 'comparison', 'merlynne', 'page',
+          'url-rule']
+
+
+def setup(parser):
+    """
+    Install this parser.
+    """
+    cache_parser = parser.add_parser(
+        "cache", help="Flush, count or report the memory of cached keys.")
+    cache_parser.add_argument(
+        'task', type=str, choices=['flush', 'count', 'memory'],
+        help='The cache task to run.')
+    cache_parser.add_argument(
+        '-c', '--caches', dest='caches', type=str, nargs='+',
+        choices=CACHES, default=CACHES,
+        help='The caches to run the task on.')
+    return 'cache', run
+
+
+def prefixes():
+    """
+    Cache name => key prefix.
+    """
+    from newslynx.core import settings
+
+    return {
+        'url': settings.URL_CACHE_PREFIX,
+        'extract': settings.EXTRACT_CACHE_PREFIX,
+        'thumbnail': settings.THUMBNAIL_CACHE_PREFIX,
+        'comparison': settings.COMPARISON_CACHE_PREFIX,
+        'merlynne': settings.MERLYNNE_KWARGS_PREFIX,
+        'page': settings.NETWORK_PAGE_CACHE_PREFIX,
+        'url-rule': settings.URL_RULE_PREFIX
+    }
+
+
+def run(opts, **kwargs):
+    from newslynx.lib import serialize
+    from newslynx.models import cache
+
+    output = {}
+    for name in opts.caches:
+        prefix = prefixes()[name]
+        if opts.task == 'flush':
+            n = cache.flush_prefix(prefix)
+            log.info('Flushed {} keys from {}.'.format(n, prefix))
+            output[name] = {'prefix': prefix, 'deleted': n}
+        elif opts.task == 'count':
+            output[name] = {'prefix': prefix,
+                            'keys': cache.count_prefix(prefix)}
+        else:
+            output[name] = cache.prefix_memory(prefix)
+            output[name]['prefix'] = prefix
+    sys.stdout.write(serialize.obj_to_json(output) + "\n")
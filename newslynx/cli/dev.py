@@ -18,7 +18,12 @@ def run(opts, **kwargs):
     tasks = {
         'gen-random-data': run_random_data,
         'flush-comparison-cache': run_flush_comparison_cache,
-        'flush-extract-cache': run_flush_extract_cache
+        'flush-extract-cache': run_flush_extract_cache,
+        'cache-stats': run_cache_stats,
+        'network-stats': run_network_stats,
+        'bench-ingest': run_bench_ingest,
+        'bench-cache-codec': run_bench_cache_codec,
+        'bench-extract': run_bench_extract
     }
     if kwargs.get('_install'):
         return tasks
@@ -34,6 +39,33 @@ def run_random_data(opts, **kwargs):
     return random_data.run(**kwargs)
 
 
+def run_bench_ingest(opts, **kwargs):
+    """
+    Benchmark per-row upserts against COPY-staged merges.
+    """
+    from newslynx.dev import benchmark
+
+    return benchmark.run(**kwargs)
+
+
+def run_bench_cache_codec(opts, **kwargs):
+    """
+    Compare cache codecs on the values currently cached.
+    """
+    from newslynx.dev import benchmark
+
+    return benchmark.cache_codecs(**kwargs)
+
+
+def run_bench_extract(opts, **kwargs):
+    """
+    Time article extraction over a directory of saved pages.
+    """
+    from newslynx.dev import benchmark
+
+    return benchmark.extraction(**kwargs)
+
+
 def run_flush_comparison_cache(opts, **kwargs):
     """
     Flush the comparison cache.
@@ -54,3 +86,33 @@ def run_flush_extract_cache(opts, **kwargs):
     ExtractCache.flush()
     ThumbnailCache.flush()
     log.info('Extraction caches flushed.')
+
+
+def run_cache_stats(opts, **kwargs):
+    """
+    Report hit ratios per cache tier.
+    """
+    import sys
+    from newslynx.lib import serialize
+    from newslynx.models import (
+        URLCache, ExtractCache, ThumbnailCache, ComparisonsCache)
+
+    stats = {}
+    for cache in [URLCache, ExtractCache, ThumbnailCache, ComparisonsCache]:
+        stats[cache.__name__] = cache.stats().report()
+    sys.stdout.write(serialize.obj_to_json(stats) + "\n")
+
+
+def run_network_stats(opts, **kwargs):
+    """
+    Report connection reuse and limiter queue waits per host.
+    """
+    import sys
+    from newslynx.lib import serialize
+    from newslynx.lib import network
+
+    stats = {
+        'connections': network.stats.report(),
+        'limits': network.wait_stats.report()
+    }
+    sys.stdout.write(serialize.obj_to_json(stats) + "\n")
@@ -8,10 +8,11 @@ import logging
 from traceback import format_exc
 
 from newslynx.cli.common import LOGO
-from newslynx.init import load_sql
+from newslynx.init import load_sql, load_metric_indexes
 from newslynx.views import app
 from newslynx.core import db
 from newslynx.tasks import default
+from newslynx.tasks import partition_metric
 
 re_conf = '{}:[^\n]+'
 
@@ -59,6 +60,12 @@ def run(opts, **kwargs):
             # load sql extensions + functions
             for sql in load_sql():
                 db.session.execute(sql)
+            for sql in load_metric_indexes():
+                db.session.execute(sql)
+
+            log.info('(Re)Creating Content Timeseries Partitions')
+            partition_metric.create()
+
             # install app defaults.
             if (not opts or not opts.bare) and not kwargs.get('empty', False):
                 if not kwargs.get('empty', False):
@@ -0,0 +1,38 @@
+"""
+Manage monthly content timeseries partitions.
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def setup(parser):
+    """
+    Install this parser.
+    """
+    from newslynx.core import settings
+
+    partitions_parser = parser.add_parser(
+        "partitions",
+        help="Creates upcoming content timeseries partitions and expires old ones.")
+    partitions_parser.add_argument(
+        '-p', '--premake-months', dest='premake_months', type=int,
+        default=settings.METRICS_PARTITION_PREMAKE_MONTHS,
+        help='The number of future monthly partitions to create.')
+    partitions_parser.add_argument(
+        '-r', '--retention-months', dest='retention_months', type=int,
+        default=settings.METRICS_PARTITION_RETENTION_MONTHS,
+        help='Expire partitions which ended more than this many months ago.')
+    partitions_parser.add_argument(
+        '--drop', dest='drop', action='store_true', default=False,
+        help='Drop expired partitions rather than just detaching them.')
+    return 'partitions', run
+
+
+def run(opts, **kwargs):
+    from newslynx.tasks import partition_metric
+
+    partition_metric.maintain(
+        months_ahead=opts.premake_months,
+        retention_months=opts.retention_months,
+        drop=opts.drop)
@@ -341,6 +341,14 @@ class Orgs(BaseClient):
         url = self._format_url('orgs', org, 'timeseries')
         return self._request('PUT', url, params=kw)
 
+    def compact_timeseries(self, id=None, **kw):
+        """
+        Downsample old hourly timeseries metrics to daily points.
+        """
+        org = self._check_org(id)
+        url = self._format_url('orgs', org, 'timeseries', 'compact')
+        return self._request('PUT', url, params=kw)
+
     def bulk_create_timeseries(self, id=None, **kw):
         """
         Bulk create timeseries metric(s) for content items.
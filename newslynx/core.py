@@ -13,6 +13,7 @@ from flask.ext.migrate import Migrate
 from flask.ext.compress import Compress
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
+from psycogreen.gevent import patch_psycopg
 import redis
 from rq import Queue
 from embedly import Embedly
@@ -61,6 +62,11 @@ def enum_vectorizer(column):
 make_searchable()
 
 # Database
+
+# wait on postgres through gevent's hub rather than blocking it,
+# so that queries in concurrent greenlets actually overlap.
+patch_psycopg()
+
 try:
     db = SQLAlchemy(app, session_options={'query_cls': SearchQuery})
     db.engine.pool._use_threadlocal = True
@@ -60,30 +60,69 @@ SQLALCHEMY_ECHO = False
 # TASK QUEUE
 REDIS_URL = "redis://localhost:6379/0"
 
+# CACHES
+CACHE_STATS_FLUSH_EVERY = 100  # lookups between writing hit counts to redis
+CACHE_LOCK_TTL = 30  # seconds a worker may hold a key while computing it
+CACHE_LOCK_POLL_INTERVAL = 0.1
+CACHE_POOL_SIZE = 20  # misses computed concurrently by `get_many`
+CACHE_CODEC = "binpickle"  # or "pickle"
+CACHE_COMPRESS_ABOVE = 1024  # bytes, None to never compress
+CACHE_SCAN_COUNT = 1000  # keys per SCAN / pipelined batch when flushing
+
 # URL CACHE
 URL_CACHE_PREFIX = "newslynx-url-cache"
 URL_CACHE_TTL = 1209600  # 14 DAYS
 URL_CACHE_POOL_SIZE = 5
+URL_CACHE_LOCAL_SIZE = 10000  # in-process entries, 0 to disable
+URL_CACHE_LOCAL_TTL = 3600
+URL_CACHE_NEGATIVE_TTL = 3600  # how long to remember failures
+URL_CACHE_STALE_TTL = 0  # serve expired entries while refreshing, 0 to disable
+
+# per-host rules for canonicalizing urls without fetching them.
+URL_RULE_PREFIX = "newslynx-url-rule"
+URL_RULE_TTL = 2592000  # 30 days since a host's last fetch
+URL_RULE_MIN_HITS = 20  # matching canonicalizations in a row before a rule is used, 0 to disable
+URL_RULE_SAMPLE_RATE = 0.05  # share of urls fetched anyway to check their host's rule
 
 # EXTRACTION CACHE
 EXTRACT_CACHE_PREFIX = "newslynx-extract-cache"
 EXTRACT_CACHE_TTL = 259200  # 3 DAYS
+EXTRACT_CACHE_LOCAL_SIZE = 250
+EXTRACT_CACHE_LOCAL_TTL = 600
+EXTRACT_CACHE_NEGATIVE_TTL = 3600  # how long to remember failures
+EXTRACT_CACHE_STALE_TTL = 0  # serve expired entries while refreshing, 0 to disable
+EXTRACT_CACHE_VALIDATE_TTL = 604800  # keep expired extractions to revalidate with a conditional GET, 0 to disable
 
 # THUMBNAIL SETTINGS
 THUMBNAIL_CACHE_PREFIX = "newslynx-thumbnail-cache"
 THUMBNAIL_CACHE_TTL = 1209600  # 14 DAYS
+THUMBNAIL_CACHE_LOCAL_SIZE = 1000
+THUMBNAIL_CACHE_LOCAL_TTL = 3600
+THUMBNAIL_CACHE_NEGATIVE_TTL = 21600  # how long to remember failures
+THUMBNAIL_CACHE_STALE_TTL = 0  # serve expired entries while refreshing, 0 to disable
 THUMBNAIL_SIZE = [150, 150]
 THUMBNAIL_DEFAULT_FORMAT = "PNG"
 
+# worker processes for parsing pages and thumbnailing images,
+# so that cpu-bound work doesn't stall every other greenlet.
+EXTRACT_POOL_WORKERS = None  # per process, None for one per core, 0 to work in-process
+EXTRACT_POOL_TIMEOUT = 60  # seconds before a task's process is killed
+EXTRACT_POOL_MAX_TASKS = 500  # tasks before a process is replaced, 0 to never replace
+
 # COMPARISON CACHE
 COMPARISON_CACHE_PREFIX = "newslynx-comparison-cache"
 COMPARISON_CACHE_TTL = 86400  # 1 day
+COMPARISON_CACHE_LOCK_TTL = 720  # as long as a comparison refresh may take
+COMPARISON_POOL_SIZE = 8  # facets computed concurrently per comparison type
 COMPARISON_PERCENTILES = [
     2.5, 5.0, 10.0, 20.0, 30.0,
     40.0, 60.0, 70.0, 80.0, 90.0,
     95.0, 97.5
 ]
 
+COMPARISON_SKETCH_PREFIX = "newslynx-comparison-sketch"
+COMPARISON_SKETCH_ACCURACY = 0.01  # relative error of sketched percentiles
+
 # TODO, make this actually modify data.
 COMPARISON_FUNCTIONS = ['min', 'max', 'avg', 'median']
 
@@ -102,6 +141,25 @@ NETWORK_TIMEOUT = (7, 27)
 NETWORK_WAIT = 0.8
 NETWORK_BACKOFF = 2
 NETWORK_MAX_RETRIES = 2
+NETWORK_POOL_HOSTS = 100  # hosts to keep connections open to, per process
+NETWORK_POOL_SIZE_PER_HOST = 10  # keep-alive connections per host
+NETWORK_STATS_KEY = "newslynx-network-stats"
+NETWORK_STATS_FLUSH_EVERY = 100  # requests between writing stats to redis
+
+# per-domain limits on outbound requests, shared across workers.
+NETWORK_LIMIT_PREFIX = "newslynx-network-limit"
+NETWORK_LIMIT_STATS_KEY = "newslynx-network-limit-stats"
+NETWORK_DOMAIN_RATE = 2  # requests per second, 0 to disable
+NETWORK_DOMAIN_BURST = 10  # requests allowed at once after a quiet spell
+NETWORK_DOMAIN_CONCURRENCY = 4  # requests in flight, 0 to disable
+NETWORK_DOMAIN_LEASE_TTL = 60  # seconds before a dead worker's slot is freed
+NETWORK_DOMAIN_MAX_WAIT = 60  # seconds to queue before going ahead anyway
+NETWORK_DOMAIN_LIMITS = {}  # domain => {rate, burst, concurrency} overrides
+
+# recently fetched pages, so one ingest fetches each page once.
+NETWORK_PAGE_CACHE_PREFIX = "newslynx-page-cache"
+NETWORK_PAGE_CACHE_TTL = 300  # seconds, 0 to disable
+NETWORK_PAGE_CACHE_MAX_BYTES = 2097152  # larger pages aren't cached
 
 # reddit
 REDDIT_USER_AGENT = 'Newslynx'
@@ -109,8 +167,23 @@ REDDIT_USER_AGENT = 'Newslynx'
 # Metrics timeseries granularity
 METRICS_MIN_DATE_UNIT = 'hour'
 METRICS_MIN_DATE_VALUE = 1
-METRICS_CONTENT_LIST_TIMESERIES_DAYS = 5
-METRICS_CONTENT_GET_TIMESERIES_DAYS = 30
+
+# Hot metric keys which get expression indexes on the metric stores.
+METRICS_INDEXED_KEYS = []
+
+# Monthly content timeseries partitions. Partitions which ended more than
+# METRICS_PARTITION_RETENTION_MONTHS ago are expired. `None` keeps everything.
+METRICS_PARTITION_PREMAKE_MONTHS = 3
+METRICS_PARTITION_RETENTION_MONTHS = None
+
+# Hourly timeseries points older than this many days are downsampled to daily points.
+METRICS_COMPACT_DAYS = 30
+
+# Incremental rollups. Ingest marks (content_item_id, hour) pairs dirty under this
+# prefix. Org timeseries rollups read this many hours before the earliest dirty
+# hour so that cumulative metrics can be differenced.
+METRICS_DIRTY_PREFIX = "newslynx-metrics-dirty"
+METRICS_ROLLUP_LOOKBACK_HOURS = 24
 
 # pandoc
 PANDOC_PATH = '/usr/local/bin/pandoc'
@@ -0,0 +1,293 @@
+"""
+Benchmarks for comparing ingest strategies against a live database,
+cache codecs against the values currently in redis and article
+extraction against a corpus of saved pages.
+"""
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+
+import pytz
+
+from newslynx.core import db, rds, settings
+from newslynx.models import Org, URLCache, ExtractCache, ThumbnailCache
+from newslynx.tasks import ingest
+from newslynx.tasks.query_metric import QueryContentMetricTimeseries
+from newslynx.lib import article
+from newslynx.lib.common import make_soup, parse_page
+from newslynx.lib.serialize import obj_to_json, obj_to_cache, cache_to_obj
+from newslynx.util import chunk_list
+
+log = logging.getLogger(__name__)
+
+# generated points live far before any real data
+# so we can safely remove them afterwards.
+BENCH_START = datetime(1800, 1, 1, tzinfo=pytz.utc)
+BENCH_END = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+CACHES = {
+    'url': URLCache,
+    'extract': ExtractCache,
+    'thumbnail': ThumbnailCache
+}
+
+# (codec, compress_above) pairs to compare.
+CODECS = [
+    ('pickle', None),
+    ('binpickle', None),
+    ('pickle', settings.CACHE_COMPRESS_ABOVE),
+    ('binpickle', settings.CACHE_COMPRESS_ABOVE)
+]
+
+
+def gen_content_timeseries(org, n):
+    """
+    Generate n hourly points spread across an org's content items.
+    """
+    cids = org.content_item_ids
+    metrics = [m for m, v in org.content_timeseries_metrics.items()
+               if not v['faceted']]
+    if not len(cids) or not len(metrics):
+        raise ValueError(
+            'Org {} needs content items and timeseries metrics to benchmark.'
+            .format(org.slug))
+
+    n_hours = (n / len(cids)) + 1
+    if BENCH_START + timedelta(hours=n_hours) >= BENCH_END:
+        raise ValueError(
+            'Org {} has too few content items to benchmark {} points.'
+            .format(org.slug, n))
+
+    for i in xrange(n):
+        dt = BENCH_START + timedelta(hours=i / len(cids))
+        obj = {
+            'content_item_id': cids[i % len(cids)],
+            'datetime': dt.isoformat()
+        }
+        for m in metrics:
+            obj[m] = i % 1000
+        yield obj
+
+
+def clean_content_timeseries(org):
+    """
+    Remove generated points.
+    """
+    db.session.execute(
+        """DELETE FROM content_metric_timeseries
+           WHERE org_id = {} AND datetime >= '{}' AND datetime < '{}'
+        """.format(org.id, BENCH_START.isoformat(), BENCH_END.isoformat()))
+    db.session.commit()
+
+
+def upsert_content_timeseries(rows):
+    """
+    The old strategy: one upsert function call per row.
+    """
+    for row in rows:
+        db.session.execute(
+            """SELECT upsert_content_metric_timeseries(
+                  {org_id}, {content_item_id}, '{datetime}', '{metrics}')
+            """.format(org_id=row['org_id'],
+                       content_item_id=row['content_item_id'],
+                       datetime=row['datetime'],
+                       metrics=obj_to_json(row['metrics'])))
+    db.session.commit()
+
+
+def time_content_timeseries(org, n, mode, chunk_size, clean=True):
+    """
+    Ingest n points and return the throughput in rows per second.
+    """
+    kw = {
+        'org_id': org.id,
+        'metrics_lookup': org.content_timeseries_metrics,
+        'content_item_ids': org.content_item_ids,
+        'queued': True
+    }
+    data = list(gen_content_timeseries(org, n))
+    start = time.time()
+    for chunk in chunk_list(data, chunk_size):
+        if mode == 'upsert':
+            rows = [{
+                'org_id': org.id,
+                'content_item_id': obj['content_item_id'],
+                'datetime': obj['datetime'],
+                'metrics': dict((k, v) for k, v in obj.items()
+                                if k not in ['content_item_id', 'datetime'])
+            } for obj in chunk]
+            upsert_content_timeseries(rows)
+        else:
+            ingest.content_timeseries(chunk, **kw)
+    elapsed = time.time() - start
+    if clean:
+        clean_content_timeseries(org)
+    return elapsed, n / elapsed
+
+
+def time_query_content_timeseries(org, n, unit='day'):
+    """
+    Query the generated points and return the latency and rows per second.
+    """
+    kw = {
+        'unit': unit,
+        'after': BENCH_START.isoformat(),
+        'before': BENCH_END.isoformat()
+    }
+    start = time.time()
+    q = QueryContentMetricTimeseries(org, org.content_item_ids, **kw)
+    for _ in q.execute():
+        pass
+    elapsed = time.time() - start
+    return elapsed, n / elapsed
+
+
+def content_timeseries(org=settings.SUPER_USER_ORG, sizes=DEFAULT_SIZES,
+                       chunk_size=200, bulk_chunk_size=1000, **kw):
+    """
+    Compare per-row upsert function calls with COPY-staged merges,
+    and time a daily timeseries query over the merged points.
+    """
+    org = Org.query.filter_by(slug=org).first()
+    if not isinstance(sizes, list):
+        sizes = [int(s) for s in str(sizes).split(',')]
+    results = []
+    for n in sizes:
+        for mode, cs in [('upsert', int(chunk_size)), ('copy', int(bulk_chunk_size))]:
+            elapsed, rps = time_content_timeseries(
+                org, n, mode, cs, clean=(mode == 'upsert'))
+            log.info('{} rows / {} / chunks of {}: {:.2f}s ({:.0f} rows/s)'
+                     .format(n, mode, cs, elapsed, rps))
+            results.append({
+                'rows': n, 'mode': mode, 'chunk_size': cs,
+                'seconds': elapsed, 'rows_per_second': rps
+            })
+        elapsed, rps = time_query_content_timeseries(org, n)
+        clean_content_timeseries(org)
+        log.info('{} rows / query: {:.2f}s ({:.0f} rows/s)'
+                 .format(n, elapsed, rps))
+        results.append({
+            'rows': n, 'mode': 'query', 'chunk_size': None,
+            'seconds': elapsed, 'rows_per_second': rps
+        })
+    db.session.remove()
+    return results
+
+
+def sample_cache(cache, sample):
+    """
+    Up to `sample` raw values from a cache, skipping
+    its locks, stats and other bookkeeping keys.
+    """
+    values = []
+    match = "{}:*".format(cache.key_prefix)
+    for k in rds.scan_iter(match=match, count=1000):
+        if len(k.split(':')) != 2:
+            continue
+        s = rds.get(k)
+        if s:
+            values.append(s)
+        if len(values) >= sample:
+            break
+    return values
+
+
+def cache_codecs(cache='extract', sample=1000, **kw):
+    """
+    Re-encode a sample of a cache's values with each codec and
+    compare their size and encode / decode latency.
+    """
+    cache = CACHES[cache]
+    raw = sample_cache(cache, int(sample))
+    if not len(raw):
+        raise ValueError(
+            'There are no {} values to benchmark.'.format(cache.__name__))
+    objs = [cache_to_obj(s) for s in raw]
+    results = [{
+        'cache': cache.__name__, 'codec': 'stored', 'compress_above': None,
+        'values': len(raw), 'bytes': sum([len(s) for s in raw]),
+        'encode_ms': None, 'decode_ms': None
+    }]
+    for codec, compress_above in CODECS:
+        start = time.time()
+        encoded = [obj_to_cache(o, codec, compress_above) for o in objs]
+        encode = time.time() - start
+        start = time.time()
+        for s in encoded:
+            cache_to_obj(s)
+        decode = time.time() - start
+        results.append({
+            'cache': cache.__name__, 'codec': codec,
+            'compress_above': compress_above, 'values': len(objs),
+            'bytes': sum([len(s) for s in encoded]),
+            'encode_ms': 1000.0 * encode / len(objs),
+            'decode_ms': 1000.0 * decode / len(objs)
+        })
+    for r in results:
+        log.info('{cache} / {codec} / compress above {compress_above}: '
+                 '{bytes} bytes for {values} values'.format(**r))
+    return results
+
+
+def cpu_time(fx, *args, **kw):
+    """
+    The processor time a function call takes, in milliseconds.
+    """
+    start = time.clock()
+    fx(*args, **kw)
+    return 1000.0 * (time.clock() - start)
+
+
+def summarize_times(times):
+    times = sorted(times)
+    return {
+        'mean_ms': round(sum(times) / len(times), 2),
+        'median_ms': round(times[len(times) / 2], 2),
+        'p95_ms': round(times[int(len(times) * 0.95)], 2),
+        'max_ms': round(times[-1], 2)
+    }
+
+
+def extraction(corpus, **kw):
+    """
+    Per-page CPU time to parse and extract every .html file in a
+    directory of saved news pages, alongside the cost of a single
+    parse with the old html.parser backend for reference.
+    Disable embedly first or its API calls are timed too.
+    """
+    pages = []
+    for name in sorted(os.listdir(corpus)):
+        if name.endswith('.html') or name.endswith('.htm'):
+            with open(os.path.join(corpus, name)) as f:
+                pages.append((name, f.read()))
+    if not len(pages):
+        raise ValueError('There are no .html files in {}'.format(corpus))
+
+    times = {'html.parser': [], 'lxml': [], 'extract': []}
+    for name, page_html in pages:
+        source_url = "http://example.com/{}".format(name)
+        times['html.parser'].append(cpu_time(make_soup, page_html))
+        times['lxml'].append(cpu_time(parse_page, page_html))
+        times['extract'].append(
+            cpu_time(article.extract_page, page_html, source_url))
+
+    results = {'pages': len(pages)}
+    for step, ts in times.items():
+        results[step] = summarize_times(ts)
+        log.info('{}: {mean_ms}ms mean / {p95_ms}ms p95 per page'
+                 .format(step, **results[step]))
+    return results
+
+
+def run(**kw):
+    """
+    A wrapper for benchmarks which rolls back on error.
+    """
+    try:
+        return content_timeseries(**kw)
+    except Exception as e:
+        db.session.rollback()
+        raise e
@@ -17,11 +17,11 @@ from newslynx.models import *
 from newslynx.models import recipe_schema
 from newslynx.core import db
 from newslynx.lib import dates
-from newslynx.lib.serialize import obj_to_json
 from newslynx.constants import *
 from newslynx.exc import RecipeSchemaError
 from newslynx.util import here
 from newslynx.tasks import rollup_metric
+from newslynx.tasks import upsert_metric
 from newslynx.lib.text import slug
 
 log = logging.getLogger(__name__)
@@ -327,6 +327,7 @@ def gen_content_metric_timeseries(org, content_items, metrics, n_content_item_ti
     for hour in range(1, (7*24)+1):
         date_list.append(start + timedelta(hours=hour))
 
+    rows = []
     for c in content_items:
         last_values = {}
         for i, d in enumerate(date_list):
@@ -341,24 +342,17 @@ def gen_content_metric_timeseries(org, content_items, metrics, n_content_item_ti
                     else:
                         _metrics[m.name] = random_int(1, 1000)
 
-            cmd_kwargs = {
+            rows.append({
                 'org_id': org.id,
                 'content_item_id': c.id,
                 'datetime': d.isoformat(),
-                'metrics': obj_to_json(_metrics)
-            }
-            # upsert command
-            cmd = """SELECT upsert_content_metric_timeseries(
-                        {org_id},
-                        {content_item_id},
-                        '{datetime}',
-                        '{metrics}');
-                   """.format(**cmd_kwargs)
-            db.session.execute(cmd)
-    db.session.commit()
+                'metrics': _metrics
+            })
+    upsert_metric.content_timeseries(rows)
 
 
 def gen_org_metric_timeseries(org, metrics, n_org_timeseries_metrics=1000):
+    rows = []
     for _ in xrange(n_org_timeseries_metrics):
         _metrics = {}
         for m in metrics:
@@ -368,23 +362,16 @@ def gen_org_metric_timeseries(org, metrics, n_org_timeseries_metrics=1000):
                 else:
                     _metrics[m.name] = _ * random_int(2, 10)
 
-        cmd_kwargs = {
+        rows.append({
             'org_id': org.id,
             'datetime': dates.floor(random_date(1, 120), unit='hour', value=1),
-            'metrics': obj_to_json(_metrics)
-        }
-        # upsert command
-        cmd = """SELECT upsert_org_metric_timeseries(
-                    {org_id},
-                    '{datetime}',
-                    '{metrics}');
-               """.format(**cmd_kwargs)
-        db.session.execute(cmd)
-    db.session.commit()
+            'metrics': _metrics
+        })
+    upsert_metric.org_timeseries(rows)
 
 
 def gen_content_metric_summaries(org, content_items, metrics):
-
+    rows = []
     for c in content_items:
         _metrics = {}
         for m in metrics:
@@ -406,19 +393,12 @@ def gen_content_metric_summaries(org, content_items, metrics):
                             'value': random_int(1, 1000)
                         }
                     ]
-        cmd_kwargs = {
+        rows.append({
             'org_id': org.id,
             'content_item_id': c.id,
-            'metrics': obj_to_json(_metrics)
-        }
-        # upsert command
-        cmd = """SELECT upsert_content_metric_summary(
-                    {org_id},
-                    {content_item_id},
-                    '{metrics}');
-               """.format(**cmd_kwargs)
-        db.session.execute(cmd)
-    db.session.commit()
+            'metrics': _metrics
+        })
+    upsert_metric.content_summary(rows)
 
 
 def main(
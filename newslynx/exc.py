@@ -144,6 +144,24 @@ class ClientError(Exception):
     """
     status_code = 500
 
+# Executor Errors #
+
+
+class ExecutorError(Exception):
+
+    """
+    An error that's thrown when a task fails in an executor's worker process.
+    """
+    status_code = 500
+
+
+class ExecutorTimeout(ExecutorError):
+
+    """
+    An error that's thrown when a task runs past the executor's timeout.
+    """
+    status_code = 500
+
 
 # a lookup of all errors
 ERRORS = {
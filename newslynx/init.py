@@ -18,6 +18,12 @@ SOUS_CHEF_DIR = here(__file__, 'sc')
 # directory of built-in sql functions
 SQL_DIR = here(__file__, 'sql')
 
+# metric stores which get expression indexes
+METRIC_INDEX_TABLES = [
+    'content_metric_timeseries',
+    'content_metric_summary'
+]
+
 
 def _load_config_file(fp):
     """
@@ -139,6 +145,32 @@ def load_sql():
             yield open(fp).read()
 
 
+def load_metric_indexes(keys=None):
+    """
+    Get expression indexes for hot metric keys.
+    """
+    if keys is None:
+        keys = settings.METRICS_INDEXED_KEYS
+    for table in METRIC_INDEX_TABLES:
+        for key in keys:
+            yield \
+                """CREATE INDEX IF NOT EXISTS {table}_{key}_idx
+                   ON {table} (org_id, ((metrics ->> '{key}')::text::numeric))
+                """.format(table=table, key=key)
+
+
+def drop_metric_indexes(keys=None):
+    """
+    Drop the expression indexes for hot metric keys.
+    """
+    if keys is None:
+        keys = settings.METRICS_INDEXED_KEYS
+    for table in METRIC_INDEX_TABLES:
+        for key in keys:
+            yield "DROP INDEX IF EXISTS {table}_{key}_idx"\
+                .format(table=table, key=key)
+
+
 def load_defaults(t):
     """
     Lookup a defaults config file
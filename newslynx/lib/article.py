@@ -4,10 +4,10 @@ Multi-Method Article Extraction
 
 import logging
 
-from bs4 import BeautifulSoup
-
-from newslynx.lib.common import make_soup
+from newslynx.lib.common import make_soup, parse_page, parse_head, is_soup
 from newslynx.core import settings
+from newslynx.exc import ExecutorTimeout
+from newslynx.lib import executor
 from newslynx.lib import network
 from newslynx.lib import url
 from newslynx.lib import html
@@ -34,6 +34,9 @@ def extract(source_url, **kw):
     6. If embedly doesnt return content or is not active, use readability
     7. If readability doesnt return content, use article tag.
     8. If authors aren't detcted from meta tags, detect them in article body.
+
+    Steps 1-3 and 5, which may make network requests, run here. The
+    rest runs in the extraction executor's worker processes.
     """
     type = kw.get('type', 'article')
 
@@ -45,10 +48,40 @@ def extract(source_url, **kw):
         log.warning("Failed to extract html from {}".format(source_url))
         return None
 
-    soup = make_soup(page_html)
+    # get canonical url, which preparing may unshorten.
+    canonical_url = meta.canonical_url(parse_head(page_html))
+    if not canonical_url:
+        canonical_url = url.prepare(
+            source_url, source=source_url, canonicalize=False)
+
+    # embedly fetches the page itself.
+    body = None
+    if type == 'article' and settings.EMBEDLY_ENABLED \
+            and not url.is_video(canonical_url):
+        body = body_via_embedly(canonical_url)
+
+    try:
+        return executor.submit(extract_page, page_html, source_url,
+                               type=type, body=body,
+                               canonical_url=canonical_url)
+    except ExecutorTimeout as e:
+        log.warning("Failed to extract {}: {}".format(source_url, e.message))
+        return None
+
+
+def extract_page(page_html, source_url, type='article', body=None,
+                 canonical_url=None):
+    """
+    Extract an article from a fetched page. The page is parsed once
+    and everything but readability, which mangles its own lxml tree,
+    reads from that. `body` and `canonical_url` are the page's body
+    and canonical url, if they've already been found.
+    """
+    soup = parse_page(page_html)
 
     # get canonical url
-    canonical_url = meta.canonical_url(soup)
+    if not canonical_url:
+        canonical_url = meta.canonical_url(soup)
     if not canonical_url:
         canonical_url = url.prepare(
             source_url, source=source_url, canonicalize=False)
@@ -79,21 +112,22 @@ def extract(source_url, **kw):
 
     # extract article body
     if data['type'] == 'article':
-        if settings.EMBEDLY_ENABLED:
-            data['body'] = body_via_embedly(canonical_url)
+        data['body'] = body
         if not data['body']:
             data['body'] = body_via_readability(page_html, canonical_url)
 
         # # extract body from article tag
-        body, raw_html = body_via_article_tag(soup, canonical_url)
+        article_tag = soup.find('article')
+        body, raw_html = body_via_article_tag(article_tag, canonical_url)
 
         # merge body
         if not data['body']:
             data['body'] = body
 
-        # get creators from raw article html
+        # get creators from the article tag
         if not len(data['authors']) and raw_html:
-            data['authors'] = author.extract(raw_html, tags=author.OPTIMISTIC_TAGS)
+            data['authors'] = author.extract(
+                article_tag, tags=author.OPTIMISTIC_TAGS)
 
             # remove site name from authors
             if data.get('site_name'):
@@ -102,9 +136,9 @@ def extract(source_url, **kw):
                     for a in data['authors']
                 ]
 
-        # get links from raw_html + content
+        # get links from the article tag + content
         links = [u for u in url.from_any(data['body']) if source_url not in u]
-        for u in url.from_any(raw_html, source=source_url):
+        for u in url.from_any(article_tag, source=source_url):
             if u not in links and (u != source_url or not u.startswith(source_url)):
                 links.append(u)
 
@@ -144,13 +178,17 @@ def body_via_readability(page_html, source_url):
 
 def body_via_article_tag(soup, source_url):
     """
-    Extract content from an "article" tag.
+    Extract content from an "article" tag, given
+    html, a parsed page or the tag itself.
     """
-    if not isinstance(soup, BeautifulSoup):
+    if soup is None:
+        return None, None
+    if not is_soup(soup):
         soup = make_soup(soup)
-    articles = soup.find_all('article')
-    if len(articles):
-        raw_html = html.get_inner(articles[0])
-        body = html.prepare(raw_html, source_url)
-        return body, raw_html
-    return None, None
+    if soup.name != 'article':
+        soup = soup.find('article')
+        if soup is None:
+            return None, None
+    raw_html = html.get_inner(soup)
+    body = html.prepare(raw_html, source_url)
+    return body, raw_html
@@ -2,9 +2,11 @@
 Parsing Authors from html meta-tags and strings
 This module was adapted from newspaper: http://github.com/codelucas/newspaper
 """
-from bs4 import BeautifulSoup
+from collections import defaultdict
 
-from newslynx.lib.common import make_soup
+from bs4 import Tag
+
+from newslynx.lib.common import make_soup, is_soup
 from newslynx.lib import html
 from newslynx.lib.regex import (
     re_by, re_name_token, re_digits,
@@ -42,24 +44,17 @@ def extract(
         vals=TAG_VALS):
     """
     Extract author attrs from meta tags.
-    Only works for english articles.
+    Only works for english articles. Takes html,
+    a parsed page or an element of one.
     """
 
     # soupify
-    if not isinstance(soup, BeautifulSoup):
+    if not is_soup(soup):
         soup = make_soup(soup)
 
     # Search popular author tags for authors
-
-    matches = []
     _authors = []
-    for tag in tags:
-        for attr in attrs:
-            for val in vals:
-                found = soup.find_all(tag, {attr: val})
-                matches.extend(found)
-
-    for match in matches:
+    for match in find_matches(soup, compile_matcher(tags, attrs, vals)):
         content = u''
 
         m = match.attrs.get('content', None)
@@ -74,6 +69,58 @@ def extract(
     return _format(_authors)
 
 
+# matchers by (tags, attrs, vals)
+_matchers = {}
+
+
+def compile_matcher(tags, attrs, vals):
+    """
+    Lookups of where each tag and value appears in the
+    arguments, so elements can be matched in one pass.
+    """
+    k = (tuple(tags), tuple(attrs), tuple(vals))
+    if k not in _matchers:
+        tag_pos = defaultdict(list)
+        for i, t in enumerate(tags):
+            tag_pos[t].append(i)
+        val_pos = defaultdict(list)
+        for i, v in enumerate(vals):
+            val_pos[v].append(i)
+        _matchers[k] = (dict(tag_pos), list(enumerate(attrs)), dict(val_pos))
+    return _matchers[k]
+
+
+def find_matches(soup, matcher):
+    """
+    Walk the tree once, collecting the elements which match a
+    (tag, attr, val) combination. They come back in the same order,
+    repeats and all, as calling `find_all(tag, {attr: val})` for each
+    combination in turn. Multi-valued attributes like class match on
+    any one of their values or all of them, just like `find_all`.
+    """
+    tag_pos, attrs, val_pos = matcher
+    found = []
+    for n, el in enumerate(soup.descendants):
+        if not isinstance(el, Tag) or el.name not in tag_pos:
+            continue
+        for ai, attr in attrs:
+            value = el.attrs.get(attr)
+            if value is None:
+                continue
+            if isinstance(value, list):
+                values = value + [" ".join(value)]
+            else:
+                values = [value]
+            vis = set()
+            for v in values:
+                vis.update(val_pos.get(v, []))
+            for ti in tag_pos[el.name]:
+                for vi in vis:
+                    found.append((ti, ai, vi, n, el))
+    found.sort(key=lambda f: f[:4])
+    return [f[-1] for f in found]
+
+
 def parse(search_str):
     """
     Takes a candidate string and
@@ -2,11 +2,39 @@
 common utilities shared throughout lib
 """
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
 
+from newslynx.lib.regex import re_head_end
 
-def make_soup(html):
+
+def make_soup(html, parser='html.parser'):
     """
     Helper for bs4
     """
-    return BeautifulSoup(html, 'html.parser')
+    return BeautifulSoup(html, parser)
+
+
+def parse_page(html):
+    """
+    Parse a whole page with lxml's parser. Parse a page once and
+    share its soup between `meta`, `author`, `url` and `image`.
+    """
+    return make_soup(html, 'lxml')
+
+
+def parse_head(html):
+    """
+    Parse just a page's <head>, which is enough for its meta tags
+    and a fraction of the work of `parse_page`.
+    """
+    m = re_head_end.search(html)
+    if m:
+        html = html[:m.end()]
+    return make_soup(html, 'lxml')
+
+
+def is_soup(obj):
+    """
+    Whether we've got a parsed page or one of its elements.
+    """
+    return isinstance(obj, Tag)
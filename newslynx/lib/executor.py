@@ -0,0 +1,252 @@
+"""
+A process pool for CPU-bound extraction.
+
+Parsing pages and resizing images holds the interpreter, so under gevent
+every other greenlet's I/O waits on it. Instead, greenlets fetch as usual
+and hand the raw html or image bytes to a bounded pool of forked worker
+processes. Tasks and results travel as pickles over a socketpair, so a
+greenlet waiting on one yields to the hub like any other socket read.
+
+A task that runs past its timeout has its process killed and replaced.
+Processes are also replaced after a number of tasks, so leaks in the
+parsers don't grow without bound.
+"""
+
+from multiprocessing import cpu_count
+from traceback import format_exc
+import cPickle as pickle
+import logging
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+
+from newslynx.core import settings
+from newslynx.exc import ExecutorError, ExecutorTimeout
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct('!I')
+
+
+def _read(fd, n):
+    """
+    Read exactly n bytes from a file descriptor, or None at EOF.
+    """
+    chunks = []
+    while n:
+        chunk = os.read(fd, n)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return ''.join(chunks)
+
+
+def _write(fd, s):
+    """
+    Write all of a string to a file descriptor.
+    """
+    while s:
+        s = s[os.write(fd, s):]
+
+
+def _frame(obj):
+    """
+    A length-prefixed pickle.
+    """
+    s = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(s)) + s
+
+
+def _serve(fd):
+    """
+    A worker process's loop: run tasks until the parent hangs up.
+    """
+    while True:
+        header = _read(fd, HEADER.size)
+        if header is None:
+            return
+        fx, args, kw = pickle.loads(_read(fd, HEADER.unpack(header)[0]))
+        try:
+            res = (True, fx(*args, **kw))
+        except Exception:
+            res = (False, format_exc())
+        try:
+            frame = _frame(res)
+        except Exception:
+            frame = _frame((False, format_exc()))
+        _write(fd, frame)
+
+
+class Worker(object):
+
+    """
+    One forked process and our end of its socket.
+    """
+
+    def __init__(self, siblings=[]):
+        sock, child = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            # close every other process's socket so that they
+            # see EOF as soon as the parent goes away.
+            sock.close()
+            for s in siblings:
+                s.close()
+            try:
+                _serve(child.fileno())
+            finally:
+                os._exit(0)
+        child.close()
+        self.pid = pid
+        self.sock = sock
+        self.tasks = 0
+
+    def recv(self, n, deadline):
+        """
+        Read exactly n bytes before the deadline.
+        """
+        chunks = []
+        while n:
+            self.sock.settimeout(max(deadline - time.time(), 0.001))
+            chunk = self.sock.recv(min(n, 65536))
+            if not chunk:
+                raise ExecutorError('Worker {} died.'.format(self.pid))
+            chunks.append(chunk)
+            n -= len(chunk)
+        return ''.join(chunks)
+
+    def run(self, fx, args, kw, timeout):
+        """
+        Run a task in this process and wait for its result.
+        """
+        deadline = time.time() + timeout
+        self.sock.settimeout(timeout)
+        self.sock.sendall(_frame((fx, args, kw)))
+        size = HEADER.unpack(self.recv(HEADER.size, deadline))[0]
+        ok, res = pickle.loads(self.recv(size, deadline))
+        self.tasks += 1
+        return ok, res
+
+    def stop(self):
+        """
+        Hang up on an idle process and wait for it to exit.
+        """
+        self.sock.close()
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+
+    def kill(self):
+        """
+        Kill the process, whatever it's doing.
+        """
+        self.sock.close()
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+
+
+class Executor(object):
+
+    """
+    A bounded pool of worker processes, started as they're needed.
+    """
+
+    def __init__(self, workers=None, timeout=None, max_tasks=None):
+        if workers is None:
+            workers = settings.EXTRACT_POOL_WORKERS
+        if workers is None:
+            workers = cpu_count()
+        self.workers = workers
+        self.timeout = timeout or settings.EXTRACT_POOL_TIMEOUT
+        if max_tasks is None:
+            max_tasks = settings.EXTRACT_POOL_MAX_TASKS
+        self.max_tasks = max_tasks
+        # looked up now rather than at import so that it's
+        # gevent's when the caller has monkeypatched threading.
+        self.slots = threading.BoundedSemaphore(max(workers, 1))
+        self.idle = []
+        self.busy = set()
+        self.pid = os.getpid()
+
+    def sockets(self):
+        return [w.sock for w in self.idle] + [w.sock for w in self.busy]
+
+    def submit(self, fx, *args, **kw):
+        """
+        Run fx(*args, **kw) in a worker process and return its result,
+        waiting for a free process first. fx, its arguments and its
+        result must all pickle.
+        """
+        if not self.workers:
+            return fx(*args, **kw)
+        with self.slots:
+            if self.idle:
+                worker = self.idle.pop()
+            else:
+                worker = Worker(self.sockets())
+            self.busy.add(worker)
+            try:
+                ok, res = worker.run(fx, args, kw, self.timeout)
+            except socket.timeout:
+                log.warning('Killing worker {} after {}s running {}.'
+                            .format(worker.pid, self.timeout, fx.__name__))
+                worker.kill()
+                raise ExecutorTimeout(
+                    '{} timed out after {}s.'.format(fx.__name__, self.timeout))
+            except BaseException:
+                # the process is in an unknown state,
+                # e.g. this greenlet was killed mid-task.
+                worker.kill()
+                raise
+            finally:
+                self.busy.discard(worker)
+            if self.max_tasks and worker.tasks >= self.max_tasks:
+                worker.stop()
+            else:
+                self.idle.append(worker)
+        if not ok:
+            raise ExecutorError(res)
+        return res
+
+    def shutdown(self):
+        """
+        Stop every idle process.
+        """
+        while self.idle:
+            self.idle.pop().stop()
+
+
+# the executor, and the process it belongs to.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    This process's executor. A forked worker gets its own
+    rather than sharing its parent's processes.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor.pid != os.getpid():
+            if _executor is not None:
+                # our copies of the parent's sockets.
+                for s in _executor.sockets():
+                    s.close()
+            _executor = Executor()
+        return _executor
+
+
+def submit(fx, *args, **kw):
+    """
+    Run fx(*args, **kw) on this process's executor.
+    """
+    return get_executor().submit(fx, *args, **kw)
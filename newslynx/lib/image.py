@@ -9,7 +9,9 @@ import base64
 import mimetypes
 from urlparse import urljoin
 
-from newslynx.lib.common import make_soup
+from newslynx.lib.common import make_soup, is_soup
+from newslynx.exc import ExecutorTimeout
+from newslynx.lib import executor
 from newslynx.lib import network
 from newslynx.lib import url
 from newslynx.core import settings
@@ -21,10 +23,8 @@ IMG_TAGS = [('img', 'src'), ('a', 'href')]
 def b64_thumbnail_from_url(img_url, **kw):
     """
     Download an image and create a base64 thumbnail.
+    The image is resized in the extraction executor.
     """
-    
-    from PIL import Image, ImageOps
-
     if not img_url:
         return None
 
@@ -49,6 +49,18 @@ def b64_thumbnail_from_url(img_url, **kw):
     if not fmt:
         fmt = default_fmt
 
+    try:
+        return executor.submit(b64_thumbnail, data, fmt, size)
+    except ExecutorTimeout:
+        return None
+
+
+def b64_thumbnail(data, fmt, size):
+    """
+    Create a base64 thumbnail from an image's bytes.
+    """
+    from PIL import Image, ImageOps
+
     # PIL doesn't like JPG
     if fmt.lower() == 'jpg':
         fmt = "jpeg"
@@ -78,12 +90,10 @@ def get_url(img_url):
     Fetch an image and detect its filetype
     """
     fmt = None
-    session = network.gen_session()
-    r = session.get(img_url, **network.get_request_kwargs())
-    mimetype = r.headers.get('content-type', None)
+    content, mimetype = network.get_file(img_url)
     if mimetype:
         fmt = extension_from_mimetype(mimetype)
-    return r.content, fmt
+    return content, fmt
 
 
 def extension_from_mimetype(mimetype):
@@ -106,10 +116,16 @@ def extension_from_mimetype(mimetype):
 def from_html(htmlstring, source=None):
     """
     Extract all img urls from an html string
+    (or a parsed page or element).
     """
-    if not htmlstring:
+    if htmlstring is None:
+        return []
+    if is_soup(htmlstring):
+        soup = htmlstring
+    elif not htmlstring:
         return []
-    soup = make_soup(htmlstring)
+    else:
+        soup = make_soup(htmlstring)
     out_imgs = []
 
     for tag, attr in IMG_TAGS:
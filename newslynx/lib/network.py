@@ -1,9 +1,22 @@
 """
 All things related to network requests
+
+Requests share one session per process whose adapters keep a pool of
+keep-alive connections per host, so repeat fetches from the same site
+skip the TCP and TLS handshakes. Cookies are not kept between requests.
+
+Successful page and file fetches are also kept in redis for a few
+minutes so that canonicalizing, extracting and thumbnailing the same
+url during one ingest only hits the publisher once.
 """
 
 from functools import wraps
+from cookielib import DefaultCookiePolicy
+from hashlib import md5
+from threading import Lock
+from urlparse import urlparse, urlsplit, urlunsplit
 import logging
+import os
 import time
 import warnings
 from traceback import format_exc
@@ -17,12 +30,428 @@ requests.packages.urllib3.disable_warnings(InsecurePlatformWarning)
 warnings.filterwarnings('ignore', category=InsecureRequestWarning)
 warnings.filterwarnings('ignore', category=InsecurePlatformWarning)
 
-from newslynx.core import settings
-from newslynx.lib.serialize import json_to_obj
+from newslynx.core import settings, rds
+from newslynx.lib.serialize import json_to_obj, obj_to_cache, cache_to_obj
+from newslynx.util import gen_uuid
+
+log = logging.getLogger(__name__)
 
 FAIL_ENCODING = 'ISO-8859-1'
 
-ssl_adapter = SSLAdapter('SSLv3')
+
+class HostStats(object):
+
+    """
+    Counts per host. Counts are kept in-process and added to a redis
+    hash every `flush_every` records of `flush_field` so they can be
+    aggregated across workers.
+    """
+    fields = []
+    flush_field = None
+
+    def __init__(self, key, flush_every=settings.NETWORK_STATS_FLUSH_EVERY):
+        self.key = key
+        self.flush_every = flush_every
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.pending = 0
+
+    def record(self, host, field, n=1):
+        with self.lock:
+            f = "{}|{}".format(host, field)
+            self.counts[f] = self.counts.get(f, 0) + n
+            if field == self.flush_field:
+                self.pending += 1
+            if self.pending < self.flush_every:
+                return
+            counts = self.counts
+            self.reset()
+        self.flush(counts)
+
+    def flush(self, counts=None):
+        if counts is None:
+            with self.lock:
+                counts = self.counts
+                self.reset()
+        if not counts:
+            return
+        pipe = rds.pipeline(transaction=False)
+        for f, v in counts.items():
+            pipe.hincrby(self.key, f, v)
+        pipe.execute()
+
+    def totals(self):
+        """
+        host => field => count, across workers.
+        """
+        hosts = {}
+        counts = dict(self.counts)
+        for f, v in rds.hgetall(self.key).items():
+            counts[f] = counts.get(f, 0) + int(v)
+        for f, v in counts.items():
+            host, field = f.rsplit('|', 1)
+            h = hosts.setdefault(host, dict.fromkeys(self.fields, 0))
+            h[field] = h.get(field, 0) + v
+        return hosts
+
+    def summarize(self, h):
+        return h
+
+    def report(self, top=25):
+        """
+        Totals overall and for the `top` hosts
+        we make the most requests to.
+        """
+        hosts = self.totals()
+        overall = dict.fromkeys(self.fields, 0)
+        for h in hosts.values():
+            for f in self.fields:
+                overall[f] += h.get(f, 0)
+        busiest = sorted(hosts.items(), key=lambda x: -x[1][self.flush_field])
+        return {
+            'overall': self.summarize(overall),
+            'hosts': dict([(host, self.summarize(h))
+                           for host, h in busiest[:top]])
+        }
+
+
+def _ratio(n, d):
+    return round(float(n) / d, 4) if d else None
+
+
+class ConnectionStats(HostStats):
+
+    """
+    Requests and new connections per host.
+    Requests which didn't open a connection reused one.
+    """
+    fields = ['requests', 'connections']
+    flush_field = 'requests'
+
+    def summarize(self, h):
+        reused = max(h['requests'] - h['connections'], 0)
+        return {
+            'requests': h['requests'],
+            'connections': h['connections'],
+            'reused': reused,
+            'reuse_ratio': _ratio(reused, h['requests'])
+        }
+
+
+class WaitStats(HostStats):
+
+    """
+    How long requests queued for a domain's limiter.
+    """
+    fields = ['acquired', 'waited', 'wait_ms', 'timeouts']
+    flush_field = 'acquired'
+
+    def summarize(self, h):
+        return {
+            'acquired': h['acquired'],
+            'waited': h['waited'],
+            'wait_ratio': _ratio(h['waited'], h['acquired']),
+            'mean_wait_ms': _ratio(h['wait_ms'], h['acquired']),
+            'mean_queued_wait_ms': _ratio(h['wait_ms'], h['waited']),
+            'timeouts': h['timeouts']
+        }
+
+
+stats = ConnectionStats(settings.NETWORK_STATS_KEY)
+wait_stats = WaitStats(settings.NETWORK_LIMIT_STATS_KEY)
+
+# ARGV: now, rate, burst, concurrency, lease ttl, lease id.
+# Returns "0" once a token and a lease slot are taken, otherwise
+# roughly how many seconds to wait before trying again.
+ACQUIRE_SCRIPT = rds.register_script("""
+local now = tonumber(ARGV[1])
+local rate, burst = tonumber(ARGV[2]), tonumber(ARGV[3])
+local concurrency, lease_ttl = tonumber(ARGV[4]), tonumber(ARGV[5])
+local bucket_key, leases_key = KEYS[1], KEYS[2]
+
+if concurrency > 0 then
+  -- forget leases of workers that died holding them.
+  redis.call('ZREMRANGEBYSCORE', leases_key, '-inf', now)
+  if redis.call('ZCARD', leases_key) >= concurrency then
+    return tostring(math.min(1 / math.max(rate, 1), 0.25))
+  end
+end
+
+if rate > 0 then
+  local b = redis.call('HMGET', bucket_key, 'tokens', 'ts')
+  local tokens = tonumber(b[1]) or burst
+  local ts = tonumber(b[2]) or now
+  tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+  if tokens < 1 then
+    return tostring((1 - tokens) / rate)
+  end
+  redis.call('HMSET', bucket_key, 'tokens', tostring(tokens - 1), 'ts', ARGV[1])
+  redis.call('EXPIRE', bucket_key, math.ceil(burst / rate) + 1)
+end
+
+if concurrency > 0 then
+  redis.call('ZADD', leases_key, now + lease_ttl, ARGV[6])
+  redis.call('EXPIRE', leases_key, math.ceil(lease_ttl) + 1)
+end
+return '0'
+""")
+
+
+class DomainLimiter(object):
+
+    """
+    A token bucket and a concurrency limit per domain, kept in redis so
+    they hold across every worker. Requests wait for a token, refilled
+    at `rate` per second up to `burst`, and for one of `concurrency`
+    leases. After `max_wait` seconds a request goes ahead regardless.
+    Set `rate` or `concurrency` to 0 to disable either limit, and
+    override them per domain in `NETWORK_DOMAIN_LIMITS`.
+    """
+    key_prefix = settings.NETWORK_LIMIT_PREFIX
+    rate = settings.NETWORK_DOMAIN_RATE
+    burst = settings.NETWORK_DOMAIN_BURST
+    concurrency = settings.NETWORK_DOMAIN_CONCURRENCY
+    lease_ttl = settings.NETWORK_DOMAIN_LEASE_TTL
+    max_wait = settings.NETWORK_DOMAIN_MAX_WAIT
+    overrides = settings.NETWORK_DOMAIN_LIMITS
+
+    def domain(self, host):
+        host = (host or '').lower()
+        if host.startswith('www.'):
+            host = host[4:]
+        return host
+
+    def limits(self, domain):
+        """
+        This domain's limits, or those of the closest
+        parent domain that has its own.
+        """
+        limits = {'rate': self.rate, 'burst': self.burst,
+                  'concurrency': self.concurrency}
+        parts = domain.split('.')
+        for i in xrange(len(parts)):
+            d = ".".join(parts[i:])
+            if d in (self.overrides or {}):
+                limits.update(self.overrides[d])
+                break
+        return limits
+
+    def acquire(self, host):
+        """
+        Wait for this host's domain to allow another request. Returns
+        the lease to release afterwards, if one was taken.
+        """
+        domain = self.domain(host)
+        limits = self.limits(domain)
+        if not limits['rate'] and not limits['concurrency']:
+            return None
+        keys = ["{}:{}:bucket".format(self.key_prefix, domain),
+                "{}:{}:leases".format(self.key_prefix, domain)]
+        lease = gen_uuid()
+        start = time.time()
+        while True:
+            wait = float(ACQUIRE_SCRIPT(keys=keys, args=[
+                repr(time.time()), limits['rate'], limits['burst'],
+                limits['concurrency'], self.lease_ttl, lease]))
+            if not wait:
+                break
+            if time.time() - start + wait > self.max_wait:
+                wait_stats.record(domain, 'timeouts')
+                log.warning('Gave up waiting for {} after {:.1f}s.'
+                            .format(domain, time.time() - start))
+                lease = None
+                break
+            time.sleep(wait)
+        waited = time.time() - start
+        if waited >= 0.001:
+            wait_stats.record(domain, 'waited')
+            wait_stats.record(domain, 'wait_ms', int(waited * 1000))
+        wait_stats.record(domain, 'acquired')
+        if not limits['concurrency'] or not lease:
+            return None
+        return keys[1], lease
+
+    def release(self, lease):
+        if lease:
+            rds.zrem(*lease)
+
+
+limiter = DomainLimiter()
+
+
+class PooledAdapter(SSLAdapter):
+
+    """
+    Keeps up to `pool_maxsize` keep-alive connections to each of the
+    `pool_connections` most recently used hosts, counting requests and
+    the connections opened for them. Every request waits on its
+    domain's limiter and holds a lease until its body is read.
+    """
+
+    def __init__(self, ssl_version=None, **kw):
+        kw.setdefault('pool_connections', settings.NETWORK_POOL_HOSTS)
+        kw.setdefault('pool_maxsize', settings.NETWORK_POOL_SIZE_PER_HOST)
+        super(PooledAdapter, self).__init__(ssl_version, **kw)
+
+    def init_poolmanager(self, *args, **kw):
+        super(PooledAdapter, self).init_poolmanager(*args, **kw)
+        new_pool = self.poolmanager._new_pool
+
+        def _new_pool(scheme, host, port, *a, **k):
+            pool = new_pool(scheme, host, port, *a, **k)
+            new_conn = pool._new_conn
+
+            def _new_conn():
+                stats.record(host, 'connections')
+                return new_conn()
+
+            pool._new_conn = _new_conn
+            return pool
+
+        self.poolmanager._new_pool = _new_pool
+
+    def send(self, request, **kw):
+        host = urlparse(request.url).hostname
+        lease = limiter.acquire(host)
+        try:
+            stats.record(host, 'requests')
+            r = super(PooledAdapter, self).send(request, **kw)
+            if not kw.get('stream'):
+                r.content
+            return r
+        finally:
+            limiter.release(lease)
+
+
+# the session, and the process it belongs to.
+_session = None
+_session_pid = None
+_session_lock = Lock()
+
+
+def gen_session(**kw):
+    """
+    This process's shared session. Its connection pools are safe to
+    use from many greenlets at once. A forked worker gets its own
+    rather than sharing its parent's sockets.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            session.mount('http://', PooledAdapter())
+            session.mount('https://', PooledAdapter('SSLv3'))
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def page_key(kind, u, params=None):
+    """
+    A page cache key for a url, ignoring its fragment
+    and the case of its scheme and host.
+    """
+    scheme, netloc, path, query, fragment = urlsplit(u.strip())
+    u = urlunsplit((scheme.lower(), netloc.lower(), path or '/', query, ''))
+    if params:
+        u += repr(sorted(params.items()))
+    if isinstance(u, unicode):
+        u = u.encode('utf-8')
+    return "{}:{}:{}".format(
+        settings.NETWORK_PAGE_CACHE_PREFIX, kind, md5(u).hexdigest())
+
+
+def get_page(kind, u, params=None):
+    """
+    A recently fetched page, or None.
+    """
+    if not settings.NETWORK_PAGE_CACHE_TTL:
+        return None
+    s = rds.get(page_key(kind, u, params))
+    if s is None:
+        return None
+    return cache_to_obj(s)
+
+
+def set_page(kind, urls, params, obj, size):
+    """
+    Remember a fetched page under the url we asked for and
+    the one we were redirected to, unless it's too big.
+    """
+    if not settings.NETWORK_PAGE_CACHE_TTL:
+        return
+    if size > settings.NETWORK_PAGE_CACHE_MAX_BYTES:
+        return
+    s = obj_to_cache(obj, compress_above=settings.CACHE_COMPRESS_ABOVE)
+    pipe = rds.pipeline(transaction=False)
+    for u in set([u for u in urls if u]):
+        pipe.set(page_key(kind, u, params), s,
+                 ex=settings.NETWORK_PAGE_CACHE_TTL)
+    pipe.execute()
+
+
+def alias_page(u, alias):
+    """
+    Serve a page fetched from `u` for `alias` too, eg. when
+    it turns out to be the page's canonical url.
+    """
+    if not settings.NETWORK_PAGE_CACHE_TTL or not u or u == alias:
+        return
+    for kind in ['html', 'validators']:
+        s = rds.get(page_key(kind, u))
+        if s is not None:
+            rds.set(page_key(kind, alias), s,
+                    ex=settings.NETWORK_PAGE_CACHE_TTL)
+
+
+def response_html(response):
+    """
+    A response's html. See `get`.
+    """
+    if response.encoding != FAIL_ENCODING:
+        html = response.text
+    else:
+        html = response.content
+    if html is None:
+        html = ''
+    return html
+
+
+def response_validators(response):
+    """
+    The headers we can send back to ask whether a page has changed.
+    """
+    validators = {}
+    if response.headers.get('etag'):
+        validators['etag'] = response.headers['etag']
+    if response.headers.get('last-modified'):
+        validators['last_modified'] = response.headers['last-modified']
+    return validators
+
+
+def set_html(_u, params, response, html):
+    """
+    Remember a successfully fetched page and its validators.
+    """
+    if not response.ok:
+        return
+    urls = [_u, response.url]
+    set_page('html', urls, params, html, len(response.content))
+    validators = response_validators(response)
+    if validators:
+        set_page('validators', urls, params, validators, 0)
+
+
+def get_validators(_u, **params):
+    """
+    The validators of a page fetched in the last
+    `NETWORK_PAGE_CACHE_TTL` seconds, if it sent any.
+    """
+    return get_page('validators', _u, params)
 
 
 def retry(*dargs, **dkwargs):
@@ -119,15 +548,6 @@ def get_request_kwargs(timeout=None, useragent=None):
     }
 
 
-def gen_session(**kw):
-    """
-    Generate a session.
-    """
-    session = requests.Session()
-    session.mount('https', ssl_adapter)
-    return session
-
-
 @retry(attempts=settings.NETWORK_MAX_RETRIES)
 def get(_u, **params):
     """Retrieves the html for either a url or a response object. All html
@@ -139,19 +559,57 @@ def get(_u, **params):
     """
     if not _u:
         return None
+    html = get_page('html', _u, params)
+    if html is not None:
+        return html
     session = gen_session()
-    html = None
     response = session.get(
         url=_u, params=params, **get_request_kwargs())
-    if response.encoding != FAIL_ENCODING:
-        html = response.text
-    else:
-        html = response.content
-    if html is None:
-        html = ''
+    html = response_html(response)
+    set_html(_u, params, response, html)
     return html
 
 
+@retry(attempts=settings.NETWORK_MAX_RETRIES)
+def is_modified(_u, validators):
+    """
+    Ask whether a page has changed since it sent these validators
+    with a conditional GET. A changed page is kept for the `get`
+    which usually follows.
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    if not headers:
+        return True
+    kw = get_request_kwargs()
+    kw['headers'].update(headers)
+    session = gen_session()
+    response = session.get(url=_u, **kw)
+    if response.status_code == 304:
+        return False
+    set_html(_u, None, response, response_html(response))
+    return True
+
+
+def get_file(_u):
+    """
+    Fetches a file's contents and mimetype.
+    """
+    page = get_page('file', _u)
+    if page is not None:
+        return page
+    session = gen_session()
+    response = session.get(url=_u, **get_request_kwargs())
+    page = (response.content, response.headers.get('content-type', None))
+    if response.ok:
+        set_page('file', [_u, response.url], None, page,
+                 len(response.content))
+    return page
+
+
 @retry(attempts=settings.NETWORK_MAX_RETRIES)
 def get_location(url):
     """
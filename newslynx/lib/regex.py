@@ -57,6 +57,9 @@ re_short_url = re.compile(r"""
     )$                    # end group
 """, re.VERBOSE | re.IGNORECASE)
 
+# the end of a bitly-ish shorturl, to rule most urls out cheaply
+re_short_url_tail = re.compile(r'/[a-z0-9\_\-]{1,12}$', re.IGNORECASE)
+
 # match a bitly-ish shorturl in text
 re_short_url_text = re.compile(r"""
    (                       # start group
@@ -76,6 +79,7 @@ re_index_html = re.compile(r'index\.htm(l)?$')
 re_www = re.compile(r'www\.')
 re_slug = re.compile(r'[^\sA-Za-z0-9]+')
 re_slug_end = re.compile(r'(^[\-]+)|([\-]+)$')
+re_head_end = re.compile(r'</head\s*>', re.IGNORECASE)
 re_url = re.compile(r'https?://[^\s\'\"]+')
 re_bitly_warning = re.compile(r'(https?://bitly\.com/a/warning)|(http?://bit.ly/a/warning)')
 
@@ -9,6 +9,7 @@ from decimal import Decimal
 from inspect import isgenerator
 from collections import Counter
 import pickle
+import cPickle
 import gzip
 import zlib
 import cStringIO
@@ -85,6 +86,20 @@ def obj_to_pickle(obj):
     return pickle.dumps(obj)
 
 
+def bin_pickle_to_obj(s):
+    """
+    binary pickle > obj
+    """
+    return cPickle.loads(s)
+
+
+def obj_to_bin_pickle(obj):
+    """
+    obj > binary pickle
+    """
+    return cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+
+
 def picklegz_to_obj(s):
     """
     pickle.gz > obj
@@ -113,6 +128,47 @@ def zip_to_str(s):
     return zlib.decompress(s)
 
 
+# Cached values are tagged with a marker, the codec they were written
+# with and whether they were compressed. A protocol 0 pickle never
+# starts with the marker so untagged values are read as one.
+CACHE_MARKER = '\x00'
+CACHE_COMPRESSED = 'z'
+CACHE_UNCOMPRESSED = '-'
+CACHE_CODECS = {
+    'pickle': ('0', obj_to_pickle, pickle_to_obj),
+    'binpickle': ('2', obj_to_bin_pickle, bin_pickle_to_obj)
+}
+CACHE_DECODERS = dict([(tag, load) for tag, dump, load in CACHE_CODECS.values()])
+
+
+def obj_to_cache(obj, codec='binpickle', compress_above=None):
+    """
+    obj > tagged cache value, zipped if larger
+    than `compress_above` bytes.
+    """
+    if codec not in CACHE_CODECS:
+        raise ValueError('Unknown cache codec: {}'.format(codec))
+    tag, dump, load = CACHE_CODECS[codec]
+    s = dump(obj)
+    flag = CACHE_UNCOMPRESSED
+    if compress_above is not None and len(s) > compress_above:
+        s = str_to_zip(s)
+        flag = CACHE_COMPRESSED
+    return CACHE_MARKER + tag + flag + s
+
+
+def cache_to_obj(s):
+    """
+    tagged cache value (or bare pickle) > obj
+    """
+    if not s.startswith(CACHE_MARKER):
+        return pickle_to_obj(s)
+    tag, flag, s = s[1], s[2], s[3:]
+    if flag == CACHE_COMPRESSED:
+        s = zip_to_str(s)
+    return CACHE_DECODERS[tag](s)
+
+
 def obj_to_yaml(obj):
     """
     obj > yamlstring
@@ -0,0 +1,177 @@
+"""
+A mergeable quantile sketch with relative-error guarantees.
+
+Values are counted in logarithmically sized buckets: bucket `k` holds
+the positive values in (gamma^(k-1), gamma^k] where
+gamma = (1 + accuracy) / (1 - accuracy). Negative values are bucketed
+by their magnitude and zeros are counted on their own. Because a
+sketch is nothing more than a count per bucket, values can be removed
+as well as added and two sketches merge by adding their counts. This
+is what lets us keep a sketch in a redis hash and update it in place
+as content summaries change, which a t-digest can't do.
+
+Accuracy, relative to the exact `percentile_cont` comparisons:
+
+- Every value read out of the sketch is within `accuracy` (relative)
+  of a value at the same rank in the exact data.
+- Percentiles interpolate linearly between the values at the two
+  neighbouring ranks, just like the exact engine, so a percentile of
+  positive values is within `accuracy` (relative) of the exact result.
+  When the neighbours have opposite signs the error is at most
+  `accuracy * (|lo| + |hi|)`.
+- min, max and median carry the same bound. The count is exact and so
+  is the mean, apart from floating-point drift in the running sum.
+
+With the default accuracy of 0.01 a percentile of 1,000 pageviews
+reads back as a value between 990 and 1,010.
+"""
+import math
+from collections import defaultdict
+
+ZERO = 'z'
+POS = 'p'
+NEG = 'n'
+COUNT = 'count'
+SUM = 'sum'
+
+
+class QuantileSketch(object):
+
+    """
+    Counts of values in logarithmic buckets.
+    """
+
+    def __init__(self, accuracy=0.01):
+        if not 0 < accuracy < 1:
+            raise ValueError('accuracy must be between 0 and 1.')
+        self.accuracy = accuracy
+        self.gamma = (1.0 + accuracy) / (1.0 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.sum = 0.0
+
+    def bucket(self, value):
+        """
+        The bucket a value is counted in.
+        """
+        if value == 0:
+            return ZERO
+        k = int(math.ceil(math.log(abs(value)) / self.log_gamma))
+        return "{}{}".format(POS if value > 0 else NEG, k)
+
+    def bucket_value(self, bucket):
+        """
+        The value a bucket stands for, within `accuracy`
+        of every value it holds.
+        """
+        if bucket == ZERO:
+            return 0.0
+        v = 2.0 * self.gamma ** int(bucket[1:]) / (self.gamma + 1.0)
+        if bucket[0] == NEG:
+            return -v
+        return v
+
+    def add(self, value, count=1):
+        b = self.bucket(value)
+        self.counts[b] += count
+        if not self.counts[b]:
+            self.counts.pop(b)
+        self.count += count
+        self.sum += value * count
+
+    def remove(self, value, count=1):
+        self.add(value, -count)
+
+    def merge(self, other):
+        """
+        Add another sketch's counts to this one.
+        """
+        if other.accuracy != self.accuracy:
+            raise ValueError('Cannot merge sketches of different accuracies.')
+        for b, c in other.counts.items():
+            self.counts[b] += c
+            if not self.counts[b]:
+                self.counts.pop(b)
+        self.count += other.count
+        self.sum += other.sum
+        return self
+
+    def buckets(self, nonzero=False):
+        """
+        (value, count) tuples in ascending order.
+        """
+        bs = []
+        for b, c in self.counts.items():
+            if c <= 0 or (nonzero and b == ZERO):
+                continue
+            bs.append((self.bucket_value(b), c))
+        return sorted(bs)
+
+    def _value_at(self, rank, buckets):
+        seen = 0
+        for v, c in buckets:
+            seen += c
+            if rank < seen:
+                return v
+        return buckets[-1][0]
+
+    def quantile(self, q, nonzero=False):
+        """
+        The `q`th quantile (0 <= q <= 1), interpolated like
+        `numpy.percentile`. None if the sketch is empty.
+        """
+        buckets = self.buckets(nonzero)
+        n = sum([c for v, c in buckets])
+        if not n:
+            return None
+        rank = q * (n - 1)
+        lo = int(math.floor(rank))
+        hi = int(math.ceil(rank))
+        v_lo = self._value_at(lo, buckets)
+        if hi == lo:
+            return v_lo
+        v_hi = self._value_at(hi, buckets)
+        return v_lo + (v_hi - v_lo) * (rank - lo)
+
+    @property
+    def mean(self):
+        if self.count <= 0:
+            return None
+        return self.sum / self.count
+
+    @property
+    def min(self):
+        return self.quantile(0.0)
+
+    @property
+    def max(self):
+        return self.quantile(1.0)
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    def to_fields(self):
+        """
+        Flatten this sketch into hash fields.
+        """
+        d = dict(self.counts.items())
+        d[COUNT] = self.count
+        d[SUM] = self.sum
+        return d
+
+    @classmethod
+    def from_fields(cls, fields, accuracy=0.01):
+        """
+        Load a sketch from hash fields.
+        """
+        s = cls(accuracy)
+        for k, v in fields.items():
+            if k == COUNT:
+                s.count = int(v)
+            elif k == SUM:
+                s.sum = float(v)
+            elif int(v):
+                s.counts[k] = int(v)
+        return s
@@ -6,6 +6,9 @@ From: https://github.com/codelucas/newspaper/blob/master/newspaper/urls.py
 """
 
 import copy
+import logging
+import random
+import re
 import time
 from urlparse import (
     urlparse, urljoin, urlsplit, urlunsplit, parse_qs
@@ -13,14 +16,16 @@ from urlparse import (
 
 import tldextract
 
-from newslynx.lib.common import make_soup
+from newslynx.lib.common import make_soup, parse_page, is_soup
 from newslynx.lib import network
 from newslynx.lib import meta
 from newslynx.lib import html
 from newslynx.util import uniq
-from newslynx.core import settings
+from newslynx.core import settings, rds
 from newslynx.lib.regex import *
 
+log = logging.getLogger(__name__)
+
 # url chunks
 ALLOWED_TYPES = [
     'html', 'htm', 'md', 'rst', 'aspx', 'jsp', 'rhtml', 'cgi',
@@ -62,6 +67,19 @@ IMG_FILETYPES = frozenset([
     'bmp', 'webp', 'tiff', 'svg', 'ico'
 ])
 
+# lookups for classifying urls.
+ALLOWED_TYPE_SET = frozenset(ALLOWED_TYPES)
+GOOD_PATH_SET = frozenset(p.lower() for p in GOOD_PATHS)
+BAD_CHUNK_SET = frozenset(BAD_CHUNKS)
+BAD_DOMAIN_SET = frozenset(BAD_DOMAINS)
+re_video_domains = re.compile('|'.join(re.escape(d) for d in VIDEO_DOMAINS))
+
+# tldextract's results by host and regex results by domain,
+# each cleared once it holds this many.
+HOST_CACHE_SIZE = 10000
+_hosts = {}
+_domains = {}
+
 REDIRECT_QUERY_PARAMS = ['url', 'u']
 
 KEEP_PARAMS = ('id', 'p', 'v', 'story_fbid')
@@ -75,6 +93,9 @@ def prepare(url, source=None, canonicalize=True, expand=True, keep_params=KEEP_P
     by checking the page source's metadata.
 
     All urls that enter `merlynne` are first treated with this function.
+
+    Hosts whose canonical urls have reliably been a rewrite of the urls
+    we fetched (see `learn_rule`) are canonicalized without a fetch.
     """
     if not url or url == "":
         return None
@@ -109,18 +130,39 @@ def prepare(url, source=None, canonicalize=True, expand=True, keep_params=KEEP_P
             url = unshorten(url, attempts=1)
 
     # canonicalize
+    fetched = None
+    learn = False
     if canonicalize:
-        page_html = network.get(url)
-        if page_html:
-            soup = make_soup(page_html)
-            _url = meta.canonical_url(soup)
-            if _url:
-                url = _url
+        rule = get_rule(url)
+        if rule:
+            url = apply_rule(url, rule)
+        else:
+            fetched = url
+            page_html = network.get(url)
+            if page_html:
+                learn = True
+                soup = parse_page(page_html)
+                _url = meta.canonical_url(soup)
+                if _url:
+                    url = _url
 
     # if it got converted to None, return
     if not url:
         return None
 
+    url = _tidy(url, keep_params)
+    if learn:
+        learn_rule(fetched, url, keep_params)
+
+    # extraction will fetch the prepared url next.
+    network.alias_page(fetched, url)
+    return url
+
+
+def _tidy(url, keep_params):
+    """
+    The last steps of `prepare`.
+    """
     # remove arguments w/ optional parameters to keep.
     url = remove_args(url, keep_params)
 
@@ -133,6 +175,74 @@ def prepare(url, source=None, canonicalize=True, expand=True, keep_params=KEEP_P
     return url
 
 
+# LEARNED CANONICALIZATION RULES #
+
+# a host's rule is the scheme and host its pages' canonical urls use,
+# stored alongside how many canonicalizations in a row it has matched.
+# an empty rule means the canonical urls aren't a simple rewrite.
+LEARN_SCRIPT = rds.register_script("""
+local rule = redis.call('HGET', KEYS[1], 'rule')
+if rule == ARGV[1] then
+    redis.call('HINCRBY', KEYS[1], 'hits', 1)
+else
+    redis.call('HMSET', KEYS[1], 'rule', ARGV[1], 'hits', 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return rule
+""")
+
+
+def rule_key(url):
+    """
+    The key of the rule for a url's host.
+    """
+    host = urlsplit(url).netloc.lower()
+    return "{}:{}".format(settings.URL_RULE_PREFIX, host)
+
+
+def apply_rule(url, rule):
+    """
+    Swap a url's scheme and host for a rule's.
+    """
+    scheme, host = rule.split('://', 1)
+    parts = urlsplit(url)
+    return urlunsplit((scheme, host) + parts[2:])
+
+
+def learn_rule(fetched, canonical, keep_params=KEEP_PARAMS):
+    """
+    Record whether a fetched url's prepared, canonical url was just
+    a rewrite of its scheme and host.
+    """
+    if not settings.URL_RULE_MIN_HITS:
+        return
+    parts = urlsplit(canonical)
+    rule = "{}://{}".format(parts.scheme, parts.netloc)
+    if _tidy(apply_rule(fetched, rule), keep_params) != canonical:
+        rule = ""
+    prev = LEARN_SCRIPT(keys=[rule_key(fetched)],
+                        args=[rule, settings.URL_RULE_TTL])
+    if prev and prev != rule:
+        log.info("Canonical urls for {} no longer match {}."
+                 .format(get_domain(fetched), prev))
+
+
+def get_rule(url):
+    """
+    The rule to canonicalize a url with instead of fetching it, if
+    its host has one we trust. A sample of urls are fetched anyway
+    to keep checking the rule.
+    """
+    if not settings.URL_RULE_MIN_HITS:
+        return None
+    if random.random() < settings.URL_RULE_SAMPLE_RATE:
+        return None
+    rule, hits = rds.hmget(rule_key(url), 'rule', 'hits')
+    if not rule or int(hits) < settings.URL_RULE_MIN_HITS:
+        return None
+    return rule
+
+
 def join(base, path):
     """
     Join two url elements.
@@ -213,8 +323,36 @@ def get_simple_domain(url, **kw):
     if url is None:
         return None
     domain = get_domain(url)
-    tld_dat = tldextract.extract(domain, **kw)
-    return tld_dat.domain
+    if kw:
+        return tldextract.extract(domain, **kw).domain
+    return split_host(domain).domain
+
+
+def split_host(host):
+    """
+    tldextract's (subdomain, domain, suffix) for a host. Links
+    mostly point at a few hosts, so these are remembered.
+    """
+    parts = _hosts.get(host)
+    if parts is None:
+        if len(_hosts) >= HOST_CACHE_SIZE:
+            _hosts.clear()
+        parts = _hosts[host] = tldextract.extract(host)
+    return parts
+
+
+def _domain_flags(domain):
+    """
+    Whether a domain is a known url shortener, and whether it's a video site.
+    """
+    flags = _domains.get(domain)
+    if flags is None:
+        if len(_domains) >= HOST_CACHE_SIZE:
+            _domains.clear()
+        flags = _domains[domain] = (
+            re_short_domains.search(domain) is not None,
+            re_video_domains.search(domain) is not None)
+    return flags
 
 
 def get_scheme(url, **kw):
@@ -323,11 +461,19 @@ def get_filetype(url, **kw):
     if url is None:
         return None
 
+    parsed = urlparse(url, **kw)
+
     # check for missing scheme
-    if not get_scheme(url):
-        url = "http://" + url
+    if not parsed.scheme:
+        parsed = urlparse("http://" + url, **kw)
+
+    return _filetype(parsed.path)
+
 
-    path = get_path(url, **kw)
+def _filetype(path):
+    """
+    The filetype at the end of a url's path, or None.
+    """
     # Eliminate the trailing '/', we are extracting the file
     if path.endswith('/'):
         path = path[:-1]
@@ -381,7 +527,29 @@ def is_article(url, pattern=None):
     if r1 or r2:
         return False
 
-    path = urlparse(url).path
+    return _is_article(url, _parse(url))
+
+
+def _parse(url):
+    """
+    Parse a url once for classifying it. Returns its path and host as
+    given and, assuming http if it's missing a scheme, its domain
+    without www and its filetype.
+    """
+    parsed = urlparse(url)
+    path, host = parsed.path, parsed.netloc
+    if not parsed.scheme:
+        parsed = urlparse("http://" + url)
+    domain = re_www.sub('', parsed.netloc)
+    return path, host or parsed.netloc, domain, _filetype(parsed.path)
+
+
+def _is_article(url, parsed):
+    """
+    is_article's checks of a url's path and domain,
+    with the url already parsed.
+    """
+    path, host, domain, file_type = parsed
     if not path:
         return None
 
@@ -398,10 +566,8 @@ def is_article(url, pattern=None):
 
     # siphon out the file type. eg: .html, .htm, .md
     if len(path_chunks) > 0:
-        file_type = get_filetype(url)
-
         # if the file type is a media type, reject instantly
-        if file_type and file_type not in ALLOWED_TYPES:
+        if file_type and file_type not in ALLOWED_TYPE_SET:
             return False
 
         last_chunk = path_chunks[-1].split('.')
@@ -414,13 +580,13 @@ def is_article(url, pattern=None):
         path_chunks.remove('index')
 
     # extract the tld (top level domain)
-    tld_dat = tldextract.extract(url)
+    tld_dat = split_host(host)
     subd = tld_dat.subdomain
     tld = tld_dat.domain.lower()
 
     url_slug = path_chunks[-1] if path_chunks else u''
 
-    if tld in BAD_DOMAINS:
+    if tld in BAD_DOMAIN_SET:
         return False
 
     if len(path_chunks) == 0:
@@ -446,9 +612,8 @@ def is_article(url, pattern=None):
 
     # Check for subdomain & path red flags
     # Eg: http://cnn.com/careers.html or careers.cnn.com --> BAD
-    for b in BAD_CHUNKS:
-        if b in path_chunks or b == subd:
-            return False
+    if subd in BAD_CHUNK_SET or not BAD_CHUNK_SET.isdisjoint(path_chunks):
+        return False
 
     match_date = re_url_date.search(url)
 
@@ -456,9 +621,8 @@ def is_article(url, pattern=None):
     if match_date:
         return True
 
-    for GOOD in GOOD_PATHS:
-        if GOOD.lower() in [p.lower() for p in path_chunks]:
-            return True
+    if not GOOD_PATH_SET.isdisjoint(p.lower() for p in path_chunks):
+        return True
 
     return False
 
@@ -470,10 +634,7 @@ def is_video(url):
     domain = get_domain(url)
     if not domain:
         return False
-    for video_domain in VIDEO_DOMAINS:
-        if video_domain in domain:
-            return True
-    return False
+    return _domain_flags(domain)[1]
 
 
 def is_internal(url, source_domain):
@@ -510,18 +671,51 @@ def is_shortened(url, pattern=None):
         if pattern.match(url):
             return True
 
+    return _is_shortened(url, get_domain(url))
+
+
+def _is_shortened(url, domain):
+    """
+    is_shortened, with the url's domain already parsed.
+    """
     # test against known short domains
-    domain = get_domain(url)
-    if re_short_domains.search(domain):
+    if _domain_flags(domain)[0]:
         return True
 
     # test against bitly-ish short url pattern
-    if re_short_url.search(url):
+    tail = url[url.rfind('/'):]
+    if re_short_url_tail.match(tail) and re_short_url.search(url):
         return True
 
     return False
 
 
+def classify_many(urls, source_domain=None):
+    """
+    Classify many urls, parsing each one only once. Returns a dict
+    for each url, in order, of whether it's an article, a video, an
+    image, shortened or (given a source domain) internal.
+    """
+    results = []
+    for u in urls:
+        parsed = _parse(u)
+        path, host, domain, file_type = parsed
+        internal = None
+        if source_domain is not None:
+            internal = source_domain in domain or domain in source_domain
+        results.append({
+            'url': u,
+            'article': (len(u) >= 11 and 'mailto:' not in u and
+                        ('http://' in u or 'https://' in u) and
+                        bool(_is_article(u, parsed))),
+            'video': bool(domain) and _domain_flags(domain)[1],
+            'image': file_type in IMG_FILETYPES,
+            'shortened': _is_shortened(u, domain),
+            'internal': internal
+        })
+    return results
+
+
 def is_abs(url):
     """
     check if a url is absolute.
@@ -572,8 +766,8 @@ def from_string(string, **kw):
 
 def from_html(htmlstring, **kw):
     """
-    Extract urls from htmlstring, optionally reconciling
-    relative urls + embeds + redirects.
+    Extract urls from htmlstring (or a parsed page or element),
+    optionally reconciling relative urls + embeds + redirects.
     """
     source = kw.get('source', None)
     exclude_images = kw.get('excl_img', True)
@@ -583,7 +777,7 @@ def from_html(htmlstring, **kw):
     final_urls = []
     if source:
         source_domain = get_domain(source)
-    soup = make_soup(htmlstring)
+    soup = htmlstring if is_soup(htmlstring) else make_soup(htmlstring)
     for tag in URL_TAGS:
 
         for el in soup.find_all(tag):
@@ -614,6 +808,10 @@ def from_any(html_or_string, **kw):
     """
     Parse urls out of html or raw string.
     """
+    if html_or_string is None:
+        return []
+    if is_soup(html_or_string):
+        return from_html(html_or_string, **kw)
     if not html_or_string:
         return []
     if html.is_html(html_or_string):
@@ -744,28 +942,26 @@ def categorize_links(links, source_domain):
         'shortened': []
     }
 
-    for l in links:
-
-        # check it it's internal / external
-        internal = is_internal(l, source_domain)
+    for c in classify_many(links, source_domain):
+        l = c['url']
 
         # is it shortened
-        if is_shortened(l):
+        if c['shortened']:
             data['shortened'].append(l)
 
         # is it an article
-        elif is_article(l):
-            if internal:
+        elif c['article']:
+            if c['internal']:
                 data['articles']['internal'].append(l)
             else:
                 data['articles']['external'].append(l)
 
         # is it a video
-        elif is_video(l):
+        elif c['video']:
             data['videos'].append(l)
 
         # fallback on internal / external.
-        elif internal:
+        elif c['internal']:
             data['internal'].append(l)
         else:
             data['external'].append(l)
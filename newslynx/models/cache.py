@@ -1,9 +1,125 @@
+"""
+A two-tier cache: an optional in-process LRU in front of redis.
+
+Concurrent misses on a key are coalesced: greenlets in one process
+wait on a single in-flight computation, and workers across processes
+take a short redis lease so only one of them does the work while the
+others poll for its result.
+
+Empty results can be cached for a shorter `negative_ttl` so that dead
+links aren't re-fetched on every request. With a `stale_ttl`, entries
+are kept that much longer than their ttl and, once expired, are served
+as they are while a background greenlet refreshes them.
+"""
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
 from hashlib import md5
+from threading import Lock
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.pool import Pool
+from redis import ResponseError
 
 from newslynx.core import rds
+from newslynx.core import settings
 from newslynx.lib import dates
+from newslynx.util import gen_uuid, chunk_iter
 from newslynx.lib.serialize import (
-    obj_to_pickle, pickle_to_obj)
+    obj_to_cache, cache_to_obj)
+
+log = logging.getLogger(__name__)
+
+# a value and its last modified time, stored as one redis entry.
+CacheEntry = namedtuple('CacheEntry', ['value', 'last_modified'])
+
+# per-process tiers and hit counts, by cache class.
+_local_caches = {}
+_cache_stats = {}
+
+# per-process computations in flight, by key.
+_in_flight = {}
+
+# keys being refreshed in the background.
+_revalidating = set()
+
+# only release a lease we still hold.
+RELEASE_LOCK = rds.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def scan_prefix(prefix, count=settings.CACHE_SCAN_COUNT):
+    """
+    Iterate over the keys under a prefix with SCAN,
+    which unlike KEYS doesn't block redis.
+    """
+    return rds.scan_iter(match="{}*".format(prefix), count=count)
+
+
+def flush_prefix(prefix, count=settings.CACHE_SCAN_COUNT):
+    """
+    Delete the keys under a prefix in pipelined batches.
+    Returns the number of keys deleted.
+    """
+    n = 0
+    for keys in chunk_iter(scan_prefix(prefix, count), count):
+        pipe = rds.pipeline(transaction=False)
+        for k in keys:
+            pipe.delete(k)
+        n += sum(pipe.execute())
+    return n
+
+
+def count_prefix(prefix, count=settings.CACHE_SCAN_COUNT):
+    """
+    The number of keys under a prefix.
+    """
+    return sum(1 for _ in scan_prefix(prefix, count))
+
+
+def prefix_memory(prefix, count=settings.CACHE_SCAN_COUNT):
+    """
+    The number of keys under a prefix and the bytes they use,
+    according to MEMORY USAGE. Servers older than redis 4 don't
+    have it so we fall back on the size of each key's DUMP.
+    """
+    keys = 0
+    size = 0
+    use_dump = False
+    for batch in chunk_iter(scan_prefix(prefix, count), count):
+        pipe = rds.pipeline(transaction=False)
+        for k in batch:
+            if use_dump:
+                pipe.dump(k)
+            else:
+                pipe.execute_command('MEMORY', 'USAGE', k)
+        try:
+            results = pipe.execute()
+        except ResponseError:
+            if use_dump:
+                raise
+            use_dump = True
+            pipe = rds.pipeline(transaction=False)
+            for k in batch:
+                pipe.dump(k)
+            results = pipe.execute()
+        for r in results:
+            if r is None:
+                continue
+            keys += 1
+            size += len(r) if use_dump else int(r)
+    return {
+        'keys': keys,
+        'bytes': size,
+        'mean_bytes': round(float(size) / keys, 2) if keys else None,
+        'estimate': 'dump' if use_dump else 'memory-usage'
+    }
 
 
 class CacheResponse(object):
@@ -17,6 +133,7 @@ class CacheResponse(object):
         self.value = value
         self.last_modified = last_modified
         self.is_cached = is_cached
+        self.failures = {}
 
     @property
     def age(self):
@@ -25,22 +142,176 @@ class CacheResponse(object):
         return 0
 
     def to_dict(self):
-        return {
+        d = {
             'key': self.key,
             'last_modified': self.last_modified,
             'age': self.age,
             'is_cached': self.is_cached
         }
+        if self.failures:
+            d['failures'] = self.failures
+        return d
+
+
+class LocalCache(object):
+
+    """
+    A bounded, in-process LRU of cache entries.
+    """
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.pop(key, None)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires is not None and expires < time.time():
+                return None
+            self.entries[key] = item
+            return entry
+
+    def set(self, key, entry, ttl=None):
+        ttls = [t for t in [ttl, self.ttl] if t]
+        expires = time.time() + min(ttls) if len(ttls) else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires, entry)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CacheStats(object):
+
+    """
+    Hits per tier. Counts are kept in-process and added to a redis
+    hash every so often so they can be aggregated across workers.
+    """
+    fields = ['local_hits', 'redis_hits', 'coalesced', 'misses']
+
+    # counted on top of the lookups above.
+    extra_fields = ['stale_hits', 'revalidations', 'validations', 'validated']
+
+    def __init__(self, key, flush_every=settings.CACHE_STATS_FLUSH_EVERY):
+        self.key = key
+        self.flush_every = flush_every
+        self.reset()
+
+    def reset(self):
+        self.counts = dict.fromkeys(self.fields + self.extra_fields, 0)
+        self.pending = 0
+
+    def record(self, field):
+        self.counts[field] += 1
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        counts = self.counts
+        self.reset()
+        pipe = rds.pipeline(transaction=False)
+        for k, v in counts.items():
+            if v:
+                pipe.hincrby(self.key, k, v)
+        pipe.execute()
+
+    def totals(self):
+        totals = dict(self.counts)
+        for k, v in rds.hgetall(self.key).items():
+            if k in totals:
+                totals[k] += int(v)
+        return totals
+
+    def report(self):
+        """
+        Lookups, hits and hit ratios per tier.
+        """
+        def ratio(n, d):
+            return round(float(n) / d, 4) if d else None
+
+        t = self.totals()
+        lookups = sum([t[f] for f in self.fields])
+        redis_lookups = lookups - t['local_hits']
+        return {
+            'lookups': lookups,
+            'misses': t['misses'],
+            'hit_ratio': ratio(lookups - t['misses'], lookups),
+            'local': {
+                'hits': t['local_hits'],
+                'hit_ratio': ratio(t['local_hits'], lookups)
+            },
+            'redis': {
+                'hits': t['redis_hits'],
+                'hit_ratio': ratio(t['redis_hits'], redis_lookups)
+            },
+            'coalesced': t['coalesced'],
+            'stale': {
+                'hits': t['stale_hits'],
+                'revalidations': t['revalidations']
+            },
+            'validation': {
+                'checks': t['validations'],
+                'unchanged': t['validated'],
+                'unchanged_ratio': ratio(t['validated'], t['validations'])
+            }
+        }
 
 
 class Cache(object):
 
     """
     An abstract Cache object to inherit from.
+
+    Set `local_size` to keep up to that many entries in an in-process
+    LRU in front of redis for at most `local_ttl` seconds. Other
+    processes' invalidations are only seen once a local entry expires.
+    Set `local_copy` if callers may mutate the values they get back.
+
+    Workers hold a `lock_ttl` second lease while they compute a value
+    and others poll for it every `lock_poll` seconds. Set `lock_ttl` to
+    roughly the longest `work` should take.
+
+    Set `negative_ttl` to cache empty results for that many seconds and
+    `stale_ttl` to serve expired entries for up to that many seconds
+    while they're refreshed in the background. Set `validate_ttl` to
+    keep expired entries that much longer and implement `validate` to
+    renew those that are still good instead of redoing their work.
+
+    Values are written with `codec` (see `newslynx.lib.serialize`) and
+    zipped when larger than `compress_above` bytes. Values written with
+    any codec, or as bare pickles by older versions, can always be read.
     """
     redis = rds
     ttl = 84600  # 1 day
     key_prefix = None
+    local_size = 0
+    local_ttl = None
+    local_copy = False
+    lock_ttl = settings.CACHE_LOCK_TTL
+    lock_poll = settings.CACHE_LOCK_POLL_INTERVAL
+    pool_size = settings.CACHE_POOL_SIZE
+    negative_ttl = None
+    stale_ttl = 0
+    validate_ttl = 0
+    codec = settings.CACHE_CODEC
+    compress_above = settings.CACHE_COMPRESS_ABOVE
 
     def __init__(self, debug=False):
         self.debug = debug
@@ -50,14 +321,14 @@ class Cache(object):
         The function for serializing the object
         returned from `get` to a string.
         """
-        return obj_to_pickle(obj)
+        return obj_to_cache(obj, self.codec, self.compress_above)
 
     def deserialize(self, s):
         """
         The function for deserializing the string
         returned from redis
         """
-        return pickle_to_obj(s)
+        return cache_to_obj(s)
 
     def work(self, *args, **kw):
         """
@@ -65,23 +336,52 @@ class Cache(object):
         """
         raise NotImplemented
 
+    @classmethod
+    def local(cls):
+        """
+        This class's in-process tier, if it has one.
+        """
+        if not cls.local_size:
+            return None
+        if cls not in _local_caches:
+            _local_caches[cls] = LocalCache(cls.local_size, cls.local_ttl)
+        return _local_caches[cls]
+
+    @classmethod
+    def stats(cls):
+        """
+        This class's hit counter.
+        """
+        if cls not in _cache_stats:
+            _cache_stats[cls] = CacheStats(
+                "{}:stats:{}".format(cls.key_prefix, cls.__name__))
+        return _cache_stats[cls]
+
     @classmethod
     def flush(cls):
         """
-        Flush this cache.
+        Flush this cache without blocking redis.
         """
-        for k in cls.redis.keys():
-            if k.startswith(cls.key_prefix):
-                cls.redis.delete(k)
+        n = flush_prefix(cls.key_prefix)
+        if cls.local():
+            cls.local().clear()
+        cls.stats().reset()
+        return n
 
     def exists(self, *args, **kw):
-        return self.redis.get(self.format_key(*args, **kw)) is not None
+        key = self.format_key(*args, **kw)
+        if self.local() and self.local().get(key):
+            return True
+        return self.redis.get(key) is not None
 
     def invalidate(self, *args, **kw):
         """
         Remove a key from the cache.
         """
-        self.redis.delete(self.format_key(*args, **kw))
+        key = self.format_key(*args, **kw)
+        self.redis.delete(key, self.last_modified_key(key))
+        if self.local():
+            self.local().delete(key)
 
     def format_key(self, *args, **kw):
         """
@@ -103,53 +403,317 @@ class Cache(object):
         hash_str = md5("".join(hash_keys)).hexdigest()
         return "{}:{}".format(self.key_prefix, hash_str)
 
-    def get(self, *args, **kw):
+    def lock_key(self, key):
+        return "{}:lock".format(key)
+
+    def last_modified_key(self, key):
         """
-        The main get/cache function.
+        Where last modified times were kept before they
+        were stored alongside their values.
         """
-        # get a custom ttl, fallback on default
-        ttl = kw.pop('ttl', self.ttl)
-
-        # format the key
-        key = self.format_key(*args, **kw)
-
-        # last modified key
-        lm_key = "{}:last_modified".format(key)
+        return "{}:last_modified".format(key)
 
-        # attempt to get the object from redis
-        if not self.debug:
-            obj = self.redis.get(key)
-        else:
-            obj = None
+    def get_entry(self, key):
+        """
+        Fetch and deserialize an entry from redis.
+        """
+        return self.load_entry(key, self.redis.get(key))
 
-        # if it doesn't exist, proceed with work
-        if not obj:
+    def load_entry(self, key, s):
+        """
+        Deserialize an entry fetched from redis.
+        """
+        if not s:
+            return None
+        obj = self.deserialize(s)
+        if isinstance(obj, CacheEntry):
+            return obj
+        lm = self.redis.get(self.last_modified_key(key))
+        return CacheEntry(obj, dates.parse_iso(lm) if lm else dates.now())
+
+    def set_local(self, key, entry, ttl):
+        if not self.local():
+            return
+        if self.local_copy:
+            entry = deepcopy(entry)
+        self.local().set(key, entry, ttl)
+
+    def is_expired(self, entry, ttl):
+        """
+        Whether an entry has outlived its ttl and is only being
+        kept around to serve while it's refreshed or to validate.
+        """
+        if not self.stale_ttl and not self.validate_ttl:
+            return False
+        if not entry.value:
+            ttl = self.negative_ttl or ttl
+        age = (dates.now() - entry.last_modified).total_seconds()
+        return age > ttl
+
+    def revalidate(self, key, ttl, *args, **kw):
+        """
+        Refresh a stale entry in the background unless this
+        or another process is already doing so.
+        """
+        if key in _revalidating or key in _in_flight:
+            return
+        _revalidating.add(key)
+        gevent.spawn(self._revalidate, key, ttl, *args, **kw)
+
+    def _revalidate(self, key, ttl, *args, **kw):
+        lock = self.lock_key(key)
+        token = gen_uuid()
+        try:
+            if not self.redis.set(lock, token, nx=True,
+                                  px=int(self.lock_ttl * 1000)):
+                return
+            try:
+                self.compute(key, ttl, *args, revalidating=True, **kw)
+            finally:
+                RELEASE_LOCK(keys=[lock], args=[token])
+        except Exception:
+            log.exception('Error refreshing {}'.format(key))
+        finally:
+            _revalidating.discard(key)
+
+    def hit(self, key, entry, ttl, args, kw, tier):
+        """
+        A response for a cached entry, refreshing it if stale.
+        Expired entries we can't serve stale are misses.
+        """
+        if self.is_expired(entry, ttl):
+            if not self.stale_ttl:
+                return None
+            self.stats().record('stale_hits')
+            self.revalidate(key, ttl, *args, **kw)
+        self.stats().record(tier)
+        return CacheResponse(key, entry.value, entry.last_modified, True)
+
+    def lookup_local(self, key, ttl, args, kw):
+        """
+        Look for an entry in the local tier.
+        """
+        local = self.local()
+        entry = local.get(key) if local else None
+        if not entry:
+            return None
+        if self.local_copy:
+            entry = CacheEntry(deepcopy(entry.value), entry.last_modified)
+        return self.hit(key, entry, ttl, args, kw, 'local_hits')
+
+    def redis_hit(self, key, entry, ttl, args, kw):
+        cr = self.hit(key, entry, ttl, args, kw, 'redis_hits')
+        if cr:
+            self.set_local(key, entry, ttl)
+        return cr
+
+    def lookup(self, key, ttl, args, kw):
+        """
+        Look for an entry in the local tier, then redis.
+        """
+        cr = self.lookup_local(key, ttl, args, kw)
+        if cr:
+            return cr
+        entry = self.get_entry(key)
+        if entry:
+            return self.redis_hit(key, entry, ttl, args, kw)
+        return None
+
+    def keep_ttl(self, ttl):
+        """
+        How long redis keeps an entry: expired entries are kept
+        around to serve stale or to validate.
+        """
+        return ttl + max(self.stale_ttl, self.validate_ttl)
 
-            # not cached
-            is_cached = False
+    def store(self, key, entry, ttl):
+        """
+        Cache an entry in redis and the local tier.
+        """
+        self.redis.set(key, self.serialize(entry), ex=self.keep_ttl(ttl))
+        self.set_local(key, entry, ttl)
 
-            obj = self.work(*args, **kw)
+    def validate(self, key, entry, ttl, *args, **kw):
+        """
+        Whether an expired entry is still good, eg. because its
+        source hasn't changed. Only used when `validate_ttl` is set.
+        """
+        return False
 
-            # if the worker returns None, break out
-            if not obj:
+    def validated(self, key, ttl, *args, **kw):
+        """
+        Renew an expired entry that's still good rather than
+        redoing its work.
+        """
+        old = self.get_entry(key)
+        if not old or not old.value:
+            return None
+        self.stats().record('validations')
+        if not self.validate(key, old, ttl, *args, **kw):
+            return None
+        self.stats().record('validated')
+        entry = CacheEntry(old.value, dates.now())
+        self.store(key, entry, ttl)
+        return CacheResponse(key, entry.value, entry.last_modified, True)
+
+    def compute(self, key, ttl, *args, **kw):
+        """
+        Do the work and cache its result.
+        """
+        revalidating = kw.pop('revalidating', False)
+        if revalidating:
+            self.stats().record('revalidations')
+        elif not self.debug:
+            self.stats().record('misses')
+
+        if self.validate_ttl and not self.debug:
+            cr = self.validated(key, ttl, *args, **kw)
+            if cr:
+                return cr
+
+        obj = self.work(*args, **kw)
+        entry = CacheEntry(obj, dates.now())
+
+        # if the worker returns None, only remember that for a while.
+        # a failed refresh keeps serving the stale value instead.
+        if not obj:
+            if revalidating or not self.negative_ttl:
                 return CacheResponse(key, obj, None, False)
+            self.store(key, entry, self.negative_ttl)
+            return CacheResponse(key, obj, entry.last_modified, False)
 
-            # set the object in redis at the specified
-            # key with the specified ttl
-            self.redis.set(key, self.serialize(obj), ex=ttl)
-
-            # set the last modified time
-            last_modified = dates.now()
-            self.redis.set(lm_key, last_modified.isoformat(), ex=ttl)
+        # set the object and its last modified time in redis
+        # at the specified key with the specified ttl
+        self.store(key, entry, ttl)
+        return CacheResponse(key, obj, entry.last_modified, False)
 
+    def coalesced(self, key, ttl):
+        """
+        A value another worker computed while we waited.
+        """
+        entry = self.get_entry(key)
+        if not entry or self.is_expired(entry, ttl):
+            return None
+        self.stats().record('coalesced')
+        self.set_local(key, entry, ttl)
+        return CacheResponse(key, entry.value, entry.last_modified, False)
+
+    def fill(self, key, ttl, *args, **kw):
+        """
+        Compute a value under a redis lease, or wait for
+        the worker holding it to cache the value.
+        """
+        lock = self.lock_key(key)
+        token = gen_uuid()
+        deadline = time.time() + self.lock_ttl
+        while time.time() < deadline:
+            if self.redis.set(lock, token, nx=True,
+                              px=int(self.lock_ttl * 1000)):
+                try:
+                    # someone may have just finished.
+                    cr = None if self.debug else self.coalesced(key, ttl)
+                    return cr or self.compute(key, ttl, *args, **kw)
+                finally:
+                    RELEASE_LOCK(keys=[lock], args=[token])
+
+            gevent.sleep(self.lock_poll)
+            cr = self.coalesced(key, ttl)
+            if cr:
+                return cr
+
+        # the lease holder is taking too long.
+        return self.compute(key, ttl, *args, **kw)
+
+    def coalesce(self, key, ttl, *args, **kw):
+        """
+        Wait on this key's in-flight computation in this
+        process, or start one.
+        """
+        flight = _in_flight.get(key)
+        if flight is not None:
+            self.stats().record('coalesced')
+            cr = flight.get()
+            if not self.local_copy:
+                return cr
+            copy = CacheResponse(cr.key, deepcopy(cr.value),
+                                 cr.last_modified, cr.is_cached)
+            copy.failures = cr.failures
+            return copy
+
+        flight = _in_flight[key] = AsyncResult()
+        try:
+            cr = self.fill(key, ttl, *args, **kw)
+        except Exception as e:
+            flight.set_exception(e)
+            raise
         else:
-            # is cached
-            is_cached = True
+            flight.set(cr)
+        finally:
+            _in_flight.pop(key, None)
+        return cr
 
-            # if it does exist, deserialize it.
-            obj = self.deserialize(obj)
+    def get(self, *args, **kw):
+        """
+        The main get/cache function.
+        """
+        # get a custom ttl, fallback on default
+        ttl = kw.pop('ttl', self.ttl)
+
+        # format the key
+        key = self.format_key(*args, **kw)
 
-            # get the cached last modified time
-            last_modified = dates.parse_iso(self.redis.get(lm_key))
+        # attempt to get the entry from the local tier, then redis.
+        if not self.debug:
+            cr = self.lookup(key, ttl, args, kw)
+            if cr:
+                return cr
+
+        # if it doesn't exist, proceed with work
+        return self.coalesce(key, ttl, *args, **kw)
 
-        return CacheResponse(key, obj, last_modified, is_cached)
+    def get_many(self, keys, **kw):
+        """
+        Get many values at once. Each key is the positional argument
+        (or a tuple of them) that would be passed to `get`, and any
+        kwargs apply to all of them. Hits are fetched with a single
+        MGET and misses are computed concurrently.
+        Returns a dictionary of key => CacheResponse.
+        """
+        ttl = kw.pop('ttl', self.ttl)
+        args = {}
+        rkeys = {}
+        for k in keys:
+            args[k] = k if isinstance(k, tuple) else (k,)
+            rkeys[k] = self.format_key(*args[k], **kw)
+
+        responses = {}
+        misses = rkeys.keys()
+        if not self.debug:
+            remote = []
+            for k in misses:
+                cr = self.lookup_local(rkeys[k], ttl, args[k], kw)
+                if cr:
+                    responses[k] = cr
+                else:
+                    remote.append(k)
+            misses = []
+            if len(remote):
+                values = self.redis.mget([rkeys[k] for k in remote])
+                for k, s in zip(remote, values):
+                    entry = self.load_entry(rkeys[k], s)
+                    cr = None
+                    if entry:
+                        cr = self.redis_hit(rkeys[k], entry, ttl, args[k], kw)
+                    if cr:
+                        responses[k] = cr
+                    else:
+                        misses.append(k)
+
+        def fx(k):
+            return k, self.coalesce(rkeys[k], ttl, *args[k], **kw)
+
+        if len(misses):
+            pool = Pool(self.pool_size)
+            for k, cr in pool.imap_unordered(fx, misses):
+                responses[k] = cr
+        return responses
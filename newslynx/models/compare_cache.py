@@ -1,11 +1,20 @@
 """
 Compute and cache content metric comparisons.
+
+Each comparison type computes its facets concurrently, each on its own
+session; `newslynx.core` makes psycopg2 cooperative so their queries
+overlap. Every facet is also cached on its own along with a fingerprint
+of its items and when their rows last changed, so a refresh only
+recomputes the facets whose items or metrics have changed. Facets which
+fail are reported on the response and retried on the next request.
 """
+import logging
+
 from gevent.pool import Pool
 
 from sqlalchemy import func
 
-from newslynx.core import db
+from newslynx.core import db, gen_session
 from newslynx.tasks.compare_metric import ContentComparison
 from newslynx.core import settings
 from newslynx.models import (
@@ -16,15 +25,62 @@ from newslynx.models.relations import (
 
 from newslynx.models.cache import Cache
 
+log = logging.getLogger(__name__)
+
 
-class ComparisonCache(Cache):
+class BaseComparisonCache(Cache):
+
+    """
+    Record failures alongside a comparison and recompute it
+    until it succeeds.
+    """
     key_prefix = settings.COMPARISON_CACHE_PREFIX
     ttl = settings.COMPARISON_CACHE_TTL
+    lock_ttl = settings.COMPARISON_CACHE_LOCK_TTL
+
+    def failures_key(self, key):
+        return "{}:failures".format(key)
+
+    def get_failures(self, key):
+        s = self.redis.get(self.failures_key(key))
+        if not s:
+            return {}
+        return self.deserialize(s)
+
+    def set_failures(self, key, failures, ttl=None):
+        if not failures:
+            self.redis.delete(self.failures_key(key))
+            return
+        self.redis.set(self.failures_key(key), self.serialize(failures),
+                       ex=ttl or self.ttl)
+
+    def invalidate(self, *args, **kw):
+        """
+        Remove a comparison and its failures from the cache.
+        """
+        super(BaseComparisonCache, self).invalidate(*args, **kw)
+        self.redis.delete(self.failures_key(self.format_key(*args, **kw)))
+
+    def get(self, *args, **kw):
+        """
+        Get a comparison, retrying it if it was partial.
+        """
+        key_kw = dict([(k, v) for k, v in kw.items() if k != 'ttl'])
+        key = self.format_key(*args, **key_kw)
+        if self.redis.exists(self.failures_key(key)):
+            self.redis.delete(key)
+        cr = super(BaseComparisonCache, self).get(*args, **kw)
+        cr.failures = self.get_failures(key)
+        return cr
+
+
+class ComparisonCache(BaseComparisonCache):
+    pool_size = settings.COMPARISON_POOL_SIZE
 
-    def get_facets(self, org, **kw):
+    def get_facets(self, org, session=db.session, **kw):
         raise NotImplemented
 
-    def get_content_item_ids(self, org, facet, **kw):
+    def get_content_item_ids(self, org, facet, session=db.session, **kw):
         raise NotImplemented
 
     def format_comparisons(self, comparisons):
@@ -35,27 +91,101 @@ class ComparisonCache(Cache):
         kw.update({'name__': self.name})
         return self._format_key(*args, **kw)
 
-    # TODO: Pooled Exectution
+    def facets_key(self, org_id):
+        """
+        A hash of this type's cached facets.
+        """
+        return "{}:facets:{}:{}".format(self.key_prefix, self.name, org_id)
+
+    def get_facet(self, org_id, facet):
+        if self.debug:
+            return None
+        s = self.redis.hget(self.facets_key(org_id), str(facet))
+        if not s:
+            return None
+        return self.deserialize(s)
+
+    def set_facet(self, org_id, facet, fingerprint, updated, comparisons):
+        key = self.facets_key(org_id)
+        obj = {'fingerprint': fingerprint, 'updated': updated,
+               'comparisons': comparisons}
+        pipe = self.redis.pipeline()
+        pipe.hset(key, str(facet), self.serialize(obj))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def prune_facets(self, org_id, facets):
+        """
+        Drop cached facets which no longer exist.
+        """
+        key = self.facets_key(org_id)
+        facets = set([str(f) for f in facets])
+        stale = [f for f in self.redis.hkeys(key) if f not in facets]
+        if len(stale):
+            self.redis.hdel(key, *stale)
+
+    def work_facet(self, org, facet, metrics, **kw):
+        """
+        Compute one facet on its own session, reusing its cached
+        comparisons if its items are the same and none of their
+        rows have changed since.
+        """
+        session = gen_session()
+        try:
+            ids = self.get_content_item_ids(org, facet, session=session, **kw)
+            if not len(ids):
+                return None
+            cc = ContentComparison(org, ids, metrics)
+            fingerprint = cc.fingerprint()
+            cached = self.get_facet(org.id, facet)
+            if cached and cached['fingerprint'] == fingerprint and \
+                    not cc.changed_since(cached.get('updated'), session):
+                return cached['comparisons']
+            # read before computing, so a change made meanwhile
+            # is picked up next time.
+            updated = cc.updated(session)
+            comparisons = list(cc.execute(session=session))
+            self.set_facet(org.id, facet, fingerprint, updated, comparisons)
+            return comparisons
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.remove()
+
     def work(self, org_id, **kw):
         org = db.session.query(Org).get(org_id)
         metrics = org.content_metric_comparisons
-        comparisons = {}
-        for facet in self.get_facets(org, **kw):
-            ids = self.get_content_item_ids(org, facet, **kw)
-            if len(ids):
-                cc = ContentComparison(org, ids, metrics)
-                comparisons[facet] = list(cc.execute())
+        facets = self.get_facets(org, **kw)
         db.session.remove()
+
+        def fx(facet):
+            try:
+                return facet, self.work_facet(org, facet, metrics, **kw), None
+            except Exception as e:
+                log.exception('Comparison {} failed for facet {} of org {}'
+                              .format(self.name, facet, org_id))
+                return facet, None, "{}: {}".format(e.__class__.__name__, e)
+
+        comparisons = {}
+        failures = {}
+        pool = Pool(self.pool_size)
+        for facet, result, error in pool.imap_unordered(fx, facets):
+            if error:
+                failures[facet] = error
+            elif result:
+                comparisons[facet] = result
+        self.prune_facets(org_id, facets)
+        key = self.format_key(org_id, **kw)
+        self.set_failures(key, {self.name: failures} if failures else None)
         return self.format_comparisons(comparisons)
 
 
-class ComparisonsCache(Cache):
+class ComparisonsCache(BaseComparisonCache):
 
     """
     Get/cache all comparisons.
     """
-    key_prefix = settings.COMPARISON_CACHE_PREFIX
-    ttl = settings.COMPARISON_CACHE_TTL
     pool_size = 4
 
     @property
@@ -73,22 +203,26 @@ class ComparisonsCache(Cache):
         """
         for cache in self.comparison_lookup.values():
             cache.invalidate(*args, **kwargs)
-        self.redis.delete(self.format_key(*args, **kwargs))
+        super(ComparisonsCache, self).invalidate(*args, **kwargs)
 
     def work(self, org_id):
 
-        types = self.comparison_lookup.keys()
+        lookup = self.comparison_lookup
 
         def fx(type):
-            cobj = self.comparison_lookup[type]
+            cobj = lookup[type]
             if self.debug:
                 cobj.debug = True
-            cr = cobj.get(org_id)
-            return cr.value
+            return cobj.get(org_id)
 
         comparisons = {}
-        for typ in types:
-            comparisons.update(fx(typ))
+        failures = {}
+        pool = Pool(self.pool_size)
+        for cr in pool.imap_unordered(fx, lookup.keys()):
+            if cr.value:
+                comparisons.update(cr.value)
+            failures.update(cr.failures)
+        self.set_failures(self.format_key(org_id), failures)
         return comparisons
 
 
@@ -96,11 +230,14 @@ class AllContentComparisonCache(ComparisonCache):
 
     name = "all"
 
-    def get_facets(self, org, **kw):
+    def get_facets(self, org, session=db.session, **kw):
         return ["all"]
 
-    def get_content_item_ids(self, org, facet, **kw):
-        return org.content_item_ids
+    def get_content_item_ids(self, org, facet, session=db.session, **kw):
+        content_items = session.query(ContentItem.id)\
+            .filter_by(org_id=org.id)\
+            .all()
+        return [c[0] for c in content_items]
 
     def format_comparisons(self, comparisons):
         return comparisons
@@ -110,22 +247,22 @@ class SubjectTagsComparisonCache(ComparisonCache):
 
     name = "subject_tags"
 
-    def get_facets(self, org, **kw):
+    def get_facets(self, org, session=db.session, **kw):
         """
         Get all subject tag ids.
         """
-        tag_ids = db.session.query(Tag)\
+        tag_ids = session.query(Tag)\
             .filter_by(org_id=org.id)\
             .filter_by(type='subject')\
             .with_entities(Tag.id)\
             .all()
         return [t[0] for t in tag_ids]
 
-    def get_content_item_ids(self, org, tag_id, **kw):
+    def get_content_item_ids(self, org, tag_id, session=db.session, **kw):
         """
         Get all content item ids for a Tag.
         """
-        content_items = db.session\
+        content_items = session\
             .query(func.distinct(content_items_tags.c.content_item_id))\
             .filter(content_items_tags.c.tag_id == tag_id)\
             .all()
@@ -136,22 +273,22 @@ class ImpactTagsComparisonCache(ComparisonCache):
 
     name = "impact_tags"
 
-    def get_facets(self, org, **kw):
+    def get_facets(self, org, session=db.session, **kw):
         """
         Get all subject tag ids.
         """
-        tag_ids = db.session.query(Tag)\
+        tag_ids = session.query(Tag)\
             .filter_by(org_id=org.id)\
             .filter_by(type='impact')\
             .with_entities(Tag.id)\
             .all()
         return [t[0] for t in tag_ids]
 
-    def get_content_item_ids(self, org, tag_id, **kw):
+    def get_content_item_ids(self, org, tag_id, session=db.session, **kw):
         """
         Get all content item ids for a Tag.
         """
-        content_items = db.session\
+        content_items = session\
             .query(func.distinct(content_items_events.c.content_item_id))\
             .join(Event)\
             .filter(Event.tags.any(Tag.id == tag_id))\
@@ -163,15 +300,15 @@ class ContentTypeComparisonCache(ComparisonCache):
 
     name = "types"
 
-    def get_facets(self, org, **kw):
-        types = db.session.query(func.distinct(ContentItem.type))\
+    def get_facets(self, org, session=db.session, **kw):
+        types = session.query(func.distinct(ContentItem.type))\
             .filter_by(org_id=org.id)\
             .all()
 
         return [t[0] for t in types]
 
-    def get_content_item_ids(self, org, type, **kw):
-        content_items = db.session.query(func.distinct(ContentItem.id))\
+    def get_content_item_ids(self, org, type, session=db.session, **kw):
+        content_items = session.query(func.distinct(ContentItem.id))\
             .filter_by(org_id=org.id)\
             .filter_by(type=type)\
             .all()
@@ -1,7 +1,9 @@
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Index
 
 from newslynx.lib import dates
 from newslynx.core import db
+from newslynx.models import util  # partitioned CREATE TABLE
 
 
 class ContentMetricTimeseries(db.Model):
@@ -18,9 +20,15 @@ class ContentMetricTimeseries(db.Model):
         db.Integer, db.ForeignKey('orgs.id'), index=True, primary_key=True)
     content_item_id = db.Column(db.Integer, db.ForeignKey('content.id'), index=True, primary_key=True)
     datetime = db.Column(db.DateTime(timezone=True), primary_key=True)
-    metrics = db.Column(JSON)
+    metrics = db.Column(JSONB)
     updated = db.Column(db.DateTime(timezone=True), onupdate=dates.now, default=dates.now)
 
+    # monthly partitions are managed by `newslynx.tasks.partition_metric`
+    __table_args__ = (
+        Index('content_metric_timeseries_metrics_idx', 'metrics', postgresql_using='gin'),
+        {'info': {'partition_by': 'RANGE (datetime)'}}
+    )
+
     def __init__(self, **kw):
         self.org_id = kw.get('org_id')
         self.content_item_id = kw.get('content_item_id')
@@ -52,7 +60,14 @@ class ContentMetricSummary(db.Model):
     org_id = db.Column(
         db.Integer, db.ForeignKey('orgs.id'), index=True, primary_key=True)
     content_item_id = db.Column(db.Integer, db.ForeignKey('content.id'), index=True, primary_key=True)
-    metrics = db.Column(JSON)
+    metrics = db.Column(JSONB)
+    updated = db.Column(db.DateTime(timezone=True), onupdate=dates.now, default=dates.now)
+
+    # comparisons look up the rows which changed since they were cached.
+    __table_args__ = (
+        Index('content_metric_summary_metrics_idx', 'metrics', postgresql_using='gin'),
+        Index('content_metric_summary_updated_idx', 'org_id', 'updated'),
+    )
 
     def __init__(self, **kw):
         self.org_id = kw.get('org_id')
@@ -2,6 +2,7 @@ from newslynx.core import settings
 from newslynx.lib import url
 from newslynx.lib import article
 from newslynx.lib import image
+from newslynx.lib import network
 
 from .cache import Cache
 
@@ -13,6 +14,10 @@ class URLCache(Cache):
     """
     key_prefix = settings.URL_CACHE_PREFIX
     ttl = settings.URL_CACHE_TTL
+    local_size = settings.URL_CACHE_LOCAL_SIZE
+    local_ttl = settings.URL_CACHE_LOCAL_TTL
+    negative_ttl = settings.URL_CACHE_NEGATIVE_TTL
+    stale_ttl = settings.URL_CACHE_STALE_TTL
 
     def work(self, raw_url):
         """
@@ -31,9 +36,54 @@ class ExtractCache(Cache):
 
     """
     A redis cache of source_url => extracted data.
+
+    Each extraction keeps the page's ETag and Last-Modified headers.
+    Once it expires, a conditional GET decides whether the page needs
+    extracting again or the extraction can simply be renewed.
     """
     key_prefix = settings.EXTRACT_CACHE_PREFIX
     ttl = settings.EXTRACT_CACHE_TTL
+    local_size = settings.EXTRACT_CACHE_LOCAL_SIZE
+    local_ttl = settings.EXTRACT_CACHE_LOCAL_TTL
+    negative_ttl = settings.EXTRACT_CACHE_NEGATIVE_TTL
+    stale_ttl = settings.EXTRACT_CACHE_STALE_TTL
+    validate_ttl = settings.EXTRACT_CACHE_VALIDATE_TTL
+    local_copy = True
+
+    def validators_key(self, key):
+        return "{}:validators".format(key)
+
+    def invalidate(self, *args, **kw):
+        super(ExtractCache, self).invalidate(*args, **kw)
+        key = self.format_key(*args, **kw)
+        self.redis.delete(self.validators_key(key))
+
+    def validate(self, key, entry, ttl, url, type='article'):
+        """
+        Whether the page is unchanged since it was extracted.
+        """
+        validators = self.redis.hgetall(self.validators_key(key))
+        if not validators or network.is_modified(url, validators) is not False:
+            return False
+        self.redis.expire(self.validators_key(key), self.keep_ttl(ttl))
+        return True
+
+    def compute(self, key, ttl, *args, **kw):
+        """
+        Keep the validators of the page we extracted.
+        """
+        cr = super(ExtractCache, self).compute(key, ttl, *args, **kw)
+        if not cr.value or cr.is_cached:
+            return cr
+        vkey = self.validators_key(key)
+        validators = network.get_validators(args[0])
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(vkey)
+        if validators:
+            pipe.hmset(vkey, validators)
+            pipe.expire(vkey, self.keep_ttl(ttl))
+        pipe.execute()
+        return cr
 
     def work(self, url, type='article'):
         """
@@ -50,6 +100,10 @@ class ThumbnailCache(Cache):
     """
     key_prefix = settings.THUMBNAIL_CACHE_PREFIX
     ttl = settings.THUMBNAIL_CACHE_TTL
+    local_size = settings.THUMBNAIL_CACHE_LOCAL_SIZE
+    local_ttl = settings.THUMBNAIL_CACHE_LOCAL_TTL
+    negative_ttl = settings.THUMBNAIL_CACHE_NEGATIVE_TTL
+    stale_ttl = settings.THUMBNAIL_CACHE_STALE_TTL
 
     def work(self, img_url):
         """
@@ -1,4 +1,4 @@
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSONB
 
 from newslynx.lib import dates
 from newslynx.core import db
@@ -15,7 +15,7 @@ class OrgMetricTimeseries(db.Model):
     org_id = db.Column(
         db.Integer, db.ForeignKey('orgs.id'), index=True, primary_key=True)
     datetime = db.Column(db.DateTime(timezone=True), primary_key=True)
-    metrics = db.Column(JSON)
+    metrics = db.Column(JSONB)
     updated = db.Column(db.DateTime(timezone=True), onupdate=dates.now, default=dates.now)
 
     def __init__(self, **kw):
@@ -45,7 +45,7 @@ class OrgMetricSummary(db.Model):
     # the ID is the global bitly hash.
     org_id = db.Column(
         db.Integer, db.ForeignKey('orgs.id'), index=True, primary_key=True)
-    metrics = db.Column(JSON)
+    metrics = db.Column(JSONB)
 
     def __init__(self, **kw):
         self.org_id = kw.get('org_id')
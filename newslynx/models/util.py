@@ -1,3 +1,19 @@
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.ext.compiler import compiles
+
+
+@compiles(CreateTable, 'postgresql')
+def create_partitioned_table(element, compiler, **kw):
+    """
+    Declare a table as partitioned via `info={'partition_by': ...}`
+    """
+    ddl = compiler.visit_create_table(element)
+    partition_by = element.element.info.get('partition_by')
+    if partition_by:
+        ddl = "{} PARTITION BY {}\n\n".format(ddl.rstrip(), partition_by)
+    return ddl
+
+
 
 def get_table_columns(obj, incl=[]):
     """ Get the column names for a Table object"""
@@ -22,6 +22,16 @@ class RefreshContentComparisons(SousChef):
         assert(res.get('success', False))
 
 
+class CompactTimeseriesMetrics(SousChef):
+    
+    timeout = 720 
+    
+    def run(self):
+        res = self.api.orgs.compact_timeseries(
+            days=self.options.get('days', 30))
+        assert(res.get('success', False))
+
+
 class DeleteOldEvents(SousChef):
     
     timeout = 720 
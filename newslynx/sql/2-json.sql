@@ -13,18 +13,23 @@ SELECT COALESCE(
 )::json
 $function$;
 
+--- merge jsonb objects, right keys win.
+CREATE OR REPLACE FUNCTION json_merge("left" JSONB, "right" JSONB)
+  RETURNS JSONB
+  LANGUAGE sql
+  IMMUTABLE
+AS $function$
+SELECT COALESCE("left", '{}'::jsonb) || COALESCE("right", '{}'::jsonb)
+$function$;
+
 --- merge json objects
-CREATE OR REPLACE FUNCTION json_merge(left JSON, right JSON)
-RETURNS JSON AS $$
-  import json
-  l, r = json.loads(left), json.loads(right)
-  if not l:
-      return json.dumps(r)
-  if not r:
-      return json.dumps(l)
-  l.update(r)
-  return json.dumps(l)
-$$ LANGUAGE PLPYTHONU;
+CREATE OR REPLACE FUNCTION json_merge("left" JSON, "right" JSON)
+  RETURNS JSON
+  LANGUAGE sql
+  IMMUTABLE
+AS $function$
+SELECT json_merge("left"::jsonb, "right"::jsonb)::json
+$function$;
 
 --- delete an individual key
 CREATE OR REPLACE FUNCTION "json_del_key"(
@@ -1,3 +1,6 @@
+-- These functions only exist for backwards compatibility.
+-- Metrics are merged in bulk via `newslynx.tasks.upsert_metric`.
+
 -- upsert content metrics timeseries
 CREATE OR REPLACE FUNCTION "upsert_content_metric_timeseries"(
     "_org_id" INT,
@@ -7,34 +10,13 @@ CREATE OR REPLACE FUNCTION "upsert_content_metric_timeseries"(
 ) 
 RETURNS VOID AS
 $$
-BEGIN
-    LOOP
-        -- first try to update the row
-        UPDATE content_metric_timeseries 
-        SET metrics = json_merge(metrics, "_metrics"::json),
-            updated = current_timestamp
-        WHERE
-            org_id = "_org_id" AND
-            datetime = "_datetime" AND
-            content_item_id = "_content_item_id";
-            
-        IF found THEN
-            RETURN;
-        END IF;
-        -- not there, so try to insert the key
-        -- if someone else inserts the same key concurrently,
-        -- we could get a unique-key failure
-        BEGIN
-            INSERT INTO content_metric_timeseries
-            VALUES ("_org_id", "_content_item_id", "_datetime", "_metrics"::json, current_timestamp);
-            RETURN;
-        EXCEPTION WHEN unique_violation THEN
-            -- do nothing, and loop to try the UPDATE again
-        END;
-    END LOOP;
-END;
+    INSERT INTO content_metric_timeseries (org_id, content_item_id, datetime, metrics, updated)
+    VALUES ("_org_id", "_content_item_id", "_datetime", "_metrics"::jsonb, current_timestamp)
+    ON CONFLICT (org_id, content_item_id, datetime) DO UPDATE
+    SET metrics = COALESCE(content_metric_timeseries.metrics, '{}'::jsonb) || EXCLUDED.metrics,
+        updated = current_timestamp;
 $$
-LANGUAGE plpgsql;
+LANGUAGE sql;
 
 -- upsert content metrics summary
 CREATE OR REPLACE FUNCTION "upsert_content_metric_summary"(
@@ -44,32 +26,13 @@ CREATE OR REPLACE FUNCTION "upsert_content_metric_summary"(
 ) 
 RETURNS VOID AS
 $$
-BEGIN
-    LOOP
-        -- first try to update the row
-        UPDATE content_metric_summary 
-        SET metrics = json_merge(metrics, "_metrics"::json)
-        WHERE
-            org_id = "_org_id" AND
-            content_item_id = "_content_item_id";
-            
-        IF found THEN
-            RETURN;
-        END IF;
-        -- not there, so try to insert the key
-        -- if someone else inserts the same key concurrently,
-        -- we could get a unique-key failure
-        BEGIN
-            INSERT INTO content_metric_summary
-            VALUES ("_org_id", "_content_item_id", "_metrics"::json);
-            RETURN;
-        EXCEPTION WHEN unique_violation THEN
-            -- do nothing, and loop to try the UPDATE again
-        END;
-    END LOOP;
-END;
+    INSERT INTO content_metric_summary (org_id, content_item_id, metrics, updated)
+    VALUES ("_org_id", "_content_item_id", "_metrics"::jsonb, current_timestamp)
+    ON CONFLICT (org_id, content_item_id) DO UPDATE
+    SET metrics = COALESCE(content_metric_summary.metrics, '{}'::jsonb) || EXCLUDED.metrics,
+        updated = current_timestamp;
 $$
-LANGUAGE plpgsql;
+LANGUAGE sql;
 
 -- upsert org metrics timeseries
 CREATE OR REPLACE FUNCTION "upsert_org_metric_timeseries"(
@@ -79,33 +42,13 @@ CREATE OR REPLACE FUNCTION "upsert_org_metric_timeseries"(
 ) 
 RETURNS VOID AS
 $$
-BEGIN
-    LOOP
-        -- first try to update the row
-        UPDATE org_metric_timeseries 
-        SET metrics = json_merge(metrics, "_metrics"::json),
-            updated = current_timestamp
-        WHERE
-            org_id = "_org_id" AND
-            datetime = "_datetime";
-            
-        IF found THEN
-            RETURN;
-        END IF;
-        -- not there, so try to insert the key
-        -- if someone else inserts the same key concurrently,
-        -- we could get a unique-key failure
-        BEGIN
-            INSERT INTO org_metric_timeseries
-            VALUES ("_org_id", "_datetime", "_metrics"::json, current_timestamp);
-            RETURN;
-        EXCEPTION WHEN unique_violation THEN
-            -- do nothing, and loop to try the UPDATE again
-        END;
-    END LOOP;
-END;
+    INSERT INTO org_metric_timeseries (org_id, datetime, metrics, updated)
+    VALUES ("_org_id", "_datetime", "_metrics"::jsonb, current_timestamp)
+    ON CONFLICT (org_id, datetime) DO UPDATE
+    SET metrics = COALESCE(org_metric_timeseries.metrics, '{}'::jsonb) || EXCLUDED.metrics,
+        updated = current_timestamp;
 $$
-LANGUAGE plpgsql;
+LANGUAGE sql;
 
 
 -- upsert org metric summary
@@ -115,27 +58,9 @@ CREATE OR REPLACE FUNCTION "upsert_org_metric_summary"(
 ) 
 RETURNS VOID AS
 $$
-BEGIN
-    LOOP
-        -- first try to update the row
-        UPDATE org_metric_summary 
-        SET metrics = json_merge(metrics, "_metrics"::json)
-        WHERE org_id = "_org_id";
-
-        IF found THEN
-            RETURN;
-        END IF;
-        -- not there, so try to insert the key
-        -- if someone else inserts the same key concurrently,
-        -- we could get a unique-key failure
-        BEGIN
-            INSERT INTO org_metric_summary
-            VALUES ("_org_id", "_metrics"::json);
-            RETURN;
-        EXCEPTION WHEN unique_violation THEN
-            -- do nothing, and loop to try the UPDATE again
-        END;
-    END LOOP;
-END;
+    INSERT INTO org_metric_summary (org_id, metrics)
+    VALUES ("_org_id", "_metrics"::jsonb)
+    ON CONFLICT (org_id) DO UPDATE
+    SET metrics = COALESCE(org_metric_summary.metrics, '{}'::jsonb) || EXCLUDED.metrics;
 $$
-LANGUAGE plpgsql;
\ No newline at end of file
+LANGUAGE sql;
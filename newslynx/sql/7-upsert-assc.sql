@@ -1,71 +1,54 @@
--- upsert org metric summary
+-- These functions only exist for backwards compatibility.
+-- Associations are upserted in bulk via `newslynx.tasks.upsert_assc`.
+
+-- upsert events <=> tags
 CREATE OR REPLACE FUNCTION "upsert_events_tags"(
     "_event_id" INT,
     "_tag_id" INT
 ) 
 RETURNS VOID AS
 $$
-    BEGIN
-        INSERT INTO events_tags
-        VALUES ("_event_id", "_tag_id");
-        RETURN;
-    EXCEPTION WHEN unique_violation THEN
-        RETURN;
-        -- do nothing, and loop to try the UPDATE again
-    END;
+    INSERT INTO events_tags (event_id, tag_id)
+    VALUES ("_event_id", "_tag_id")
+    ON CONFLICT DO NOTHING;
 $$
-LANGUAGE plpgsql;
+LANGUAGE sql;
 
--- upsert org metric summary
+-- upsert content items <=> events
 CREATE OR REPLACE FUNCTION "upsert_content_items_events"(
     "_event_id" INT,
     "_content_item_id" INT
 ) 
 RETURNS VOID AS
 $$
-    BEGIN
-        INSERT INTO content_items_events
-        VALUES ("_event_id", "_content_item_id");
-        RETURN;
-    EXCEPTION WHEN unique_violation THEN
-        RETURN;
-        -- do nothing, and loop to try the UPDATE again
-    END;
+    INSERT INTO content_items_events (event_id, content_item_id)
+    VALUES ("_event_id", "_content_item_id")
+    ON CONFLICT DO NOTHING;
 $$
-LANGUAGE plpgsql;
+LANGUAGE sql;
 
--- upsert org metric summary
+-- upsert content items <=> tags
 CREATE OR REPLACE FUNCTION "upsert_content_items_tags"(
     "_content_item_id" INT,
     "_tag_id" INT
 ) 
 RETURNS VOID AS
 $$
-    BEGIN
-        INSERT INTO content_items_tags
-        VALUES ("_tag_id", "_content_item_id");
-        RETURN;
-    EXCEPTION WHEN unique_violation THEN
-        RETURN;
-        -- do nothing, and loop to try the UPDATE again
-    END;
+    INSERT INTO content_items_tags (content_item_id, tag_id)
+    VALUES ("_content_item_id", "_tag_id")
+    ON CONFLICT DO NOTHING;
 $$
-LANGUAGE plpgsql;
+LANGUAGE sql;
 
--- upsert org metric summary
+-- upsert content items <=> authors
 CREATE OR REPLACE FUNCTION "upsert_content_items_authors"(
     "_content_item_id" INT,
     "_author_id" INT
 ) 
 RETURNS VOID AS
 $$
-    BEGIN
-        INSERT INTO content_items_authors
-        VALUES ("_author_id", "_content_item_id");
-        RETURN;
-    EXCEPTION WHEN unique_violation THEN
-        RETURN;
-        -- do nothing, and loop to try the UPDATE again
-    END;
+    INSERT INTO content_items_authors (content_item_id, author_id)
+    VALUES ("_content_item_id", "_author_id")
+    ON CONFLICT DO NOTHING;
 $$
-LANGUAGE plpgsql;
\ No newline at end of file
+LANGUAGE sql;
@@ -0,0 +1,56 @@
+-- The name of the monthly content_metric_timeseries partition for a datetime.
+CREATE OR REPLACE FUNCTION content_metric_timeseries_partition_name(
+  "_datetime" timestamp with time zone
+)
+  RETURNS TEXT
+  LANGUAGE sql
+  IMMUTABLE
+AS $function$
+SELECT 'content_metric_timeseries_' || to_char("_datetime" AT TIME ZONE 'UTC', 'YYYY_MM')
+$function$;
+
+-- Create the monthly content_metric_timeseries partition for a datetime,
+-- moving any rows for that month out of the default partition first.
+CREATE OR REPLACE FUNCTION create_content_metric_timeseries_partition(
+  "_datetime" timestamp with time zone
+)
+RETURNS TEXT AS
+$BODY$
+DECLARE
+  part text;
+  lower_bound timestamp with time zone;
+  upper_bound timestamp with time zone;
+BEGIN
+  lower_bound := date_trunc('month', "_datetime" AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+  upper_bound := lower_bound + interval '1 month';
+  part := content_metric_timeseries_partition_name(lower_bound);
+
+  IF to_regclass(part) IS NOT NULL THEN
+    RETURN part;
+  END IF;
+
+  CREATE TEMP TABLE content_metric_timeseries_moved
+    (LIKE content_metric_timeseries);
+
+  EXECUTE format(
+    'WITH moved AS (
+        DELETE FROM content_metric_timeseries_default
+        WHERE datetime >= %L AND datetime < %L
+        RETURNING *
+     )
+     INSERT INTO content_metric_timeseries_moved SELECT * FROM moved',
+    lower_bound, upper_bound);
+
+  EXECUTE format(
+    'CREATE TABLE %I PARTITION OF content_metric_timeseries
+     FOR VALUES FROM (%L) TO (%L)',
+    part, lower_bound, upper_bound);
+
+  INSERT INTO content_metric_timeseries
+    SELECT * FROM content_metric_timeseries_moved;
+  DROP TABLE content_metric_timeseries_moved;
+
+  RETURN part;
+END
+$BODY$
+LANGUAGE plpgsql;
@@ -0,0 +1,271 @@
+"""
+Downsample old hourly timeseries points into daily points.
+
+Each day older than the cutoff which still holds more than one point
+is replaced by a single point at the start of the day:
+
+- metrics aggregate according to their `agg` (counts sum),
+- cumulative metrics take the day's last value,
+- faceted metrics merge their facets in the same way.
+
+Hourly queries on the timeseries stores read days before the horizon
+as daily buckets, so compacted and not-yet-compacted days read alike.
+"""
+from datetime import timedelta
+
+from newslynx.core import db
+from newslynx.core import settings
+from newslynx.lib import dates
+from newslynx.util import chunk_list
+
+
+def horizon(days=None):
+    """
+    The start of the first day which hasn't been compacted.
+    """
+    if days is None:
+        days = settings.METRICS_COMPACT_DAYS
+    d = dates.floor(dates.now(), unit='day', value=1)
+    return d - timedelta(days=int(days))
+
+
+class Compaction(object):
+
+    """
+    An abstract model for downsampling a timeseries store.
+    """
+    table = None
+    id_col = None
+    metrics_attr = None
+    date_col = 'datetime'
+    metrics_col = 'metrics'
+    expired_table = 'expired'
+    days_table = 'expired_days'
+    simple_table = 'compacted'
+    facets_table = 'compacted_facets'
+    bucket_col = 'bucket'
+    unit = 'day'
+
+    # jsonb_build_object takes at most 100 arguments.
+    chunk_size = 40
+
+    def __init__(self, org, **kw):
+        self.org = org
+        self.days = int(kw.get('days', settings.METRICS_COMPACT_DAYS))
+        self.metrics = getattr(org, self.metrics_attr)
+
+    @property
+    def before(self):
+        """
+        Only compact full days older than the cutoff.
+        """
+        return horizon(self.days).isoformat()
+
+    @property
+    def date_select(self):
+        return "date_trunc('{}', {})".format(self.unit, self.date_col)
+
+    @property
+    def query_kw(self):
+        """
+        default kwargs.
+        """
+        return dict(
+            table=self.table,
+            id_col=self.id_col,
+            date_col=self.date_col,
+            date_select=self.date_select,
+            metrics_col=self.metrics_col,
+            expired_table=self.expired_table,
+            days_table=self.days_table,
+            simple_table=self.simple_table,
+            bucket_col=self.bucket_col,
+            org_id=self.org.id,
+            before=self.before
+        )
+
+    def add_kw(self, **kw):
+        """
+        Update default kw.
+        """
+        return dict(self.query_kw.items() + kw.items())
+
+    # SELECT STATEMENTS
+
+    def select_json(self, metric):
+        """
+        Pull a json key out of the metrics store.
+        """
+        return "({metrics_col} ->> '{name}')::text::numeric"\
+               .format(**self.add_kw(**metric))
+
+    def select_last(self, value, metric):
+        """
+        The last non-null value of the day.
+        """
+        return \
+            """(array_agg({value} ORDER BY {date_col} DESC)
+                  FILTER (WHERE {value} IS NOT NULL))[1]"""\
+            .format(value=value, **self.add_kw(**metric))
+
+    def select_agg(self, value, metric):
+        """
+        Aggregate a value by a metric's type.
+        """
+        if metric['type'] == 'cumulative':
+            return self.select_last(value, metric)
+        return "{agg}({value})".format(value=value, **metric)
+
+    def select_simple(self, metric):
+        return self.select_agg(self.select_json(metric), metric)
+
+    def select_faceted(self, metric):
+        """
+        Merge a metric's facets for each id and day
+        by aggregating each facet's values.
+        """
+        facets = "({metrics_col} -> '{name}')".format(**self.add_kw(**metric))
+        value = "(f ->> 'value')::text::numeric"
+        return \
+            """SELECT {insert_cols}, {bucket_col}, '{name}'::text AS name,
+                      jsonb_agg(jsonb_build_object('facet', facet, 'value', value)) AS facets
+               FROM (
+                   SELECT {insert_cols}, {bucket_col}, f ->> 'facet' AS facet, {agg} AS value
+                   FROM {days_table},
+                        jsonb_array_elements(
+                           CASE WHEN jsonb_typeof({facets}) = 'array'
+                                THEN {facets} ELSE '[]'::jsonb END) f
+                   GROUP BY {insert_cols}, {bucket_col}, f ->> 'facet'
+               ) ff
+               GROUP BY {insert_cols}, {bucket_col}
+            """.format(**self.add_kw(insert_cols=self.insert_cols,
+                                     **dict(metric, facets=facets,
+                                            agg=self.select_agg(value, metric))))
+
+    @property
+    def simple_select(self):
+        """
+        Build the compacted object of the metrics without facets.
+        """
+        ss = []
+        for n, m in self.metrics.items():
+            if not m.get('faceted'):
+                ss.append("'{}', {}".format(n, self.select_simple(m)))
+        if not len(ss):
+            return "'{}'::jsonb"
+        objs = []
+        for chunk in chunk_list(ss, self.chunk_size):
+            objs.append("jsonb_build_object({})".format(",\n".join(chunk)))
+        return "jsonb_strip_nulls({})".format(" || ".join(objs))
+
+    @property
+    def faceted_select(self):
+        """
+        Build the compacted object of the faceted metrics for each id
+        and day. Facets are merged in their own query rather than in a
+        sub-select of the grouped insert, which Postgres won't correlate
+        with the group's day.
+        """
+        ss = [self.select_faceted(m) for m in self.metrics.values()
+              if m.get('faceted')]
+        if not len(ss):
+            return None
+        return \
+            """SELECT {insert_cols}, {bucket_col}, jsonb_object_agg(name, facets) AS {metrics_col}
+               FROM ({faceted}) fff
+               GROUP BY {insert_cols}, {bucket_col}
+            """.format(faceted="\nUNION ALL\n".join(ss),
+                       **self.add_kw(insert_cols=self.insert_cols))
+
+    @property
+    def query(self):
+        """
+        Delete the hourly points of each expired day and
+        insert the daily point in their place.
+        """
+        faceted = self.faceted_select
+        facets_cte = ""
+        facets_join = ""
+        metrics_select = "s.{}".format(self.metrics_col)
+        if faceted:
+            facets_cte = ", {} AS ({})".format(self.facets_table, faceted)
+            facets_join = "LEFT JOIN {} f USING ({}, {})"\
+                .format(self.facets_table, self.insert_cols, self.bucket_col)
+            metrics_select = "s.{0} || COALESCE(f.{0}, '{{}}'::jsonb)"\
+                .format(self.metrics_col)
+        return \
+            """WITH {expired_table} AS (
+                  DELETE FROM {table}
+                  WHERE org_id = {org_id}
+                  AND {date_col} < '{before}'
+                  AND ({id_col}, {date_select}) IN (
+                      SELECT {id_col}, {date_select}
+                      FROM {table}
+                      WHERE org_id = {org_id}
+                      AND {date_col} < '{before}'
+                      GROUP BY 1, 2
+                      HAVING count(*) > 1
+                  )
+                  RETURNING *
+               ), {days_table} AS (
+                  SELECT *, {date_select} AS {bucket_col}
+                  FROM {expired_table}
+               ), {simple_table} AS (
+                  SELECT {insert_cols}, {bucket_col}, {simple_select} AS {metrics_col}
+                  FROM {days_table}
+                  GROUP BY {insert_cols}, {bucket_col}
+               ){facets_cte}
+               INSERT INTO {table} ({insert_cols}, {date_col}, {metrics_col}, updated)
+               SELECT {insert_cols}, {bucket_col}, {metrics_select}, current_timestamp
+               FROM {simple_table} s
+               {facets_join}
+            """.format(**self.add_kw(insert_cols=self.insert_cols,
+                                     simple_select=self.simple_select,
+                                     facets_cte=facets_cte,
+                                     facets_join=facets_join,
+                                     metrics_select=metrics_select))
+
+    @property
+    def insert_cols(self):
+        if self.id_col == 'org_id':
+            return 'org_id'
+        return "org_id, {}".format(self.id_col)
+
+    def execute(self, session=db.session):
+        """
+        Compact without commiting.
+        """
+        if not len(self.metrics.keys()):
+            return 0
+        return session.execute(self.query).rowcount
+
+
+class ContentMetricTimeseriesCompaction(Compaction):
+    table = "content_metric_timeseries"
+    id_col = "content_item_id"
+    metrics_attr = "content_timeseries_metrics"
+
+
+class OrgMetricTimeseriesCompaction(Compaction):
+    table = "org_metric_timeseries"
+    id_col = "org_id"
+    metrics_attr = "timeseries_metrics"
+
+
+def compact(org, days=None):
+    """
+    Compact an org's content and org timeseries in a single transaction
+    so that org rollups never see half-compacted days.
+    """
+    kw = {}
+    if days is not None:
+        kw['days'] = days
+    try:
+        content = ContentMetricTimeseriesCompaction(org, **kw).execute()
+        org_ = OrgMetricTimeseriesCompaction(org, **kw).execute()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise e
+    db.session.remove()
+    return {'content_timeseries': content, 'org_timeseries': org_}
@@ -1,12 +1,23 @@
 """
 This module exists for generating comparison queries.
 """
-from newslynx.util import gen_uuid
+from hashlib import md5
+
 from newslynx.core import db
 from newslynx.core import settings
 from newslynx.tasks.util import ResultIter
 
 
+def percentile_col(per):
+    """
+    The name of a percentile's column, eg: 2.5 => per_2_5
+    """
+    per_col = "per_" + str(per).replace('.', '_')
+    if per_col.endswith('_0'):
+        per_col = per_col[:-2]
+    return per_col
+
+
 class Comparison(object):
     table = None
     id_col = None
@@ -27,62 +38,82 @@ class Comparison(object):
         return "ARRAY[{}]".format(",".join([str(i) for i in self.ids]))
 
     def select_metric(self, metric):
-        return "(metrics ->> '{name}')::text::numeric as metric".format(**metric)
+        return "('{name}', (metrics ->> '{name}')::text::numeric)".format(**metric)
 
-    def null_filter(self, metric):
-        return "AND (metrics ->> '{name}')::text::numeric IS NOT NULL".format(**metric)
-
-    def init_query(self, metric):
-        select = self.select_metric(metric)
-        null_filter = self.null_filter(metric)
+    @property
+    def null_filter(self):
         if not self.rm_null:
-            null_filter = ""
-        return \
-            """SELECT {select}
-               FROM {table}
-               WHERE {id_col} in (select unnest({ids_array}))
-               {null_filter}
-               """\
-            .format(select=select, table=self.table,
-                    id_col=self.id_col, ids_array=self.ids_array,
-                    null_filter=null_filter)
-
-    def metric_summary_query(self, metric):
+            return ""
+        return "AND m.value IS NOT NULL"
+
+    @property
+    def percentile_fractions(self):
+        return "ARRAY[{}]".format(
+            ", ".join([str(float(per) / 100.0) for per in self.percentiles]))
+
+    def percentile_col(self, per):
+        return percentile_col(per)
+
+    def select_percentile(self, i, per):
+        """
+        Mirror numpy.percentile over the non-zero values, or 0 if
+        there are none.
+        """
         return \
-            """ SELECT array_agg(metric) as metric_arr,
-                       ROUND(avg(metric), 2) as mean,
-                       ROUND(min(metric), 2) as min,
-                       ROUND(median(metric), 2) as median,
-                       ROUND(max(metric), 2) as max
-                       FROM ({0}) AS "{1}"
-            """.format(self.init_query(metric), gen_uuid())
-
-    def select_percentile(self, per):
-        per_col = "per_" + str(per).replace('.', '_')
-        if per_col.endswith('_0'):
-            per_col = per_col[:-2]
-        return "percentile(metric_arr, {}) as {}".format(per, per_col)
+            """CASE WHEN n IS NULL THEN NULL
+                    WHEN pers[{i}] IS NULL THEN '0'::json
+                    ELSE to_json(ROUND(pers[{i}]::numeric, 2))
+               END AS {col}""".format(i=i + 1, col=self.percentile_col(per))
 
     @property
     def select_percentiles(self):
         ss = []
-        for per in self.percentiles:
-            ss.append(self.select_percentile(per))
+        for i, per in enumerate(self.percentiles):
+            ss.append(self.select_percentile(i, per))
         return ",\n".join(ss)
 
-    def metric_query(self, metric):
+    def metrics_query(self, metrics):
+        """
+        Summarize many metrics in a single scan.
+        """
         kw = {
-            'name': metric.get('name'),
+            'table': self.table,
+            'id_col': self.id_col,
+            'ids_array': self.ids_array,
+            'null_filter': self.null_filter,
+            'fractions': self.percentile_fractions,
             'percentiles': self.select_percentiles,
-            'summary_query': self.metric_summary_query(metric),
-            'alias': gen_uuid(),
+            'values': ",\n".join([self.select_metric(m) for m in metrics]),
+            'names': ", ".join(["('{}', {})".format(m['name'], i)
+                                for i, m in enumerate(metrics)])
         }
-
         return \
-            """SELECT '{name}' as metric,
+            """WITH vals AS (
+                  SELECT m.metric, m.value
+                  FROM {table},
+                  LATERAL (VALUES {values}) AS m(metric, value)
+                  WHERE {id_col} in (select unnest({ids_array}))
+                  {null_filter}
+               ),
+               stats AS (
+                  SELECT metric,
+                         count(1) as n,
+                         ROUND(avg(value), 2) as mean,
+                         ROUND(min(value), 2) as min,
+                         ROUND(median(value), 2) as median,
+                         ROUND(max(value), 2) as max,
+                         percentile_cont({fractions})
+                            WITHIN GROUP (ORDER BY value)
+                            FILTER (WHERE value <> 0) as pers
+                  FROM vals
+                  GROUP BY metric
+               )
+               SELECT names.metric,
                       mean, median, min, max,
                       {percentiles}
-               FROM (\n{summary_query}\n) AS "{alias}"
+               FROM (VALUES {names}) AS names(metric, ord)
+               LEFT JOIN stats ON stats.metric = names.metric
+               ORDER BY names.ord
             """.format(**kw)
 
     @property
@@ -90,31 +121,64 @@ class Comparison(object):
         """
         Chunk queries.
         """
-        queries = []
-        for metric in self.metrics.values():
-            queries.append(self.metric_query(metric))
-            if len(queries) % self.bulk_size == 0:
-                yield "\nUNION ALL\n".join(queries)
-        yield "\nUNION ALL\n".join(queries)
+        metrics = self.metrics.values()
+        for i in xrange(0, len(metrics), self.bulk_size):
+            yield self.metrics_query(metrics[i:i + self.bulk_size])
+
+    def fingerprint(self):
+        """
+        A hash which changes whenever the compared items or the
+        comparison's parameters do.
+        """
+        parts = [str(i) for i in sorted(self.ids)]
+        parts.append(str(self.rm_null))
+        parts.extend(sorted(self.metrics.keys()))
+        parts.extend([str(p) for p in self.percentiles])
+        return md5("|".join(parts)).hexdigest()
 
-    def _execute_one(self, query):
+    def updated(self, session=db.session):
+        """
+        When the org's rows last changed.
+        """
+        q = "SELECT max(updated) FROM {table} WHERE org_id = :org_id"\
+            .format(table=self.table)
+        return session.execute(q, {'org_id': self.org.id}).scalar()
+
+    def changed_since(self, updated, session=db.session):
+        """
+        Whether any compared row has changed since `updated`. This
+        only reads the org's rows which changed after it.
+        """
+        if updated is None:
+            return True
+        q = \
+            """SELECT 1 FROM {table}
+               WHERE org_id = :org_id AND updated > :updated
+               AND {id_col} = ANY({ids_array})
+               LIMIT 1
+            """.format(table=self.table, id_col=self.id_col,
+                       ids_array=self.ids_array)
+        params = {'org_id': self.org.id, 'updated': updated}
+        return session.execute(q, params).scalar() is not None
+
+    def _execute_one(self, query, session=db.session):
         """
         Execute the chunked queries and stream the results.
         """
-        res = db.session.execute(query)
+        res = session.execute(query)
         if res:
             for r in ResultIter(res):
                 if r:
                     yield r
 
-    def execute(self):
+    def execute(self, session=db.session):
         """
-        Pooled execution.
+        Execute all chunks.
         """
         for query in self.queries:
-            for r in self._execute_one(query):
+            for r in self._execute_one(query, session):
                 yield r
-        db.session.remove()
+        session.remove()
 
 
 # Comparison Query Objects
@@ -1,4 +1,4 @@
-from newslynx.core import db
+from newslynx.tasks import upsert_metric
 
 
 def refresh_all(org):
@@ -21,7 +21,7 @@ def content_summary(org, ids=[]):
         org.computable_content_summary_metrics,
         extra_cols=['org_id', 'content_item_id'],
         id_col='content_item_id',
-        ids=[]
+        ids=ids
     )
 
 
@@ -70,7 +70,7 @@ def computed_query(org, table,
     if not len(ids):
         id_filter = ""
     else:
-        id_filter = "AND {} not in ARRAY[{}]".format(
+        id_filter = "AND {} = ANY(ARRAY[{}])".format(
             id_col, ",".join([str(i) for i in ids]))
 
     # query kwargs
@@ -85,7 +85,7 @@ def computed_query(org, table,
     }
 
     q = \
-        """SELECT upsert_{table}({extra_cols}, metrics::text)
+        """SELECT {extra_cols}, metrics
            FROM  (
               SELECT
                 {extra_cols},
@@ -105,8 +105,7 @@ def computed_query(org, table,
               ) t2
            ) t3
     """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    upsert_metric.from_query(table, q)
     return True
 
 
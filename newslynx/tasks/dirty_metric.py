@@ -0,0 +1,138 @@
+"""
+Per-org dirty sets of (content_item_id, hour) pairs.
+
+Ingest records which content items and hours it touched. Each rollup
+consumer claims its pending pairs, processes only those, and then
+acknowledges them, advancing its watermark. A failed run releases
+its claim so the pairs are picked up again next time.
+"""
+from newslynx.core import rds
+from newslynx.core import settings
+from newslynx.lib import dates
+
+
+class DirtySet(object):
+
+    """
+    A redis set of (content_item_id, hour) pairs awaiting a rollup.
+    """
+    consumer = None
+    key_prefix = settings.METRICS_DIRTY_PREFIX
+    sep = '|'
+
+    def __init__(self, org_id):
+        self.org_id = org_id
+
+    def format_key(self, *parts):
+        return ":".join([self.key_prefix, str(self.org_id), self.consumer] +
+                        list(parts))
+
+    @property
+    def key(self):
+        return self.format_key('pending')
+
+    @property
+    def processing_key(self):
+        return self.format_key('processing')
+
+    @property
+    def watermark_key(self):
+        return self.format_key('watermark')
+
+    @classmethod
+    def format_member(cls, content_item_id, hour=None):
+        return "{}{}{}".format(content_item_id, cls.sep, hour or '')
+
+    @classmethod
+    def parse_member(cls, member):
+        cid, hour = member.split(cls.sep, 1)
+        return int(cid), hour or None
+
+    def add(self, pairs, pipe=None):
+        """
+        Mark (content_item_id, hour) pairs as dirty.
+        """
+        members = [self.format_member(*p) for p in pairs]
+        if not len(members):
+            return
+        (pipe or rds).sadd(self.key, *members)
+
+    @property
+    def watermark(self):
+        """
+        When this consumer last processed its dirty set,
+        or None if it never has.
+        """
+        return rds.get(self.watermark_key)
+
+    def claim(self):
+        """
+        Move all pending pairs (and any left by a crashed run)
+        into processing and return them.
+        """
+        pipe = rds.pipeline()
+        pipe.sunionstore(self.processing_key, self.processing_key, self.key)
+        pipe.delete(self.key)
+        pipe.smembers(self.processing_key)
+        members = pipe.execute()[-1]
+        return [self.parse_member(m) for m in members]
+
+    def ack(self):
+        """
+        Drop the processed pairs and advance the watermark.
+        """
+        pipe = rds.pipeline()
+        pipe.delete(self.processing_key)
+        pipe.set(self.watermark_key, dates.now().isoformat())
+        pipe.execute()
+
+    def release(self):
+        """
+        Return claimed pairs to the pending set.
+        """
+        pipe = rds.pipeline()
+        pipe.sunionstore(self.key, self.key, self.processing_key)
+        pipe.delete(self.processing_key)
+        pipe.execute()
+
+
+class ContentSummaryDirtySet(DirtySet):
+    consumer = 'content-summary'
+
+
+class OrgTimeseriesDirtySet(DirtySet):
+    consumer = 'org-timeseries'
+
+
+CONSUMERS = [
+    ContentSummaryDirtySet,
+    OrgTimeseriesDirtySet
+]
+
+
+def add(org_id, pairs):
+    """
+    Mark (content_item_id, hour) pairs dirty for every consumer.
+    """
+    pairs = list(pairs)
+    if not len(pairs):
+        return True
+    pipe = rds.pipeline()
+    for consumer in CONSUMERS:
+        consumer(org_id).add(pairs, pipe=pipe)
+    pipe.execute()
+    return True
+
+
+def items(pairs):
+    """
+    The distinct content items in a list of pairs.
+    """
+    return sorted(set([cid for cid, hour in pairs]))
+
+
+def hours(pairs):
+    """
+    The distinct hours in a list of pairs.
+    """
+    return sorted(set([hour for cid, hour in pairs if hour]))
@@ -21,16 +21,22 @@ gevent.monkey.patch_all()
 from gevent.pool import Pool
 
 import logging
+from copy import deepcopy
 from functools import partial
 from datetime import datetime
+from collections import defaultdict
 
 from newslynx.core import db
 from newslynx.util import gen_uuid
-from newslynx.models import Recipe, Event, ContentItem, Author
+from newslynx.models import Recipe, Event, ContentItem, Author, Org
 from newslynx.models import URLCache, ThumbnailCache, ExtractCache
 from newslynx.models.util import get_table_columns, fetch_by_id_or_field
 from newslynx.exc import RequestError
 from newslynx.tasks.util import ResultIter
+from newslynx.tasks import upsert_metric
+from newslynx.tasks import upsert_assc
+from newslynx.tasks import dirty_metric
+from newslynx.tasks import sketch_metric
 from newslynx.util import uniq
 from newslynx.lib import dates
 from newslynx.lib import stats
@@ -38,7 +44,6 @@ from newslynx.lib import url
 from newslynx.lib import text
 from newslynx.lib import html
 from newslynx.lib import author
-from newslynx.lib.serialize import obj_to_json
 from newslynx.core import settings
 from newslynx.constants import (
     METRIC_FACET_KEYS, EVENT_STATUSES,
@@ -117,9 +122,9 @@ def events(data, **kw):
     # STEP 1: Clean data:
 
     def _clean():
-        __prepare = partial(
-            _prepare, requires=requires, recipe=recipe, org_id=org_id, type='event')
-        for obj in p.imap_unordered(__prepare, data):
+        objs = _prepare_many(data, p, requires=requires, recipe=recipe,
+                             org_id=org_id, type='event')
+        for obj in objs:
             # split out tags_ids + content_item_ids + links
             meta[obj['source_id']] = dict(
                 tag_ids=obj.pop('tag_ids', obj.pop('tags', [])),
@@ -332,11 +337,16 @@ def events(data, **kw):
             for cid in meta[src_id].get('content_item_ids', []):
                 ci_args.append((e.id, cid))
 
-        _upsert_associations('upsert_events_tags', tag_args)
-        _upsert_associations('upsert_content_items_events', ci_args)
+        _upsert_associations('events_tags', tag_args)
+        _upsert_associations('content_items_events', ci_args)
+        return ci_args
 
-    _assc()
+    ci_args = _assc()
     db.session.commit()
+
+    # content items with new events need their summaries rolled up.
+    dirty_metric.add(org_id, [(cid, None) for eid, cid in ci_args])
+
     # just return true for the queue.
     if queued:
         ret = True
@@ -389,10 +399,10 @@ def content(data, **kw):
     # STEP 1: Clean data:
 
     def _clean():
-        __prepare = partial(_prepare, requires=requires, recipe=recipe,
-                            org_id=org_id, type='content_item',
-                            extract=kw.get('extract', True))
-        for obj in p.imap_unordered(__prepare, data):
+        objs = _prepare_many(data, p, requires=requires, recipe=recipe,
+                             org_id=org_id, type='content_item',
+                             extract=kw.get('extract', True))
+        for obj in objs:
 
             # determine unique id.
             uniqkey = "{}||{}".format(obj['url'], obj['type'])
@@ -625,8 +635,8 @@ def content(data, **kw):
                 tag_args.append((ci.id, tag_id))
             for aid in meta[uniqkey].get('author_ids', []):
                 author_args.append((ci.id, aid))
-        _upsert_associations('upsert_content_items_tags', tag_args)
-        _upsert_associations('upsert_content_items_authors', author_args)
+        _upsert_associations('content_items_tags', tag_args)
+        _upsert_associations('content_items_authors', author_args)
         db.session.commit()
 
     _assc()
@@ -641,9 +651,37 @@ def content(data, **kw):
     return ret
 
 
-def _prepare(obj, requires=[], recipe=None, type='event', org_id=None, extract=True):
+def _prepare_many(data, pool, requires=[], recipe=None, type='event',
+                  org_id=None, extract=True):
     """
-    Prepare a content item or an event.
+    Prepare a chunk of content items or events, resolving all of
+    their cached urls, extractions and thumbnails in batches.
+    """
+    __prepare = partial(_prepare, requires=requires, type=type)
+    objs = list(pool.imap_unordered(__prepare, data))
+
+    # expand + canonicalize urls
+    _resolve_urls(objs, 'url')
+
+    __finish = partial(_finish, recipe=recipe, type=type, org_id=org_id)
+    objs = list(pool.imap_unordered(__finish, objs))
+
+    # if type is content items and we're extracting. do it.
+    if type == 'content_item' and extract:
+        thumbnails = _resolve_extractions(objs)
+    else:
+        thumbnails = [(obj, False, None) for obj in objs]
+    _resolve_thumbnails(thumbnails)
+
+    # set domain
+    for obj in objs:
+        obj['domain'] = url.get_domain(obj['url'])
+    return objs
+
+
+def _prepare(obj, requires=[], type='event'):
+    """
+    Validate a content item or an event and normalize its url.
     """
 
     # check required fields
@@ -669,12 +707,16 @@ def _prepare(obj, requires=[], recipe=None, type='event', org_id=None, extract=T
     obj.pop('id', None)
     obj.pop('org_id', None)
 
-    # normalize the url
-    if type == 'event':
-        obj['url'] = _prepare_url(obj, 'url', expand=True, canonicalize=False)
+    # normalize the url, urls are expanded in a batch.
+    obj['url'] = _prepare_url(obj, 'url', cache=False)
+
+    return obj
 
-    elif type == 'content_item':
-        obj['url'] = _prepare_url(obj, 'url', expand=True, canonicalize=True)
+
+def _finish(obj, recipe=None, type='event', org_id=None):
+    """
+    Prepare the rest of a content item or an event.
+    """
 
     # sanitize creation date
     obj['created'] = _prepare_date(obj, 'created')
@@ -695,21 +737,52 @@ def _prepare(obj, requires=[], recipe=None, type='event', org_id=None, extract=T
         obj['img_url'] = None
 
     # determine provenance.
-    obj = _provenance(obj, recipe, type)
+    return _provenance(obj, recipe, type)
 
-    # if type is content items and we're extracting. do it.
-    if type == 'content_item' and extract and obj.get('url', None):
-        cr = extract_cache.get(obj.get('url'), type=obj.get('type', None))
 
-        if not cr.value:
-            extract_cache.invalidate(
-                obj.get('url'), type=obj.get('type', None))
-            pass
+def _resolve_urls(objs, field):
+    """
+    Replace prepared urls with their cached, expanded versions.
+    """
+    urls = uniq([o[field] for o in objs if o.get(field, None)])
+    if not len(urls):
+        return
+    responses = url_cache.get_many(urls)
+    for o in objs:
+        if o.get(field, None):
+            o[field] = responses[o[field]].value
+
 
-        # merge extracted data with object.
+def _resolve_extractions(objs):
+    """
+    Merge cached extractions into content items, one batch per type.
+    Returns (obj, extracted, fallback image) tuples for thumbnailing.
+    """
+    by_type = defaultdict(list)
+    thumbnails = []
+    for obj in objs:
+        if obj.get('url', None):
+            by_type[obj.get('type', None)].append(obj)
         else:
-            # merge extracted authors.
-            for k, v in cr.value.items():
+            thumbnails.append((obj, False, None))
+
+    for type, tobjs in by_type.items():
+        responses = extract_cache.get_many(
+            uniq([o['url'] for o in tobjs]), type=type)
+        seen = set()
+        for obj in tobjs:
+            cr = responses[obj['url']]
+            if not cr.value:
+                continue
+
+            # items with the same url can't share extracted lists.
+            value = cr.value
+            if obj['url'] in seen:
+                value = deepcopy(value)
+            seen.add(obj['url'])
+
+            # merge extracted data with object.
+            for k, v in value.items():
                 if not obj.get(k, None):
                     obj[k] = v
                 # preference extracted data
@@ -722,24 +795,42 @@ def _prepare(obj, requires=[], recipe=None, type='event', org_id=None, extract=T
                         for vv in v:
                             if vv not in obj[k]:
                                 obj[k].append(vv)
+            thumbnails.append((obj, True, value.get('img_url', None)))
+    return thumbnails
 
-            # swap bad images.
-            tn = _prepare_thumbnail(obj, 'img_url')
-            if not tn:
-                img = cr.value.get('img_url', None)
-                if img:
-                    obj['img_url'] = img
-                    obj['thumbnail'] = _prepare_thumbnail(obj, 'img_url')
-            else:
-                obj['thumbnail'] = tn
-    else:
-        obj['thumbnail'] = _prepare_thumbnail(obj, 'img_url')
 
-    # set domain
-    obj['domain'] = url.get_domain(obj['url'])
+def _thumbnails(urls):
+    """
+    Thumbnails for many image urls.
+    """
+    urls = uniq([u for u in urls if u])
+    if not len(urls):
+        return {}
+    responses = thumbnail_cache.get_many(urls)
+    return {u: cr.value for u, cr in responses.items()}
 
-    # return prepped object
-    return obj
+
+def _resolve_thumbnails(thumbnails):
+    """
+    Create thumbnails for (obj, extracted, fallback image) tuples in
+    batches. Extracted items whose own image fails swap in the
+    extracted one.
+    """
+    tns = _thumbnails([obj.get('img_url', None) for obj, e, f in thumbnails])
+    retry = []
+    for obj, extracted, fallback in thumbnails:
+        tn = tns.get(obj.get('img_url', None), None)
+        if not extracted or tn:
+            obj['thumbnail'] = tn
+
+        # swap bad images.
+        elif fallback:
+            obj['img_url'] = fallback
+            retry.append(obj)
+
+    tns = _thumbnails([obj['img_url'] for obj in retry])
+    for obj in retry:
+        obj['thumbnail'] = tns.get(obj['img_url'], None)
 
 
 def _provenance(obj, recipe, type='event'):
@@ -771,17 +862,11 @@ def _provenance(obj, recipe, type='event'):
     return obj
 
 
-def _upsert_associations(cmd, ids):
+def _upsert_associations(table, ids):
     """
     Upsert asscications efficiently.
     """
-    query = "SELECT {}({},{})"
-    queries = []
-    for from_id, to_id in ids:
-        queries.append(query.format(cmd, from_id, to_id))
-    if len(queries):
-        q = "\nUNION ALL\n".join(queries)
-        db.session.execute(q)
+    upsert_assc.upsert(table, ids)
 
 
 def _prepare_str(o, field, source_url=None):
@@ -815,7 +900,7 @@ def _prepare_date(o, field):
     return dt
 
 
-def _prepare_url(o, field, source=None, **kw):
+def _prepare_url(o, field, source=None, cache=True, **kw):
     """
     Prepare a url
     """
@@ -829,26 +914,13 @@ def _prepare_url(o, field, source=None, **kw):
 
     # prepare urls before attempting cached request.
     u = url.prepare(o[field], source=source, expand=False, canonicalize=False)
+    if not cache:
+        return u
     cache_response = url_cache.get(u)
 
     return cache_response.value
 
 
-def _prepare_thumbnail(o, field):
-    """
-    Prepare a url
-    """
-    if field not in o:
-        return None
-    if o[field] is None:
-        return None
-    u = o[field]
-
-    # create a thumbnail from an image.
-    cache_response = thumbnail_cache.get(u)
-    return cache_response.value
-
-
 def _check_requires(o, requires, type='Event'):
     """
     Check for presence of required fields.
@@ -882,6 +954,9 @@ def _split_meta(obj, cols):
 
 
 def content_timeseries(data, **kw):
+    """
+    Ingest content timeseries metrics.
+    """
 
     # parse kwargs.
     org_id = kw.get('org_id')
@@ -893,36 +968,22 @@ def content_timeseries(data, **kw):
     if not isinstance(data, list):
         data = [data]
 
-    queries = []
     objects = []
     for obj in data:
         cid = _check_content_item_id(obj, content_item_ids)
         metrics = _prepare_metrics(obj, metrics_lookup)
-
-        cmd_kwargs = {
+        objects.append({
             "org_id": org_id,
             "content_item_id": cid,
-            'datetime': _prepare_metric_date(obj)
-        }
-        # upsert command
-        cmd = """SELECT upsert_content_metric_timeseries(
-                    {org_id},
-                    {content_item_id},
-                    '{datetime}',
-                    '{metrics}')
-               """.format(metrics=obj_to_json(metrics), **cmd_kwargs)
-        queries.append(cmd)
-
-        # build up list of objects.
-        cmd_kwargs['metrics'] = metrics
-        objects.append(cmd_kwargs)
-
-    # execute queries.
-    if len(queries):
-        q = " UNION ALL ".join(queries)
-        db.session.execute(q)
-        db.session.commit()
-        db.session.remove()
+            'datetime': _prepare_metric_date(obj),
+            'metrics': metrics
+        })
+
+    # stage + merge.
+    upsert_metric.content_timeseries(objects)
+    db.session.remove()
+    dirty_metric.add(
+        org_id, [(o['content_item_id'], o['datetime']) for o in objects])
     if queued:
         return True
     return objects
@@ -938,39 +999,30 @@ def content_summary(data, **kw):
     metrics_lookup = kw.get('metrics_lookup', [])
     queued = kw.get('queued', False)
 
-    queries = []
-    objects = []
-
     # standardized format.
     if not isinstance(data, list):
         data = [data]
 
+    objects = []
     for obj in data:
         cid = _check_content_item_id(obj, content_item_ids)
-        cmd_kwargs = {
-            "org_id": org_id,
-            "content_item_id": cid
-        }
         metrics = _prepare_metrics(obj, metrics_lookup)
+        objects.append({
+            "org_id": org_id,
+            "content_item_id": cid,
+            'metrics': metrics
+        })
 
-        # upsert command
-        cmd = """SELECT upsert_content_metric_summary(
-                    {org_id},
-                    {content_item_id},
-                    '{metrics}')
-               """.format(metrics=obj_to_json(metrics), **cmd_kwargs)
-        queries.append(cmd)
-
-        # build up list of objects.
-        cmd_kwargs['metrics'] = metrics
-        objects.append(cmd_kwargs)
-
-    # execute queries.
-    if len(queries):
-        q = " UNION ALL ".join(queries)
-        db.session.execute(q)
-        db.session.commit()
-        db.session.remove()
+    # stage + merge.
+    upsert_metric.content_summary(objects)
+
+    # move the items between comparison sketches.
+    if sketch_metric.built(org_id):
+        org = db.session.query(Org).get(org_id)
+        sketch_metric.update(org, [o['content_item_id'] for o in objects])
+    db.session.remove()
+    dirty_metric.add(
+        org_id, [(o['content_item_id'], None) for o in objects])
     if queued:
         return True
     return objects
@@ -986,39 +1038,23 @@ def org_timeseries(data, **kw):
     metrics_lookup = kw.get('metrics_lookup', [])
     queued = kw.get('queued', False)
 
-    queries = []
-    objects = []
-
     # standardized format.
     if not isinstance(data, list):
         data = [data]
 
+    objects = []
     for obj in data:
         obj.pop('org_id')
         metrics = _prepare_metrics(obj, metrics_lookup)
-        cmd_kwargs = {
+        objects.append({
             "org_id": org_id,
-            'datetime': _prepare_metric_date(obj)
-        }
-        # upsert command
-        cmd = \
-            """SELECT upsert_org_metric_timeseries(
-             {org_id},
-            '{datetime}',
-            '{metrics}')
-        """.format(metrics=obj_to_json(metrics), **cmd_kwargs)
-        queries.append(cmd)
-
-        cmd_kwargs['metrics'] = metrics
-        objects.append(cmd_kwargs)
-
-    # execute queries.
-    if len(queries):
-        q = " UNION ALL ".join(queries)
-        db.session.execute(q)
-        db.session.commit()
-        db.session.remove()
+            'datetime': _prepare_metric_date(obj),
+            'metrics': metrics
+        })
 
+    # stage + merge.
+    upsert_metric.org_timeseries(objects)
+    db.session.remove()
     if queued:
         return True
     return objects
@@ -1033,36 +1069,22 @@ def org_summary(data, **kw):
     metrics_lookup = kw.get('metrics_lookup', [])
     queued = kw.get('queued', False)
 
-    queries = []
-    objects = []
-
     # standardized format.
     if not isinstance(data, list):
         data = [data]
 
+    objects = []
     for obj in data:
         obj.pop('org_id')
         metrics = _prepare_metrics(obj, metrics_lookup)
-        cmd_kwargs = {
+        objects.append({
             "org_id": org_id,
-        }
-        # upsert command
-        cmd = \
-            """SELECT upsert_org_metric_summary(
-             {org_id},
-            '{metrics}')
-        """.format(metrics=obj_to_json(metrics), **cmd_kwargs)
-        queries.append(cmd)
-
-        cmd_kwargs['metrics'] = metrics
-        objects.append(cmd_kwargs)
-
-    # execute queries.
-    if len(queries):
-        q = " UNION ALL ".join(queries)
-        db.session.execute(q)
-        db.session.commit()
-        db.session.remove()
+            'metrics': metrics
+        })
+
+    # stage + merge.
+    upsert_metric.org_summary(objects)
+    db.session.remove()
     if queued:
         return True
     return objects
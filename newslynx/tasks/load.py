@@ -59,7 +59,7 @@ def content_timeseries(data, **kw):
     """
     kw.setdefault('q_timeout', 180)
     kw.setdefault('q_max_workers', )
-    kw.setdefault('q_chunk_size', 200)
+    kw.setdefault('q_chunk_size', 1000)
     kw.setdefault('q_src', 'content_timeseries')
     return bulkload(data, **kw)
 
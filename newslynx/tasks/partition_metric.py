@@ -0,0 +1,133 @@
+"""
+Monthly partitions of content_metric_timeseries.
+
+Rows are routed to one partition per (UTC) month. Points which fall
+outside of every monthly partition land in the default partition and
+are moved out of it when their month's partition is created.
+"""
+import logging
+from datetime import datetime
+
+import pytz
+
+from newslynx.core import db
+from newslynx.core import settings
+from newslynx.lib import dates
+
+log = logging.getLogger(__name__)
+
+TABLE = 'content_metric_timeseries'
+DEFAULT_PARTITION = '{}_default'.format(TABLE)
+
+
+def month_start(d, offset=0):
+    """
+    The first instant of the month of `d`, shifted by `offset` months.
+    """
+    d = d.astimezone(pytz.utc)
+    n = d.year * 12 + (d.month - 1) + offset
+    return datetime(n / 12, (n % 12) + 1, 1, tzinfo=pytz.utc)
+
+
+def partition_name(d):
+    """
+    The name of a month's partition.
+    """
+    return "{}_{}".format(TABLE, month_start(d).strftime('%Y_%m'))
+
+
+def parse_partition_name(name):
+    """
+    The first instant of a partition's month or None if this
+    isn't a monthly partition.
+    """
+    try:
+        return datetime.strptime(name[len(TABLE) + 1:], '%Y_%m')\
+            .replace(tzinfo=pytz.utc)
+    except ValueError:
+        return None
+
+
+def create_default_query():
+    return "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT"\
+           .format(DEFAULT_PARTITION, TABLE)
+
+
+def create_query(d):
+    return "SELECT create_content_metric_timeseries_partition('{}')"\
+           .format(month_start(d).isoformat())
+
+
+def list_query():
+    return \
+        """SELECT c.relname
+           FROM pg_inherits i
+           JOIN pg_class c ON c.oid = i.inhrelid
+           JOIN pg_class p ON p.oid = i.inhparent
+           WHERE p.relname = '{}'
+           ORDER BY c.relname ASC
+        """.format(TABLE)
+
+
+def partitions(session=db.session):
+    """
+    List all monthly partitions as (name, month) tuples.
+    """
+    for r in session.execute(list_query()):
+        month = parse_partition_name(r[0])
+        if month:
+            yield r[0], month
+
+
+def create(months_ahead=None, session=db.session):
+    """
+    Create the default partition and monthly partitions
+    from this month through `months_ahead` months from now.
+    """
+    if months_ahead is None:
+        months_ahead = settings.METRICS_PARTITION_PREMAKE_MONTHS
+    now = dates.now()
+    session.execute(create_default_query())
+    created = []
+    for offset in xrange(int(months_ahead) + 1):
+        d = month_start(now, offset)
+        session.execute(create_query(d))
+        created.append(partition_name(d))
+    session.commit()
+    return created
+
+
+def expire(retention_months=None, drop=False, session=db.session):
+    """
+    Detach (and optionally drop) monthly partitions which
+    ended more than `retention_months` months ago.
+    """
+    if retention_months is None:
+        retention_months = settings.METRICS_PARTITION_RETENTION_MONTHS
+    if retention_months is None:
+        return []
+    cutoff = month_start(dates.now(), -int(retention_months))
+    expired = []
+    for name, month in list(partitions(session)):
+        if month_start(month, 1) > cutoff:
+            continue
+        session.execute(
+            "ALTER TABLE {} DETACH PARTITION {}".format(TABLE, name))
+        if drop:
+            session.execute("DROP TABLE {}".format(name))
+        expired.append(name)
+    session.commit()
+    return expired
+
+
+def maintain(months_ahead=None, retention_months=None, drop=False):
+    """
+    Create upcoming partitions and expire old ones.
+    """
+    created = create(months_ahead)
+    expired = expire(retention_months, drop)
+    log.info('Ensured partitions: {}'.format(", ".join(created)))
+    if len(expired):
+        log.info('{} partitions: {}'.format(
+            'Dropped' if drop else 'Detached', ", ".join(expired)))
+    return {'created': created, 'expired': expired, 'dropped': drop}
@@ -6,6 +6,8 @@ from datetime import datetime, date
 import copy
 
 from newslynx.core import db
+from newslynx.lib import dates
+from newslynx.tasks import compact_metric
 from newslynx.tasks.util import ResultIter
 from newslynx.util import uniq
 
@@ -15,6 +17,11 @@ class TSQuery(object):
 
     """
     An abstract model for querying our timeseries stores.
+
+    Points are hourly, or daily once they've been downsampled by
+    `newslynx.tasks.compact_metric`. Every unit >= day reads both alike.
+    Hourly queries which reach past the compaction horizon bucket the
+    points before it by day, unless `horizon` is None.
     """
     table = None
     id_col = None
@@ -45,6 +52,7 @@ class TSQuery(object):
         self.transform = kw.get('transform', None)
         self.before = kw.get('before', None)
         self.after = kw.get('after', None)
+        self.horizon = kw.get('horizon', True)
         self.metrics = getattr(org, self.metrics_attr)
         self.computed_metrics = getattr(org, self.computed_metrics_attr)
         # self.select_metrics()
@@ -106,6 +114,18 @@ class TSQuery(object):
         """
         Format dates.
         """
+        if self.unit != self.min_unit or not self.horizon:
+            self.horizon = None
+        else:
+            horizon = compact_metric.horizon()
+            after = self.after
+            if isinstance(after, basestring):
+                after = dates.parse_iso(after)
+            if after and after >= horizon:
+                self.horizon = None
+            else:
+                self.horizon = horizon.isoformat()
+
         self.filter_dates = False
         if self.before:
             self.filter_dates = True
@@ -151,6 +171,28 @@ class TSQuery(object):
 
         return "AND {}".format(" AND ".join(clauses))
 
+    @property
+    def date_trunc(self):
+        """
+        Truncate points to the unit, or to the day
+        before the compaction horizon.
+        """
+        if self.horizon:
+            return \
+                """date_trunc(CASE WHEN {date_col} < '{horizon}' THEN 'day'
+                                   ELSE '{unit}' END, {date_col})"""\
+                .format(date_col=self.date_col, horizon=self.horizon,
+                        unit=self.unit)
+        return "date_trunc('{unit}', {date_col})"\
+            .format(unit=self.unit, date_col=self.date_col)
+
+    @property
+    def bucketed(self):
+        """
+        Whether points need aggregating into buckets.
+        """
+        return self.unit != self.min_unit or self.horizon is not None
+
     @property
     def query_kw(self):
         """
@@ -301,8 +343,7 @@ class TSQuery(object):
             init_id_col = ""
 
         # optionally ignore date
-        date_select = "date_trunc('{unit}', {date_col}) as {date_col},"\
-            .format(**self.query_kw)
+        date_select = "{} as {},".format(self.date_trunc, self.date_col)
         if self.unit is None:
             date_select = ""
 
@@ -349,8 +390,7 @@ class TSQuery(object):
             agg_order_by = ""
 
         # optionally ignore date
-        date_select = "date_trunc('{unit}', {date_col}) as {date_col},"\
-                      .format(**self.query_kw)
+        date_select = "{} as {},".format(self.date_trunc, self.date_col)
         date_col = copy.copy(self.date_col)
         if self.unit is None:
             date_select = ""
@@ -418,7 +458,7 @@ class TSQuery(object):
         """
         kwargs for the non-sparse query.
         """
-        if self.unit == self.min_unit:
+        if not self.bucketed:
             init_q = self.init_query
         else:
             init_q = self.agg_query
@@ -433,6 +473,7 @@ class TSQuery(object):
                       .format(self.id_col, self.sparse_table)
         cal_order_by = ", cal.{0}".format(self.id_col)
         cal_date_select = "{}".format(self.date_col)
+        cal_distinct = ""
 
         if not self.group_by_id:
             cal_id_col1 = ""
@@ -441,6 +482,11 @@ class TSQuery(object):
             cal_order_by = ""
             cal_date_select = "distinct({})".format(self.date_col)
 
+        # hours before the horizon collapse into their day.
+        if self.horizon:
+            cal_distinct = "distinct"
+            cal_date_select = "{} as {}".format(self.date_trunc, self.date_col)
+
         return self.add_kw(
             select=self.non_sparse_selects,
             init_q=init_q,
@@ -449,7 +495,8 @@ class TSQuery(object):
             cal_id_col1=cal_id_col1,
             cal_id_col2=cal_id_col2,
             cal_order_by=cal_order_by,
-            cal_date_select=cal_date_select
+            cal_date_select=cal_date_select,
+            cal_distinct=cal_distinct
         )
 
     @property
@@ -462,7 +509,7 @@ class TSQuery(object):
                     {init_q}
                 ),
                 cal as (
-                    select
+                    select {cal_distinct}
                         {cal_id_col1}
                         {cal_date_select}
                         from {cal}
@@ -511,7 +558,7 @@ class TSQuery(object):
         kwargs for the cumulative query.
         """
         # determine initial query
-        if self.sparse and self.unit == 'hour' and self.group_by_id:
+        if self.sparse and not self.bucketed and self.group_by_id:
             init_q = self.init_query
 
         elif self.sparse:
@@ -556,7 +603,7 @@ class TSQuery(object):
 
         # simple query.
         if self.sparse and \
-           self.unit == self.min_unit and \
+           not self.bucketed and \
            not self.transform:
 
             if not self.compute:
@@ -6,12 +6,15 @@ from datetime import timedelta
 from newslynx.lib.serialize import obj_to_json
 from newslynx.exc import NotFoundError, RequestError
 from newslynx.core import db
+from newslynx.core import settings
 from newslynx.lib import dates
 from newslynx.constants import IMPACT_TAG_CATEGORIES, IMPACT_TAG_LEVELS
 from newslynx.tasks.query_metric import (
     QueryContentMetricTimeseries,
     QueryOrgMetricTimeseries
 )
+from newslynx.tasks import upsert_metric
+from newslynx.tasks import dirty_metric
 from newslynx.models import Org
 
 
@@ -29,23 +32,61 @@ def rollup(org, content_item_ids=[], num_hours=24):
 
 def content_summary(org, content_item_ids=[], num_hours=24):
     """
-    Rollup content summary metrics.
+    Rollup content summary metrics. Without explicit ids, only
+    roll up the content items ingest has marked dirty since the
+    last run (or everything updated in the last `num_hours`
+    if this org has never been rolled up incrementally).
+    Returns the ids which were rolled up.
     """
+    dirty = None
     if not len(content_item_ids):
-        content_item_ids = org.content_item_ids
+        dirty = dirty_metric.ContentSummaryDirtySet(org.id)
+        if dirty.watermark:
+            content_item_ids = dirty_metric.items(dirty.claim())
+            num_hours = None
+        else:
+            dirty.claim()
+            content_item_ids = org.content_item_ids
     if not len(content_item_ids):
-        # ignore organizations without content items.
-        return True
-    content_summary_from_events(org, content_item_ids)
-    content_summary_from_content_timeseries(org, content_item_ids, num_hours)
-    return True
+        # ignore organizations without (dirty) content items.
+        if dirty:
+            dirty.ack()
+        return []
+    try:
+        content_summary_from_events(org, content_item_ids, dirty=False)
+        content_summary_from_content_timeseries(
+            org, content_item_ids, num_hours)
+    except Exception as e:
+        if dirty:
+            dirty.release()
+        raise e
+    if dirty:
+        dirty.ack()
+    return content_item_ids
 
 
 def org_timeseries(org, content_item_ids=[], num_hours=24):
     """
-    Rollup content timeseries => org timeseries.
+    Rollup content timeseries => org timeseries. Only the hours
+    ingest has marked dirty since the last run are recomputed
+    (or everything if this org has never been rolled up incrementally).
     """
-    org_timeseries_from_content_timeseries(org, content_item_ids, num_hours)
+    dirty = dirty_metric.OrgTimeseriesDirtySet(org.id)
+    hours = None
+    if dirty.watermark:
+        hours = dirty_metric.hours(dirty.claim())
+        if not len(hours):
+            dirty.ack()
+            return True
+    else:
+        dirty.claim()
+    try:
+        org_timeseries_from_content_timeseries(
+            org, content_item_ids, num_hours, hours=hours)
+    except Exception as e:
+        dirty.release()
+        raise e
+    dirty.ack()
     return True
 
 
@@ -61,10 +102,12 @@ def org_summary(org):
 
 # custom event rollup.
 
-def content_summary_from_events(org, content_item_ids=[]):
+def content_summary_from_events(org, content_item_ids=[], dirty=True):
     """
     Count up impact tag categories + levels assigned to events
-    by the content_items they're associated with.
+    by the content_items they're associated with. Unless `dirty` is
+    False, the items are marked dirty so their computed metrics
+    are refreshed by the next incremental rollup.
     """
     if not isinstance(content_item_ids, list):
         content_item_ids = [content_item_ids]
@@ -101,9 +144,11 @@ def content_summary_from_events(org, content_item_ids=[]):
         event_tag_metrics.append(kw['name'])
 
     content_ids_filter = ""
+    null_ids_filter = ""
     if len(content_item_ids):
-        content_ids_filter = "AND content_item_id in ({})"\
-            .format(",".join([str(i) for i in content_item_ids]))
+        ids = ",".join([str(i) for i in content_item_ids])
+        content_ids_filter = "AND content_item_id in ({})".format(ids)
+        null_ids_filter = "AND id in ({})".format(ids)
 
     # query formatting kwargs
     qkw = {
@@ -111,36 +156,32 @@ def content_summary_from_events(org, content_item_ids=[]):
         "case_statements": ",\n".join(case_statements),
         "org_id": org.id,
         "null_metrics": obj_to_json({k: 0 for k in event_tag_metrics}),
-        "content_ids_filter": content_ids_filter
+        "content_ids_filter": content_ids_filter,
+        "null_ids_filter": null_ids_filter
     }
 
     # optionally add in null-query
     null_q = """
         -- Content Items With No Approved Events
         , null_metrics AS (
-            SELECT upsert_content_metric_summary(t.org_id, t.content_item_id, '{null_metrics}')
-            FROM (
-                SELECT org_id, id as content_item_id
-                FROM content
-                WHERE org_id = {org_id} AND
-                id NOT IN (
-                    SELECT distinct(content_item_id)
-                    FROM content_event_metrics
-                    )
-            ) t
+            SELECT org_id, id as content_item_id, '{null_metrics}'::jsonb as metrics
+            FROM content
+            WHERE org_id = {org_id} AND
+            id NOT IN (
+                SELECT distinct(content_item_id)
+                FROM content_event_metrics
+                )
+            {null_ids_filter}
         )
     """.format(**qkw)
 
-    # add in null query if we're not filtering
-    # by specific content item ids.
-    qkw['null_query'] = ""
-    qkw['final_query'] = "select * from positive_metrics"
-    if not content_ids_filter:
-        qkw['null_query'] = null_q
-        qkw['final_query'] = """
-            select * from positive_metrics
-            UNION ALL
-            select * from  null_metrics"""
+    # zero out items without approved events so that
+    # removed events are reflected too.
+    qkw['null_query'] = null_q
+    qkw['final_query'] = """
+        select * from positive_metrics
+        UNION ALL
+        select * from  null_metrics"""
 
     q = """
         WITH content_event_tags AS (
@@ -176,21 +217,22 @@ def content_summary_from_events(org, content_item_ids=[]):
             SELECT
                 org_id,
                 content_item_id,
-                (SELECT row_to_json(_) from (SELECT {metrics}) as _) as metrics
+                (SELECT row_to_json(_) from (SELECT {metrics}) as _)::jsonb as metrics
             FROM content_event_tag_counts
         ),
 
         -- Content Items With Approved Events
         positive_metrics AS (
-            SELECT
-                upsert_content_metric_summary(org_id, content_item_id, metrics::text)
+            SELECT org_id, content_item_id, metrics
             FROM content_event_metrics
         )
         {null_query}
         {final_query}
         """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    upsert_metric.from_query('content_metric_summary', q)
+    if dirty:
+        dirty_metric.ContentSummaryDirtySet(org.id)\
+            .add([(cid, None) for cid in content_item_ids])
     return True
 
 
@@ -201,6 +243,8 @@ def content_summary_from_content_timeseries(org, content_item_ids=[], num_hours=
     Rollup content-timseries metrics into summaries.
     Optimize this query by only updating content items
     which have had updates to their metrics in the last X hours.
+    If `num_hours` is None, all of the given content items are
+    rolled up.
     """
 
     # just use this to generate a giant timeseries select with computed
@@ -209,15 +253,26 @@ def content_summary_from_content_timeseries(org, content_item_ids=[], num_hours=
     ts.compute = False
     metrics, ss = _summary_select(org.content_timeseries_metric_rollups)
 
+    updated_filter = ""
+    if num_hours is not None:
+        updated_filter = \
+            """WHERE zzzz.content_item_id in (
+                    SELECT
+                        distinct(content_item_id)
+                    FROM content_metric_timeseries
+                    WHERE updated > '{}'
+                    )
+            """.format((dates.now() - timedelta(hours=num_hours)).isoformat())
+
     qkw = {
         'select_statements': ss,
         'metrics': metrics,
         'org_id': org.id,
-        'last_updated': (dates.now() - timedelta(hours=num_hours)).isoformat(),
+        'updated_filter': updated_filter,
         'ts_query': ts.query,
     }
 
-    q = """SELECT upsert_content_metric_summary({org_id}, content_item_id, metrics::text)
+    q = """SELECT {org_id} AS org_id, content_item_id, metrics
            FROM  (
               SELECT
                 content_item_id,
@@ -227,28 +282,36 @@ def content_summary_from_content_timeseries(org, content_item_ids=[], num_hours=
                     content_item_id,
                     {select_statements}
                 FROM ({ts_query}) zzzz
-                WHERE zzzz.content_item_id in (
-                    SELECT
-                        distinct(content_item_id)
-                    FROM content_metric_timeseries
-                    WHERE updated > '{last_updated}'
-                    )
+                {updated_filter}
                 GROUP BY content_item_id
                 ) t1
             ) t2
         """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    upsert_metric.from_query('content_metric_summary', q)
     return True
 
 
-def org_timeseries_from_content_timeseries(org, content_item_ids=[], num_hours=24):
+def org_timeseries_from_content_timeseries(org, content_item_ids=[], num_hours=24,
+                                           hours=None):
     """
     Rollup content timeseries => org timeseries.
+    If `hours` is passed, only recompute those hours.
     """
-    # summarize the content timeseries table
+    ts_kw = {}
+    hours_filter = ""
+    if hours:
+        # look back far enough to difference cumulative metrics.
+        after = dates.parse_iso(min(hours), enforce_tz=True) - \
+            timedelta(hours=settings.METRICS_ROLLUP_LOOKBACK_HOURS)
+        ts_kw = {'after': after, 'before': max(hours)}
+        hours_filter = "WHERE datetime = ANY(ARRAY[{}]::timestamptz[])"\
+            .format(",".join(["'{}'".format(h) for h in hours]))
+
+    # summarize the content timeseries table. points are rolled up
+    # as they're stored; compaction downsamples the org's own rows.
     content_ts = QueryContentMetricTimeseries(org, org.content_item_ids,
-                                              unit='hour', group_by_id=False)
+                                              unit='hour', group_by_id=False,
+                                              horizon=None, **ts_kw)
     content_ts.compute = False
     # select statements.
     metrics, ss = _summary_select(org.timeseries_metric_rollups)
@@ -257,12 +320,13 @@ def org_timeseries_from_content_timeseries(org, content_item_ids=[], num_hours=2
         'org_id': org.id,
         'metrics': metrics,
         'select_statements': ss,
+        'hours_filter': hours_filter,
         'ts_query': content_ts.query
     }
 
     # generate the query
     q = \
-        """SELECT upsert_org_metric_timeseries({org_id}, datetime, metrics::text)
+        """SELECT {org_id} AS org_id, datetime, metrics
            FROM  (
               SELECT
                 datetime,
@@ -272,12 +336,12 @@ def org_timeseries_from_content_timeseries(org, content_item_ids=[], num_hours=2
                     datetime,
                     {select_statements}
                 FROM ({ts_query}) zzzz
+                {hours_filter}
                 GROUP BY datetime
                 ) t1
             ) t2
     """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    upsert_metric.from_query('org_metric_timeseries', q)
     return True
 
 
@@ -296,7 +360,7 @@ def org_summary_from_content_summary(org):
         'org_id': org.id
     }
     q = \
-        """SELECT upsert_org_metric_summary({org_id}, metrics::text)
+        """SELECT {org_id} AS org_id, metrics
            FROM  (
               SELECT
                 (SELECT row_to_json(_) from (SELECT {metrics}) as _) as metrics
@@ -314,8 +378,7 @@ def org_summary_from_content_summary(org):
                 ) t1
             ) t2
         """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    upsert_metric.from_query('org_metric_summary', q)
     return True
 
 
@@ -335,7 +398,7 @@ def org_summary_from_org_timeseries(org):
         'ts_query': ts_query.query
     }
     q = \
-        """SELECT upsert_org_metric_summary({org_id}, metrics::text)
+        """SELECT {org_id} AS org_id, metrics
            FROM  (
               SELECT
                 (SELECT row_to_json(_) from (SELECT {metrics}) as _) as metrics
@@ -346,8 +409,7 @@ def org_summary_from_org_timeseries(org):
                 ) t1
             ) t2
         """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    upsert_metric.from_query('org_metric_summary', q)
     return True
 
 
@@ -0,0 +1,311 @@
+"""
+Percentile sketches of content summary metrics.
+
+Every org keeps a `QuantileSketch` per comparison facet and metric in
+redis. A content item's current values are also kept, along with the
+facets it counted toward. When its summary changes, the old values are
+moved out of those facets and the new values into the facets it
+belongs to now. This all happens in one lua script per item, so
+updates are atomic and O(facets * metrics) per item regardless of the
+size of the org. Comparisons are then read straight out of the
+sketches instead of being recomputed from `content_metric_summary`.
+
+Tagging a content item without changing its metrics does not move it
+between facets until its next update, so sketches are periodically
+rebuilt from scratch alongside the exact comparisons. See
+`newslynx.lib.sketch` for accuracy bounds.
+"""
+from collections import defaultdict
+
+from newslynx.core import db, rds
+from newslynx.core import settings
+from newslynx.lib import dates
+from newslynx.lib.sketch import QuantileSketch
+from newslynx.tasks.compare_metric import percentile_col
+from newslynx.util import chunk_list
+
+FACET_TYPES = ['all', 'types', 'subject_tags', 'impact_tags']
+TAG_FACET_TYPES = ['subject_tags', 'impact_tags']
+CHUNK_SIZE = 1000
+
+# ARGV: base key, content item id, number of facets, facets...,
+#       then (metric, bucket, value) triples. An empty bucket
+#       means the metric no longer has a value.
+UPDATE_SCRIPT = rds.register_script("""
+local base, cid = ARGV[1], ARGV[2]
+local n = tonumber(ARGV[3])
+local new_facets = {}
+for i = 1, n do
+  new_facets[i] = ARGV[3 + i]
+end
+local members_key = base .. ':members:' .. cid
+local old_facets = redis.call('SMEMBERS', members_key)
+
+local function incr(facet, metric, bucket, value, sign)
+  local key = base .. ':' .. facet .. ':' .. metric
+  if redis.call('HINCRBY', key, bucket, sign) == 0 then
+    redis.call('HDEL', key, bucket)
+  end
+  redis.call('HINCRBY', key, 'count', sign)
+  redis.call('HINCRBYFLOAT', key, 'sum', tostring(sign * tonumber(value)))
+end
+
+for i = 4 + n, #ARGV, 3 do
+  local metric, bucket, value = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+  local values_key = base .. ':values:' .. metric
+  local old = redis.call('HGET', values_key, cid)
+  if old then
+    local sep = string.find(old, '|', 1, true)
+    local old_bucket = string.sub(old, 1, sep - 1)
+    local old_value = string.sub(old, sep + 1)
+    for _, f in ipairs(old_facets) do
+      incr(f, metric, old_bucket, old_value, -1)
+    end
+  end
+  if bucket ~= '' then
+    for _, f in ipairs(new_facets) do
+      incr(f, metric, bucket, value, 1)
+    end
+    redis.call('HSET', values_key, cid, bucket .. '|' .. value)
+  elseif old then
+    redis.call('HDEL', values_key, cid)
+  end
+end
+
+redis.call('DEL', members_key)
+if n > 0 then
+  redis.call('SADD', members_key, unpack(new_facets))
+  redis.call('SADD', base .. ':facets', unpack(new_facets))
+end
+return 1
+""")
+
+
+# KEYS
+
+def base_key(org_id):
+    return "{}:{}".format(settings.COMPARISON_SKETCH_PREFIX, org_id)
+
+
+def built_key(org_id):
+    return "{}:built".format(base_key(org_id))
+
+
+def facets_key(org_id):
+    return "{}:facets".format(base_key(org_id))
+
+
+def sketch_key(org_id, facet, metric):
+    return "{}:{}:{}".format(base_key(org_id), facet, metric)
+
+
+def format_facet(type, value):
+    return "{}|{}".format(type, value)
+
+
+def parse_facet(facet):
+    type, value = facet.split('|', 1)
+    if type in TAG_FACET_TYPES:
+        value = int(value)
+    return type, value
+
+
+# QUERIES
+
+def items_query(org_id, content_item_ids):
+    """
+    Content items' summary metrics and the facets they belong to.
+    """
+    return \
+        """SELECT c.id, c.type, s.metrics,
+                  ARRAY(SELECT ct.tag_id
+                        FROM content_items_tags ct
+                        JOIN tags t ON t.id = ct.tag_id
+                        WHERE ct.content_item_id = c.id
+                        AND t.type = 'subject') AS subject_tags,
+                  ARRAY(SELECT DISTINCT et.tag_id
+                        FROM content_items_events ce
+                        JOIN events_tags et ON et.event_id = ce.event_id
+                        JOIN tags t ON t.id = et.tag_id
+                        WHERE ce.content_item_id = c.id
+                        AND t.type = 'impact') AS impact_tags
+           FROM content c
+           LEFT JOIN content_metric_summary s
+             ON s.org_id = c.org_id AND s.content_item_id = c.id
+           WHERE c.org_id = {}
+           AND c.id = ANY(ARRAY[{}])
+        """.format(org_id, ",".join([str(i) for i in content_item_ids]))
+
+
+def item_facets(row):
+    """
+    The facets a content item counts toward.
+    """
+    facets = [format_facet('all', 'all')]
+    if row.type:
+        facets.append(format_facet('types', row.type))
+    for tag_id in row.subject_tags or []:
+        facets.append(format_facet('subject_tags', tag_id))
+    for tag_id in row.impact_tags or []:
+        facets.append(format_facet('impact_tags', tag_id))
+    return facets
+
+
+def parse_value(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# MAINTENANCE
+
+def built(org_id):
+    """
+    When an org's sketches were last rebuilt, or None if they
+    haven't been (at the current accuracy).
+    """
+    b = rds.hgetall(built_key(org_id))
+    if not b or float(b.get('accuracy', 0)) != \
+            settings.COMPARISON_SKETCH_ACCURACY:
+        return None
+    return dates.parse_iso(b['at'])
+
+
+def _apply(org, content_item_ids, session):
+    """
+    Move content items' current values between facet sketches.
+    """
+    metrics = org.content_metric_comparisons.keys()
+    sketch = QuantileSketch(settings.COMPARISON_SKETCH_ACCURACY)
+    base = base_key(org.id)
+    n = 0
+    for ids in chunk_list(sorted(set(content_item_ids)), CHUNK_SIZE):
+        rows = {}
+        for r in session.execute(items_query(org.id, ids)):
+            rows[r.id] = r
+        pipe = rds.pipeline(transaction=False)
+        for cid in ids:
+            r = rows.get(cid)
+            facets = item_facets(r) if r else []
+            args = [base, cid, len(facets)] + facets
+            for name in metrics:
+                value = None
+                if r and r.metrics:
+                    value = parse_value(r.metrics.get(name))
+                if value is None:
+                    args.extend([name, '', ''])
+                else:
+                    args.extend([name, sketch.bucket(value), repr(value)])
+            UPDATE_SCRIPT(keys=[], args=args, client=pipe)
+        pipe.execute()
+        n += len(ids)
+    return n
+
+
+def update(org, content_item_ids, session=db.session):
+    """
+    Update an org's sketches with the current summaries of
+    these content items. A no-op until the sketches are built.
+    """
+    if not isinstance(content_item_ids, list):
+        content_item_ids = [content_item_ids]
+    if not len(content_item_ids) or not built(org.id):
+        return 0
+    return _apply(org, content_item_ids, session)
+
+
+def clear(org_id):
+    """
+    Delete all of an org's sketches.
+    """
+    pipe = rds.pipeline(transaction=False)
+    for k in rds.scan_iter(match="{}:*".format(base_key(org_id)), count=1000):
+        pipe.delete(k)
+    pipe.execute()
+
+
+def rebuild(org, session=db.session):
+    """
+    Rebuild an org's sketches from content_metric_summary.
+    Comparisons fall back to the exact engine until this is done.
+    """
+    clear(org.id)
+    q = "SELECT id FROM content WHERE org_id = {}".format(org.id)
+    ids = [r[0] for r in session.execute(q)]
+    n = _apply(org, ids, session)
+    rds.hmset(built_key(org.id), {
+        'at': dates.now().isoformat(),
+        'accuracy': settings.COMPARISON_SKETCH_ACCURACY
+    })
+    return n
+
+
+# COMPARISONS
+
+def _round(v):
+    if v is None:
+        return None
+    return round(v, 2)
+
+
+def summarize(name, sketch, percentiles):
+    """
+    A comparison row in the shape `ContentComparison` returns.
+    """
+    row = {'metric': name, 'mean': None, 'median': None,
+           'min': None, 'max': None}
+    for per in percentiles:
+        row[percentile_col(per)] = None
+    if sketch.count <= 0:
+        return row
+    row['mean'] = _round(sketch.mean)
+    row['median'] = _round(sketch.median)
+    row['min'] = _round(sketch.min)
+    row['max'] = _round(sketch.max)
+    for per in percentiles:
+        v = sketch.quantile(float(per) / 100.0, nonzero=True)
+        row[percentile_col(per)] = _round(v) if v is not None else 0
+    return row
+
+
+def comparisons(org, facet_types=None):
+    """
+    Read comparisons out of an org's sketches in the shape
+    `ComparisonsCache` returns, or None if they aren't built.
+    """
+    if not built(org.id):
+        return None
+    facet_types = facet_types or FACET_TYPES
+    metrics = org.content_metric_comparisons
+    percentiles = settings.COMPARISON_PERCENTILES
+    accuracy = settings.COMPARISON_SKETCH_ACCURACY
+
+    facets = [f for f in sorted(rds.smembers(facets_key(org.id)))
+              if parse_facet(f)[0] in facet_types]
+    keys = []
+    pipe = rds.pipeline(transaction=False)
+    for f in facets:
+        for name in metrics.keys():
+            pipe.hgetall(sketch_key(org.id, f, name))
+            keys.append((f, name))
+
+    rows = defaultdict(list)
+    counts = defaultdict(int)
+    for (f, name), fields in zip(keys, pipe.execute()):
+        sketch = QuantileSketch.from_fields(fields, accuracy)
+        rows[f].append(summarize(name, sketch, percentiles))
+        counts[f] += max(sketch.count, 0)
+
+    output = {t: {} for t in facet_types if t != 'all'}
+    for f in facets:
+        if not counts[f]:
+            continue
+        type, value = parse_facet(f)
+        if type == 'all':
+            output['all'] = rows[f]
+        else:
+            output[type][value] = rows[f]
+    return output
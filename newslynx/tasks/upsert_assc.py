@@ -0,0 +1,57 @@
+"""
+Set-based upserts for our association tables.
+"""
+from newslynx.core import db
+
+
+# a lookup of association table => column order of the id pairs we pass in.
+ASSOCIATIONS = {
+    'events_tags': ('event_id', 'tag_id'),
+    'content_items_events': ('event_id', 'content_item_id'),
+    'content_items_tags': ('content_item_id', 'tag_id'),
+    'content_items_authors': ('content_item_id', 'author_id')
+}
+
+
+def upsert_query(table, ids):
+    """
+    Insert all pairs of ids in a single statement, ignoring
+    the ones which already exist.
+    """
+    values = ",".join(
+        ["({},{})".format(int(f), int(t)) for f, t in ids])
+    return \
+        """INSERT INTO {table} ({cols})
+           VALUES {values}
+           ON CONFLICT DO NOTHING
+        """.format(table=table, cols=", ".join(ASSOCIATIONS[table]),
+                   values=values)
+
+
+def upsert(table, ids, **kw):
+    """
+    Upsert a list of (from_id, to_id) pairs into an association table.
+    """
+    session = kw.get('session', db.session)
+    if not len(ids):
+        return True
+    session.execute(upsert_query(table, ids))
+    return True
+
+
+# short cuts
+
+def events_tags(ids, **kw):
+    return upsert('events_tags', ids, **kw)
+
+
+def content_items_events(ids, **kw):
+    return upsert('content_items_events', ids, **kw)
+
+
+def content_items_tags(ids, **kw):
+    return upsert('content_items_tags', ids, **kw)
+
+
+def content_items_authors(ids, **kw):
+    return upsert('content_items_authors', ids, **kw)
@@ -0,0 +1,255 @@
+"""
+Set-based upserts for our metric stores.
+
+Rather than issuing one `upsert_*` function call per data point,
+we either stream prepared rows into a temporary staging table
+with `COPY` or select them from a query, and then merge the whole
+batch into the target table with a single `INSERT ... ON CONFLICT`
+statement.
+"""
+import csv
+import logging
+import cStringIO
+from collections import OrderedDict
+
+from psycopg2 import extensions
+
+from newslynx.core import db
+from newslynx.lib.serialize import obj_to_json
+
+log = logging.getLogger(__name__)
+
+
+class BulkUpsert(object):
+
+    """
+    An abstract model for bulk-merging rows into a metrics store.
+    """
+    table = None
+    key_cols = []
+    col_types = {}
+    has_updated = False
+
+    metrics_col = 'metrics'
+
+    def __init__(self, rows=[], **kw):
+        self.rows = self.dedupe(rows)
+        self.session = kw.get('session', db.session)
+
+    @property
+    def staging_table(self):
+        """
+        The name of the temporary staging table.
+        """
+        return "{}_staging".format(self.table)
+
+    @property
+    def cols(self):
+        return self.key_cols + [self.metrics_col]
+
+    def key(self, row):
+        return tuple(row[c] for c in self.key_cols)
+
+    def dedupe(self, rows):
+        """
+        Multiple points for the same key within a batch are
+        merged in order, just like sequential upserts would.
+        A single INSERT ... ON CONFLICT cannot touch a row twice.
+        """
+        lookup = OrderedDict()
+        for row in rows:
+            k = self.key(row)
+            if k not in lookup:
+                lookup[k] = dict(row)
+                lookup[k][self.metrics_col] = \
+                    dict(row.get(self.metrics_col, {}))
+            else:
+                lookup[k][self.metrics_col]\
+                    .update(row.get(self.metrics_col, {}))
+        return lookup.values()
+
+    @property
+    def staging_query(self):
+        """
+        The staging table.
+        """
+        cols = []
+        for c in self.key_cols:
+            cols.append("{} {}".format(c, self.col_types[c]))
+        cols.append("{} text".format(self.metrics_col))
+        return \
+            """CREATE TEMP TABLE IF NOT EXISTS {staging_table} (
+                    {cols}
+               ) ON COMMIT DROP
+            """.format(staging_table=self.staging_table,
+                       cols=",\n".join(cols))
+
+    @property
+    def copy_query(self):
+        return "COPY {} ({}) FROM STDIN WITH CSV"\
+            .format(self.staging_table, ", ".join(self.cols))
+
+    @property
+    def copy_buffer(self):
+        """
+        Serialize rows to csv for COPY.
+        """
+        buf = cStringIO.StringIO()
+        writer = csv.writer(buf)
+        for row in self.rows:
+            values = [row[c] for c in self.key_cols]
+            values.append(obj_to_json(row[self.metrics_col]))
+            writer.writerow(values)
+        buf.seek(0)
+        return buf
+
+    @property
+    def staged_query(self):
+        """
+        Select staged rows.
+        """
+        return "SELECT {}, {}::jsonb AS {} FROM {}"\
+            .format(", ".join(self.key_cols), self.metrics_col,
+                    self.metrics_col, self.staging_table)
+
+    def merge_query(self, source_query):
+        """
+        Insert the rows a query returns, merging metrics
+        into the rows which already exist with jsonb's `||`.
+        `source_query` must select the key columns and a json(b)
+        metrics column, with at most one row per key.
+        """
+        set_updated = ""
+        ins_updated = ""
+        sel_updated = ""
+        if self.has_updated:
+            set_updated = ", updated = current_timestamp"
+            ins_updated = ", updated"
+            sel_updated = ", current_timestamp"
+
+        qkw = {
+            'table': self.table,
+            'source_query': source_query,
+            'metrics_col': self.metrics_col,
+            'key_cols': ", ".join(self.key_cols),
+            'set_updated': set_updated,
+            'ins_updated': ins_updated,
+            'sel_updated': sel_updated
+        }
+        return \
+            """INSERT INTO {table} ({key_cols}, {metrics_col} {ins_updated})
+               SELECT {key_cols}, {metrics_col}::jsonb {sel_updated}
+               FROM ({source_query}) s
+               ON CONFLICT ({key_cols}) DO UPDATE
+               SET {metrics_col} = COALESCE({table}.{metrics_col}, '{{}}'::jsonb) || EXCLUDED.{metrics_col}
+                   {set_updated}
+            """.format(**qkw)
+
+    def execute(self):
+        """
+        Stage + merge all rows in one transaction.
+        """
+        if not len(self.rows):
+            return True
+        self.session.execute(self.staging_query)
+        conn = self.session.connection().connection
+        cursor = conn.cursor()
+        # psycopg2 refuses to COPY on a green connection, so
+        # this blocks the hub for the duration of the COPY.
+        wait = extensions.get_wait_callback()
+        extensions.set_wait_callback(None)
+        try:
+            cursor.copy_expert(self.copy_query, self.copy_buffer)
+        finally:
+            extensions.set_wait_callback(wait)
+        self.session.execute(self.merge_query(self.staged_query))
+        self.session.commit()
+        return True
+
+    def execute_query(self, source_query):
+        """
+        Merge the results of a query.
+        """
+        self.session.execute(self.merge_query(source_query))
+        self.session.commit()
+        return True
+
+
+class ContentMetricTimeseriesUpsert(BulkUpsert):
+    table = "content_metric_timeseries"
+    key_cols = ['org_id', 'content_item_id', 'datetime']
+    col_types = {
+        'org_id': 'int',
+        'content_item_id': 'int',
+        'datetime': 'timestamp with time zone'
+    }
+    has_updated = True
+
+
+class ContentMetricSummaryUpsert(BulkUpsert):
+    table = "content_metric_summary"
+    key_cols = ['org_id', 'content_item_id']
+    col_types = {
+        'org_id': 'int',
+        'content_item_id': 'int'
+    }
+    has_updated = True
+
+
+class OrgMetricTimeseriesUpsert(BulkUpsert):
+    table = "org_metric_timeseries"
+    key_cols = ['org_id', 'datetime']
+    col_types = {
+        'org_id': 'int',
+        'datetime': 'timestamp with time zone'
+    }
+    has_updated = True
+
+
+class OrgMetricSummaryUpsert(BulkUpsert):
+    table = "org_metric_summary"
+    key_cols = ['org_id']
+    col_types = {
+        'org_id': 'int'
+    }
+
+
+# a lookup of table => upsert
+UPSERTS = {
+    'content_metric_timeseries': ContentMetricTimeseriesUpsert,
+    'content_metric_summary': ContentMetricSummaryUpsert,
+    'org_metric_timeseries': OrgMetricTimeseriesUpsert,
+    'org_metric_summary': OrgMetricSummaryUpsert
+}
+
+
+def from_rows(table, rows, **kw):
+    """
+    Bulk upsert a list of rows into a metrics table.
+    """
+    return UPSERTS[table](rows, **kw).execute()
+
+
+def from_query(table, source_query, **kw):
+    """
+    Bulk upsert the results of a query into a metrics table.
+    """
+    return UPSERTS[table](**kw).execute_query(source_query)
+
+
+# short cuts
+
+def content_timeseries(rows, **kw):
+    return ContentMetricTimeseriesUpsert(rows, **kw).execute()
+
+
+def content_summary(rows, **kw):
+    return ContentMetricSummaryUpsert(rows, **kw).execute()
+
+
+def org_timeseries(rows, **kw):
+    return OrgMetricTimeseriesUpsert(rows, **kw).execute()
+
+
+def org_summary(rows, **kw):
+    return OrgMetricSummaryUpsert(rows, **kw).execute()
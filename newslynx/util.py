@@ -82,3 +82,18 @@ def chunk_list(l, n):
     """
     for i in xrange(0, len(l), n):
         yield l[i:i+n]
+
+
+def chunk_iter(it, n):
+    """
+    Yield successive n-sized lists from an iterable
+    without reading it all into memory.
+    """
+    chunk = []
+    for x in it:
+        chunk.append(x)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if len(chunk):
+        yield chunk
@@ -2,6 +2,8 @@ import logging
 from collections import defaultdict
 
 from operator import itemgetter
+
+import numpy as np
 from flask import Blueprint
 
 from newslynx.views.decorators import load_user, load_org
@@ -14,6 +16,8 @@ from newslynx.models import (
     ContentTypeComparisonCache,
     ImpactTagsComparisonCache,
     OrgMetricSummary, ContentMetricSummary)
+from newslynx.models.cache import CacheResponse
+from newslynx.tasks import sketch_metric
 
 from newslynx.views.util import arg_bool
 
@@ -47,6 +51,15 @@ def response_from_cache(cr):
     return resp
 
 
+def response_from_refresh(cr):
+    """
+    Report any facets which failed to refresh.
+    """
+    if cr.failures:
+        return jsonify({'success': False, 'failures': cr.failures})
+    return jsonify({'success': True})
+
+
 def parse_comparison_type(type, level):
     """
     Parse a comparison type.
@@ -68,15 +81,34 @@ def parse_comparison_level(level):
     return level
 
 
+def get_sketch_comparison(org, type):
+    """
+    Read a content comparison from the org's percentile sketches,
+    or None if they haven't been built yet.
+    """
+    facet_types = None if type == 'all' else [type]
+    value = sketch_metric.comparisons(org, facet_types)
+    if value is None:
+        return None
+    return CacheResponse(sketch_metric.built_key(org.id), value,
+                         sketch_metric.built(org.id), True)
+
+
 def get_comparison(*args, **kwargs):
     """
     Get a single comparison.
     """
+    org = kwargs.pop('org', None)
     level = kwargs.pop('level')
     type = kwargs.pop('type')
     level = parse_comparison_level(level)
     type = parse_comparison_type(type, level)
     refresh = arg_bool('refresh', default=False)
+    exact = arg_bool('exact', default=False)
+    if org and level == 'content' and not refresh and not exact:
+        cr = get_sketch_comparison(org, type)
+        if cr:
+            return cr
     fx = comparison_types[level][type]
     if refresh:
         fx.invalidate(*args, **kwargs)
@@ -93,6 +125,7 @@ def refresh_comparison(*args, **kwargs):
     """
 
     # parse kwargs
+    org = kwargs.pop('org', None)
     level = kwargs.pop('level')
     type = kwargs.pop('type')
     level = parse_comparison_level(level)
@@ -104,14 +137,37 @@ def refresh_comparison(*args, **kwargs):
     if not cr.value or cr.is_cached:
         raise InternalServerError(
             'Something went wrong with the cache invalidation process.')
+
+    # rebuild sketches alongside the exact comparisons
+    if org and level == 'content':
+        sketch_metric.rebuild(org)
     return cr
 
 
+def parse_level_ids(level_id):
+    """
+    Parse one or more comma-separated ids.
+    """
+    ids = []
+    for i in str(level_id).split(','):
+        i = i.strip()
+        if not i:
+            continue
+        try:
+            ids.append(int(i))
+        except ValueError:
+            raise RequestError("'{}' is not a valid id.".format(i))
+    return ids
+
+
 def get_comparison_items(level, level_id, org_id):
     """
     Get a comparison item for any level. We can add more functions to
     this as our needs grow.
     """
+    if not isinstance(level_id, list):
+        level_id = parse_level_ids(level_id)
+
     fx = {
         'content': ContentMetricSummary.query
                         .filter_by(org_id=org_id)\
@@ -120,25 +176,14 @@ def get_comparison_items(level, level_id, org_id):
                     .filter(OrgMetricSummary.org_id.in_(level_id)),
     }
 
-    if not isinstance(level_id, list):
-        level_id = [level_id]
-
-    if len(level_id) == 1:
-        o = fx[level].first()
-    else:
-        o = fx[level].all()
-        if not len(o):
-            o = None
-    if not o:
+    o = fx[level].all() if len(level_id) else []
+    if not len(o):
         raise NotFoundError(
             "No {} could be found with ids:\n{}"
-            .format(level, ",".join(level_id))
+            .format(level, ",".join([str(i) for i in level_id]))
         )
-    if len(level_id) == 1:
-        yield o.to_dict()
-    else:
-        for oo in o:
-            yield oo.to_dict()
+    for oo in o:
+        yield oo.to_dict()
 
 
 def get_item_comparison(*args, **kwargs):
@@ -159,11 +204,13 @@ def get_item_comparison(*args, **kwargs):
 
 def compare_many(items, comparisons, key='metrics'):
     """
-    Add a comparisons object to
+    Add a comparisons object to each item, ranking all of them at once.
     """
-    for item in items:
-        m = item.pop(key)
-        item['comparisons'] = compare(m, comparisons)
+    items = list(items)
+    metrics = [item.pop(key) for item in items]
+    ranked = ComparisonLookup(comparisons).rank_many(metrics)
+    for item, comparison in zip(items, ranked):
+        item['comparisons'] = comparison
         yield item
 
 
@@ -172,19 +219,7 @@ def compare(metrics, comparisons):
     Return percentile rankings given a a dictionary
     of metrics and comparisons.
     """
-    output = defaultdict(lambda: defaultdict(dict))
-    for metric, comparison in gen_comparisons_lookup(comparisons):
-        value = metrics.get(metric, None)
-        if comparison['min'] == 0 and comparison['max'] == 0:
-            percentile = None
-        else:
-            percentile = compare_one(value, comparison)
-        d = {metric: percentile}
-        if not comparison['facet_value']:
-            output[comparison['facet']].update(d)
-        else:
-            output[comparison['facet']][comparison['facet_value']].update(d)
-    return output
+    return ComparisonLookup(comparisons).rank_many([metrics])[0]
 
 
 def gen_comparisons_lookup(comparisons):
@@ -205,27 +240,114 @@ def gen_comparisons_lookup(comparisons):
                     yield value['metric'], value
 
 
-def compare_one(value, comparison):
-    """
-    Given a value and comparison object, return comparison stats.
-    """
-    # lookup all percentiles.
-    percentiles = {
-        ('per_50' if k == 'median' else k): float(v)
-        for k, v in comparison.items()
-        if k.startswith('per_') or k.startswith('median')
-    }
-    percentiles = dict(sorted(percentiles.items(), key=itemgetter(1)))
-    idx, per_value = find_nearest(percentiles.values(), value)
-    per = float(percentiles.keys()[idx].replace('per_', '').replace('_5', '.5'))
-    return per
+class ComparisonLookup(object):
+
+    """
+    Comparisons compiled once into sorted arrays so that
+    any number of items can be ranked with `searchsorted`.
+    """
+
+    def __init__(self, comparisons):
+        self.entries = []
+        for metric, comparison in gen_comparisons_lookup(comparisons):
+            if comparison['min'] == 0 and comparison['max'] == 0:
+                compiled = None
+            else:
+                compiled = compile_percentiles(comparison)
+            self.entries.append((comparison['facet'],
+                                 comparison['facet_value'],
+                                 metric, compiled))
+
+    def rank_many(self, metrics):
+        """
+        Rank a list of metrics dictionaries.
+        """
+        outputs = [defaultdict(lambda: defaultdict(dict)) for m in metrics]
+        values = {}
+        for facet, facet_value, metric, compiled in self.entries:
+            if compiled is None:
+                pers = [None] * len(metrics)
+            else:
+                if metric not in values:
+                    values[metric] = np.array(
+                        [parse_value(m.get(metric, None)) for m in metrics],
+                        dtype=float)
+                pers = rank(compiled, values[metric])
+            for output, per in zip(outputs, pers):
+                d = {metric: per}
+                if not facet_value:
+                    output[facet].update(d)
+                else:
+                    output[facet][facet_value].update(d)
+        return outputs
+
+
+def parse_value(value):
+    """
+    A metric value as a float, NaN if it's missing.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_percentile(key):
+    return float(key.replace('per_', '').replace('_5', '.5'))
+
+
+def compile_percentiles(comparison):
+    """
+    Compile a comparison's percentiles into sorted, distinct values
+    along with the percentile each should rank as. Where values tie,
+    the percentile is the one which came first in the order the old
+    linear scan visited them, so rankings are unchanged.
+    """
+    try:
+        percentiles = {
+            ('per_50' if k == 'median' else k): float(v)
+            for k, v in comparison.items()
+            if k.startswith('per_') or k.startswith('median')
+        }
+    except (TypeError, ValueError):
+        return None
+    if not len(percentiles):
+        return None
+    order = dict(sorted(percentiles.items(), key=itemgetter(1))).keys()
+    first = {}
+    for pos, k in enumerate(order):
+        first.setdefault(percentiles[k], (pos, k))
+    values = sorted(first.keys())
+    return (np.array(values, dtype=float),
+            np.array([first[v][0] for v in values]),
+            [parse_percentile(first[v][1]) for v in values])
+
+
+def rank(compiled, values):
+    """
+    The percentile nearest to each value, None for missing values.
+    """
+    percentiles, order, pers = compiled
+    last = len(percentiles) - 1
+    idx = np.searchsorted(percentiles, values)
+    lo = np.clip(idx - 1, 0, last)
+    hi = np.clip(idx, 0, last)
+    d_lo = np.abs(percentiles[lo] - values)
+    d_hi = np.abs(percentiles[hi] - values)
+    nearest = np.where(
+        (d_hi < d_lo) | ((d_hi == d_lo) & (order[hi] < order[lo])), hi, lo)
+    missing = np.isnan(values)
+    return [None if m else pers[i] for i, m in zip(nearest, missing)]
 
 
-def find_nearest(array, value):
+def compare_one(value, comparison):
     """
-    Find the nearest value in an array.
+    Given a value and comparison object, return comparison stats.
     """
-    return min(enumerate(array), key=lambda x: abs(x[1]-value))
+    compiled = compile_percentiles(comparison)
+    if compiled is None:
+        return None
+    return rank(compiled, np.array([parse_value(value)], dtype=float))[0]
 
 
 @bp.route('/api/v1/<level>/<level_id>/comparisons', methods=['GET'])
@@ -235,7 +357,7 @@ def make_item_comparisons(user, org, level, level_id):
     """
     Get all comparisons by level.
     """
-    resp = get_item_comparison(org.id, org_id=org.id, level=level,
+    resp = get_item_comparison(org.id, org=org, org_id=org.id, level=level,
                                level_id=level_id, type='all', key='metrics')
     return jsonify(list(resp))
 
@@ -247,7 +369,7 @@ def make_item_comparison(user, org, level, level_id, type):
     """
     Get all comparisons by level.
     """
-    resp = get_item_comparison(org.id, org_id=org.id, level=level,
+    resp = get_item_comparison(org.id, org=org, org_id=org.id, level=level,
                                level_id=level_id, type=type, key='metrics')
     return jsonify(list(resp))
 
@@ -259,7 +381,7 @@ def get_comparisons(user, org, level):
     """
     Get all comparisons by level.
     """
-    cr = get_comparison(org.id, level=level, type='all')
+    cr = get_comparison(org.id, org=org, level=level, type='all')
     return response_from_cache(cr)
 
 
@@ -270,8 +392,8 @@ def refresh_comparisons(user, org, level):
     """
     Refresh content comparisons
     """
-    refresh_comparison(org.id, level=level, type='all')
-    return jsonify({'success': True})
+    cr = refresh_comparison(org.id, org=org, level=level, type='all')
+    return response_from_refresh(cr)
 
 
 @bp.route('/api/v1/<level>/comparisons/<type>', methods=['GET'])
@@ -281,7 +403,7 @@ def get_one_comparison(user, org, type, level):
     """
     Get one content comparison.
     """
-    cr = get_comparison(org.id, level=level, type=type)
+    cr = get_comparison(org.id, org=org, level=level, type=type)
     return response_from_cache(cr)
 
 
@@ -292,5 +414,5 @@ def refresh_one_comparison(user, org, type, level):
     """
     Refresh one content comparison.
     """
-    refresh_comparison(org.id, level=level, type=type)
-    return jsonify({'success': True})
+    cr = refresh_comparison(org.id, org=org, level=level, type=type)
+    return response_from_refresh(cr)
@@ -10,6 +10,7 @@ from newslynx.views.util import request_data, url_for_job_status
 from newslynx.tasks import load
 from newslynx.tasks import rollup_metric
 from newslynx.tasks import compute_metric
+from newslynx.tasks import sketch_metric
 from newslynx.views.util import arg_int
 
 
@@ -96,11 +97,15 @@ def refresh_content_summary(user, org):
     # how many hours since last update should we refresh?
     since = arg_int('since', 24)
 
-    # rollup timeseries => summary
-    rollup_metric.content_summary(org, [], since)
+    # rollup timeseries => summary for dirty content items
+    ids = rollup_metric.content_summary(org, [], since)
 
-    # compute metrics
-    compute_metric.content_summary(org, [])
+    # compute metrics for the same items
+    if len(ids):
+        compute_metric.content_summary(org, ids)
+
+        # move them between comparison sketches
+        sketch_metric.update(org, ids)
 
     # simple response
     return jsonify({'success': True})
@@ -120,5 +125,6 @@ def refresh_one_content_summary(user, org, content_item_id):
 
     # compute metrics
     compute_metric.content_summary(org, ids=[content_item_id])
+    sketch_metric.update(org, [int(content_item_id)])
 
     return jsonify({'success': True})
@@ -305,7 +305,7 @@ def delete_metric(user, org, name_id):
 
     # format for deleting metrics from metric store.
     cmd_fmt = "UPDATE {table} " + \
-              "SET metrics=json_del_keys(metrics, '{name}'::text);"\
+              "SET metrics = metrics - '{name}'::text;"\
               .format(name=m.name)
 
     # delete metric from metric stores.
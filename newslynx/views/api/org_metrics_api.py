@@ -2,6 +2,7 @@ import logging
 
 from flask import Blueprint
 
+from newslynx.core import settings
 from newslynx.views.decorators import load_user
 from newslynx.exc import NotFoundError, ForbiddenError
 from newslynx.models import Org
@@ -11,6 +12,7 @@ from newslynx.tasks import load
 from newslynx.tasks.query_metric import QueryOrgMetricTimeseries
 from newslynx.tasks import rollup_metric
 from newslynx.tasks import compute_metric
+from newslynx.tasks import compact_metric
 from newslynx.models.util import fetch_by_id_or_field
 from newslynx.views.util import (
     localize, url_for_job_status,  arg_int, request_ts)
@@ -187,6 +189,33 @@ def refresh_org_timeseries(user, org_id_slug):
     return jsonify({'success': True})
 
 
+@bp.route('/api/v1/orgs/<int:org_id_slug>/timeseries/compact', methods=['PUT'])
+@load_user
+def compact_org_timeseries(user, org_id_slug):
+    """
+    Downsample old hourly content + org timeseries metrics to daily points.
+    """
+    # fetch org
+    org = fetch_by_id_or_field(Org, 'slug', org_id_slug)
+
+    # if it still doesn't exist, raise an error.
+    if not org:
+        raise NotFoundError(
+            'This Org does not exist.')
+
+    # ensure the active user can edit this Org
+    if user.id not in org.user_ids:
+        raise ForbiddenError(
+            'You are not allowed to access this Org')
+
+    # how many days of hourly points should we keep?
+    days = arg_int('days', settings.METRICS_COMPACT_DAYS)
+
+    ret = compact_metric.compact(org, days)
+    ret['success'] = True
+    return jsonify(ret)
+
+
 @bp.route('/api/v1/orgs/<int:org_id_slug>/summary', methods=['PUT'])
 @load_user
 def refresh_org_summary(user, org_id_slug):
@@ -0,0 +1,60 @@
+import unittest
+
+from newslynx.lib import author
+from newslynx.lib.common import make_soup, parse_page
+
+PAGE = """
+<html>
+<head>
+  <meta name="author" content="Brian Abelson">
+  <meta property="author" content="Michael Keller and Stijn Debrouwere">
+  <link rel="author" href="/people/brian-abelson">
+</head>
+<body>
+  <div class="byline story-meta">By <a rel="author" href="#">Joaquin Sapien</a></div>
+  <article>
+    <span class="byline-author">Ariane Wu</span>
+    <p id="byline">Photo by Getty Images</p>
+    <h2 itemprop="author">Ariane Wu &amp; Lisa Song</h2>
+    <div class="post-byline byl">Lisa Song</div>
+  </article>
+</body>
+</html>
+"""
+
+
+def find_all_matches(soup, tags, attrs, vals):
+    matches = []
+    for tag in tags:
+        for attr in attrs:
+            for val in vals:
+                matches.extend(soup.find_all(tag, {attr: val}))
+    return matches
+
+
+class TestAuthorExtraction(unittest.TestCase):
+
+    def test_matches_find_all(self):
+        """One pass finds what find_all does, in the same order"""
+        for soup in [make_soup(PAGE), parse_page(PAGE)]:
+            for tags in [author.PESSIMISTIC_TAGS, author.OPTIMISTIC_TAGS]:
+                matcher = author.compile_matcher(
+                    tags, author.TAG_ATTRS, author.TAG_VALS)
+                expected = find_all_matches(
+                    soup, tags, author.TAG_ATTRS, author.TAG_VALS)
+                found = author.find_matches(soup, matcher)
+                self.assertEqual([id(el) for el in found],
+                                 [id(el) for el in expected])
+
+    def test_extract(self):
+        soup = parse_page(PAGE)
+        self.assertEqual(
+            set(author.extract(soup)),
+            set(['BRIAN ABELSON', 'MICHAEL KELLER', 'STIJN DEBROUWERE']))
+        authors = author.extract(soup.find('article'),
+                                 tags=author.OPTIMISTIC_TAGS)
+        self.assertEqual(set(authors), set(['ARIANE WU', 'LISA SONG']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+
+from newslynx.core import db
+from newslynx.models import Org
+from newslynx.lib import dates
+from newslynx.lib.serialize import obj_to_json
+from newslynx.tasks import compact_metric
+from newslynx.tasks.compact_metric import (
+    ContentMetricTimeseriesCompaction, OrgMetricTimeseriesCompaction)
+from newslynx.tasks.query_metric import QueryContentMetricTimeseries
+
+# points are made on a day long before any real data, and compacted
+# with a cutoff of the day after, so nothing else is touched.
+DAY = datetime(2001, 1, 1, tzinfo=pytz.utc)
+CUTOFF = datetime(2001, 1, 2, tzinfo=pytz.utc)
+
+METRICS = {
+    'test_pageviews': {
+        'name': 'test_pageviews', 'type': 'count', 'agg': 'sum'},
+    'test_shares': {
+        'name': 'test_shares', 'type': 'cumulative', 'agg': 'max'},
+    'test_pageviews_by_domain': {
+        'name': 'test_pageviews_by_domain', 'type': 'count', 'agg': 'sum',
+        'faceted': True},
+    'test_shares_by_site': {
+        'name': 'test_shares_by_site', 'type': 'cumulative', 'agg': 'max',
+        'faceted': True}
+}
+
+POINTS = [
+    (0, {'test_pageviews': 1, 'test_shares': 10,
+         'test_pageviews_by_domain': [{'facet': 'a.com', 'value': 1}],
+         'test_shares_by_site': [{'facet': 'twitter', 'value': 5}]}),
+    (1, {'test_pageviews': 2, 'test_shares': 20,
+         'test_pageviews_by_domain': [{'facet': 'a.com', 'value': 2},
+                                      {'facet': 'b.com', 'value': 4}],
+         'test_shares_by_site': [{'facet': 'twitter', 'value': 7}]}),
+    (2, {'test_pageviews': 3})
+]
+
+
+class CompactionTests(object):
+
+    """
+    Shared tests for each store. Nothing is committed.
+    """
+    compaction = None
+
+    def setUp(self):
+        self.org = Org.query.get(1)
+        for hour, metrics in POINTS:
+            self.insert(DAY.replace(hour=hour), metrics)
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+
+    def compact(self):
+        c = self.compaction(self.org, days=(dates.now() - CUTOFF).days)
+        c.metrics = METRICS
+        return c.execute()
+
+    def points(self):
+        q = "SELECT datetime, metrics FROM {} WHERE {} AND datetime < :cutoff"\
+            .format(self.compaction.table, self.where)
+        return db.session.execute(q, self.params(cutoff=CUTOFF)).fetchall()
+
+    def test_compact(self):
+        assert(self.compact() == 1)
+        points = self.points()
+        assert(len(points) == 1)
+        dt, metrics = points[0]
+        assert(dt == DAY)
+
+        # counts sum, cumulative metrics take the day's last value.
+        assert(metrics['test_pageviews'] == 6)
+        assert(metrics['test_shares'] == 20)
+
+        # facets merge the same way.
+        facets = {f['facet']: f['value']
+                  for f in metrics['test_pageviews_by_domain']}
+        assert(facets == {'a.com': 3, 'b.com': 4})
+        assert(metrics['test_shares_by_site'] ==
+               [{'facet': 'twitter', 'value': 7}])
+
+    def test_compact_twice(self):
+        self.compact()
+        assert(self.compact() == 0)
+        assert(len(self.points()) == 1)
+
+
+class TestContentMetricTimeseriesCompaction(CompactionTests, unittest.TestCase):
+    compaction = ContentMetricTimeseriesCompaction
+    where = "org_id = :org_id AND content_item_id = :content_item_id"
+
+    def params(self, **kw):
+        kw.update(org_id=self.org.id,
+                  content_item_id=self.org.content_item_ids[0])
+        return kw
+
+    def insert(self, dt, metrics):
+        db.session.execute(
+            """INSERT INTO content_metric_timeseries
+               (org_id, content_item_id, datetime, metrics, updated)
+               VALUES (:org_id, :content_item_id, :datetime,
+                       CAST(:metrics AS jsonb), current_timestamp)""",
+            self.params(datetime=dt, metrics=obj_to_json(metrics)))
+
+
+class TestOrgMetricTimeseriesCompaction(CompactionTests, unittest.TestCase):
+    compaction = OrgMetricTimeseriesCompaction
+    where = "org_id = :org_id"
+
+    def params(self, **kw):
+        kw.update(org_id=self.org.id)
+        return kw
+
+    def insert(self, dt, metrics):
+        db.session.execute(
+            """INSERT INTO org_metric_timeseries
+               (org_id, datetime, metrics, updated)
+               VALUES (:org_id, :datetime,
+                       CAST(:metrics AS jsonb), current_timestamp)""",
+            self.params(datetime=dt, metrics=obj_to_json(metrics)))
+
+
+class TestHourlyQueryPastHorizon(unittest.TestCase):
+
+    """
+    Hourly queries read days before the compaction horizon by day.
+    """
+
+    def setUp(self):
+        self.org = Org.query.get(1)
+        self.cid = self.org.content_item_ids[0]
+        self.recent = dates.floor(dates.now(), unit='hour') - timedelta(hours=3)
+        points = [(DAY.replace(hour=h), {'test_pageviews': h + 1})
+                  for h in xrange(3)]
+        points += [(self.recent + timedelta(hours=h), {'test_pageviews': 10})
+                   for h in xrange(2)]
+        for dt, metrics in points:
+            db.session.execute(
+                """INSERT INTO content_metric_timeseries
+                   (org_id, content_item_id, datetime, metrics, updated)
+                   VALUES (:org_id, :content_item_id, :datetime,
+                           CAST(:metrics AS jsonb), current_timestamp)""",
+                {'org_id': self.org.id, 'content_item_id': self.cid,
+                 'datetime': dt, 'metrics': obj_to_json(metrics)})
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+
+    def query(self, **kw):
+        q = QueryContentMetricTimeseries(
+            self.org, [self.cid], unit='hour', after=DAY, **kw)
+        q.metrics = {'test_pageviews': METRICS['test_pageviews']}
+        q.computed_metrics = {}
+        q.compute = False
+        return [dict(r) for r in q.execute()]
+
+    def test_sparse(self):
+        rows = self.query()
+        old = [r for r in rows if r['datetime'] < CUTOFF]
+        assert(len(old) == 1)
+        assert(old[0]['datetime'] == DAY)
+        assert(old[0]['test_pageviews'] == 6)
+        hours = [self.recent, self.recent + timedelta(hours=1)]
+        recent = [r for r in rows if r['datetime'] in hours]
+        assert([r['test_pageviews'] for r in recent] == [10, 10])
+
+    def test_non_sparse(self):
+        rows = self.query(sparse=False)
+        old = [r for r in rows if r['datetime'] < CUTOFF]
+        assert([r['datetime'] for r in old] == [DAY])
+        horizon = compact_metric.horizon()
+        for r in rows:
+            if r['datetime'] < horizon:
+                assert(r['datetime'] == dates.floor(r['datetime'], unit='day'))
+
+    def test_after_horizon(self):
+        q = QueryContentMetricTimeseries(
+            self.org, [self.cid], unit='hour', after=self.recent)
+        assert(q.horizon is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
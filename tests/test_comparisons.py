@@ -0,0 +1,157 @@
+import json
+import random
+import unittest
+from collections import defaultdict
+from copy import deepcopy
+from operator import itemgetter
+
+from newslynx.client import API
+from newslynx.core import settings
+from newslynx.lib.serialize import obj_to_json
+from newslynx.models import ContentMetricSummary
+from newslynx.tasks.compare_metric import percentile_col
+from newslynx.views.api.comparisons_api import (
+    compare, compare_many, gen_comparisons_lookup)
+
+METRICS = ['pageviews', 'twitter_shares', 'time_on_page']
+
+
+# the linear scan comparisons were ranked with before `ComparisonLookup`.
+
+def find_nearest(array, value):
+    return min(enumerate(array), key=lambda x: abs(x[1] - value))
+
+
+def old_compare_one(value, comparison):
+    percentiles = {
+        ('per_50' if k == 'median' else k): float(v)
+        for k, v in comparison.items()
+        if k.startswith('per_') or k.startswith('median')
+    }
+    percentiles = dict(sorted(percentiles.items(), key=itemgetter(1)))
+    idx, per_value = find_nearest(percentiles.values(), value)
+    return float(percentiles.keys()[idx].replace('per_', '').replace('_5', '.5'))
+
+
+def old_compare(metrics, comparisons):
+    """
+    The old rankings, except that missing values rank as None
+    rather than raising a TypeError.
+    """
+    output = defaultdict(lambda: defaultdict(dict))
+    for metric, comparison in gen_comparisons_lookup(comparisons):
+        value = metrics.get(metric, None)
+        if comparison['min'] == 0 and comparison['max'] == 0:
+            percentile = None
+        elif value is None:
+            percentile = None
+        else:
+            percentile = old_compare_one(value, comparison)
+        d = {metric: percentile}
+        if not comparison['facet_value']:
+            output[comparison['facet']].update(d)
+        else:
+            output[comparison['facet']][comparison['facet_value']].update(d)
+    return output
+
+
+def make_comparison(metric, values):
+    """
+    A comparison with the given percentile values, in order.
+    """
+    c = {'metric': metric, 'min': min(values), 'max': max(values),
+         'mean': sum(values) / len(values)}
+    pers = list(settings.COMPARISON_PERCENTILES)
+    for per, v in zip(pers, values):
+        c[percentile_col(per)] = v
+    c['median'] = values[len(pers)]
+    return c
+
+
+def make_comparisons(values):
+    return {
+        'all': [make_comparison(m, values) for m in METRICS],
+        'types': {
+            'article': [make_comparison(m, values) for m in METRICS],
+            'video': [make_comparison(m, sorted(values)[::-1])
+                      for m in METRICS[:1]]
+        }
+    }
+
+
+class TestComparisonRanking(unittest.TestCase):
+
+    """
+    Rankings are the same as the old linear scan.
+    """
+
+    def check(self, comparisons, items):
+        expected = [old_compare(m, deepcopy(comparisons)) for m in items]
+        ranked = [i['comparisons'] for i in compare_many(
+            [{'metrics': m} for m in items], deepcopy(comparisons))]
+        assert(ranked == expected)
+        for m, e in zip(items, expected):
+            assert(compare(m, deepcopy(comparisons)) == e)
+
+    def test_ties(self):
+        values = [0, 0, 1, 1, 1, 4, 4, 10, 10, 10, 20, 20, 4]
+        items = [{m: v for m in METRICS}
+                 for v in [0, 0.5, 1, 2.5, 4, 7, 10, 15, 20]]
+        self.check(make_comparisons(values), items)
+
+    def test_outside_range(self):
+        values = [5, 6, 7, 8, 9, 10, 12, 14, 16, 18, 20, 22, 11]
+        items = [{m: v for m in METRICS}
+                 for v in [-100, -1, 0, 4.999, 22.001, 23, 1e9]]
+        self.check(make_comparisons(values), items)
+
+    def test_missing_values(self):
+        values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 6.5]
+        items = [{}, {'pageviews': None}, {'pageviews': 3},
+                 {'twitter_shares': 100, 'time_on_page': None}]
+        comparisons = make_comparisons(values)
+        self.check(comparisons, items)
+        c = compare({}, deepcopy(comparisons))
+        assert(c['all'] == {m: None for m in METRICS})
+
+    def test_all_zero(self):
+        values = [0] * 13
+        items = [{m: 0 for m in METRICS}, {m: 5 for m in METRICS}]
+        self.check(make_comparisons(values), items)
+
+    def test_random(self):
+        random.seed(3)
+        for i in xrange(200):
+            values = sorted([random.choice(range(8)) * random.choice([1, 2.5])
+                             for j in xrange(13)])
+            items = [{m: random.choice([None, random.uniform(-5, 30),
+                                        random.choice(values)])
+                      for m in METRICS} for j in xrange(10)]
+            self.check(make_comparisons(values), items)
+
+
+class TestComparisonRoutes(unittest.TestCase):
+    org = 1
+    api = API(org=1)
+
+    def test_multiple_ids(self):
+        summaries = ContentMetricSummary.query\
+            .filter_by(org_id=self.org)\
+            .limit(3)\
+            .all()
+        metrics = {s.content_item_id: s.metrics for s in summaries}
+        ids = sorted(metrics.keys())
+        comparisons = self.api.content.list_comparisons()
+        items = self.api.content.make_comparisons(
+            ",".join([str(i) for i in ids]))
+        assert(sorted([i['content_item_id'] for i in items]) == ids)
+        for item in items:
+            expected = old_compare(metrics[item['content_item_id']],
+                                   deepcopy(comparisons))
+            assert(item['comparisons'] == json.loads(obj_to_json(expected)))
+            single = self.api.content.make_comparisons(item['content_item_id'])
+            assert(single == [item])
+
+
+if __name__ == '__main__':
+    unittest.main()
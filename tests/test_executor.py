@@ -0,0 +1,53 @@
+import os
+import time
+import unittest
+
+from newslynx.exc import ExecutorError, ExecutorTimeout
+from newslynx.lib.executor import Executor
+
+
+def square(x, pause=0):
+    time.sleep(pause)
+    return os.getpid(), x * x
+
+
+def fail():
+    raise ValueError('nope')
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = Executor(workers=2, timeout=1, max_tasks=3)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_submit(self):
+        """Tasks run in worker processes, which are replaced after max_tasks"""
+        pids = set()
+        for i in xrange(10):
+            pid, res = self.executor.submit(square, i)
+            self.assertEqual(res, i * i)
+            pids.add(pid)
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(len(pids), 4)
+
+    def test_error(self):
+        with self.assertRaises(ExecutorError) as cm:
+            self.executor.submit(fail)
+        self.assertIn('ValueError', cm.exception.message)
+
+    def test_timeout(self):
+        """A task past its timeout is killed, and its process replaced"""
+        self.assertRaises(
+            ExecutorTimeout, self.executor.submit, square, 1, pause=5)
+        self.assertEqual(self.executor.submit(square, 3)[1], 9)
+
+    def test_in_process(self):
+        executor = Executor(workers=0)
+        self.assertEqual(executor.submit(square, 2), (os.getpid(), 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from newslynx.core import db
+from newslynx.models import Org
+from newslynx.constants import IMPACT_TAG_CATEGORIES, IMPACT_TAG_LEVELS
+from newslynx.tasks import rollup_metric
+
+EVENT_COUNTS_QUERY = """
+    SELECT content_items_events.content_item_id, count(distinct(events.id))
+    FROM events
+    JOIN content_items_events ON events.id = content_items_events.event_id
+    JOIN events_tags ON events.id = events_tags.event_id
+    JOIN tags ON events_tags.tag_id = tags.id
+    WHERE events.org_id = :org_id AND
+          events.status = 'approved' AND
+          (tags.category IS NOT NULL OR tags.level IS NOT NULL)
+    GROUP BY 1
+"""
+
+SUMMARY_QUERY = """
+    SELECT content_item_id, metrics
+    FROM content_metric_summary
+    WHERE org_id = :org_id
+"""
+
+
+class TestContentSummaryFromEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.org = Org.query.get(1)
+        self.metrics = ['total_events', 'total_event_tags']
+        self.metrics += ["{}_level_events".format(l) for l in IMPACT_TAG_LEVELS]
+        self.metrics += ["{}_category_events".format(c)
+                         for c in IMPACT_TAG_CATEGORIES]
+
+    def tearDown(self):
+        db.session.remove()
+
+    def check(self, content_item_ids):
+        """
+        Every item has every event metric, counting its approved events
+        or zero if it has none.
+        """
+        params = {'org_id': self.org.id}
+        expected = dict(db.session.execute(EVENT_COUNTS_QUERY, params).fetchall())
+        summaries = dict(db.session.execute(SUMMARY_QUERY, params).fetchall())
+        for cid in content_item_ids:
+            metrics = summaries[cid]
+            for m in self.metrics:
+                assert(m in metrics)
+            assert(metrics['total_events'] == expected.get(cid, 0))
+
+    def test_with_ids(self):
+        content_item_ids = self.org.content_item_ids[:5]
+        assert(rollup_metric.content_summary_from_events(
+            self.org, content_item_ids, dirty=False))
+        self.check(content_item_ids)
+
+    def test_without_ids(self):
+        assert(rollup_metric.content_summary_from_events(
+            self.org, dirty=False))
+        self.check(self.org.content_item_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from datetime import datetime
+
+from newslynx.lib import serialize
+
+
+class TestCacheCodecs(unittest.TestCase):
+
+    obj = {
+        'title': u'Caf\xe9',
+        'body': '<p>Some body text.</p>' * 200,
+        'links': ['http://example.com/{}'.format(i) for i in xrange(50)],
+        'created': datetime(2015, 6, 1, 12, 30)
+    }
+
+    def test_roundtrip(self):
+        """Every codec reads back what it wrote, zipped or not"""
+        for codec in serialize.CACHE_CODECS.keys():
+            for compress_above in [None, 0, 1024, 10 ** 9]:
+                s = serialize.obj_to_cache(self.obj, codec, compress_above)
+                self.assertEqual(serialize.cache_to_obj(s), self.obj)
+
+    def test_compress_above(self):
+        """Values are only zipped above the threshold"""
+        s = serialize.obj_to_cache(self.obj, 'binpickle', 1024)
+        self.assertEqual(s[2], serialize.CACHE_COMPRESSED)
+        s = serialize.obj_to_cache({'a': 1}, 'binpickle', 1024)
+        self.assertEqual(s[2], serialize.CACHE_UNCOMPRESSED)
+
+    def test_reads_bare_pickles(self):
+        """Values cached before codecs were added still load"""
+        s = serialize.obj_to_pickle(self.obj)
+        self.assertEqual(serialize.cache_to_obj(s), self.obj)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, serialize.obj_to_cache, self.obj, 'xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import random
+import unittest
+
+import numpy
+
+from newslynx.lib.sketch import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    accuracy = 0.01
+    percentiles = [2.5, 5.0, 10.0, 20.0, 30.0, 40.0, 50.0,
+                   60.0, 70.0, 80.0, 90.0, 95.0, 97.5]
+
+    def sketch(self, values):
+        s = QuantileSketch(self.accuracy)
+        for v in values:
+            s.add(v)
+        return s
+
+    def assert_close(self, estimate, exact):
+        assert(abs(estimate - exact) <= self.accuracy * abs(exact) + 1e-9)
+
+    def test_percentiles_within_relative_accuracy(self):
+        """Sketched percentiles are within `accuracy` of numpy.percentile"""
+        random.seed(1)
+        values = [random.paretovariate(1.2) * 100 for _ in xrange(5000)]
+        s = self.sketch(values)
+        for per in self.percentiles:
+            self.assert_close(s.quantile(per / 100.0),
+                              numpy.percentile(values, per))
+        self.assert_close(s.min, min(values))
+        self.assert_close(s.max, max(values))
+        self.assert_close(s.mean, numpy.mean(values))
+
+    def test_remove(self):
+        """Removing values is the same as never adding them"""
+        random.seed(2)
+        keep = [random.randint(1, 10000) for _ in xrange(500)]
+        drop = [random.randint(1, 10000) for _ in xrange(500)]
+        s = self.sketch(keep + drop)
+        for v in drop:
+            s.remove(v)
+        self.assertEqual(s.counts, self.sketch(keep).counts)
+        self.assertEqual(s.count, len(keep))
+
+    def test_merge(self):
+        """Merged sketches equal a sketch of all values"""
+        a = range(1, 300)
+        b = range(200, 1000)
+        s = self.sketch(a).merge(self.sketch(b))
+        self.assertEqual(s.counts, self.sketch(a + b).counts)
+
+    def test_nonzero(self):
+        """Zeros are excluded from non-zero percentiles"""
+        s = self.sketch([0, 0, 0, 10, 20])
+        self.assertEqual(s.quantile(0.0), 0)
+        self.assert_close(s.quantile(0.0, nonzero=True), 10)
+        self.assertEqual(self.sketch([0, 0]).quantile(0.5, nonzero=True), None)
+
+    def test_fields_roundtrip(self):
+        """Sketches survive being flattened into a redis hash"""
+        s = self.sketch([-5, 0, 1, 2, 3, 1000])
+        fields = dict([(k, str(v)) for k, v in s.to_fields().items()])
+        s2 = QuantileSketch.from_fields(fields, self.accuracy)
+        self.assertEqual(s2.counts, s.counts)
+        self.assertEqual(s2.count, s.count)
+        self.assertEqual(s2.quantile(0.5), s.quantile(0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
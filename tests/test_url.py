@@ -89,6 +89,35 @@ class TestURL(unittest.TestCase):
         for c in cases:
             assert(url.is_shortened(c))
 
+    def test_classify_many(self):
+        cases = [
+            'http://www.nytimes.com/2014/06/06/business/gm-ignition-switch-internal-recall-investigation-report.html',
+            'http://careers.nytimes.com/story/jobs',
+            'https://www.youtube.com/watch?v=fPxUIz5GHAE',
+            'http://static.nytimes.com/images/car.jpg',
+            'bit.ly/1kzIQWw',
+            '//www.revealnews.org/article/a-brief-history-of-the-modern-strawberry/',
+            'mailto:someone@nytimes.com'
+        ]
+        for c in url.classify_many(cases, 'nytimes.com'):
+            u = c['url']
+            assert(c['article'] == bool(url.is_article(u)))
+            assert(c['video'] == url.is_video(u))
+            assert(c['image'] == url.is_image(u))
+            assert(c['shortened'] == url.is_shortened(u))
+            assert(c['internal'] == url.is_internal(u, 'nytimes.com'))
+        flags = url.classify_many(cases)
+        assert([c['url'] for c in flags] == cases)
+        assert(flags[0]['article'] and not flags[1]['article'])
+        assert(flags[2]['video'] and flags[3]['image'] and flags[4]['shortened'])
+        assert(flags[0]['internal'] is None)
+
+    def test_apply_rule(self):
+        u = 'http://www.example.com/2015/06/story/index.html?utm_source=twitter#top'
+        out = url.apply_rule(u, 'https://www.example.com')
+        assert(out == 'https://www.example.com/2015/06/story/index.html?utm_source=twitter#top')
+        assert(url._tidy(out, url.KEEP_PARAMS) == 'https://www.example.com/2015/06/story')
+
     def test_unshorten_url(self):
 
         cases = [